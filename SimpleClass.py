@@ -44,7 +44,7 @@ public class PaymentValidationSoapAdapter {
                                                 MessageContext context) {
 
         WebServiceMessage response = context.getResponse();
-        paymentValidationPort.validateArrangementForPayment(request, response);
+        paymentValidationPort.validateArrangementForPayment(request, context.getRequest(), response);
          }
 
 }
@@ -58,9 +58,13 @@ public class PaymentValidationSoapAdapter {
 package com.rbs.bdd;
 
 import org.springframework.boot.SpringApplication;
+import org.springframework.boot.WebApplicationType;
 import org.springframework.boot.autoconfigure.SpringBootApplication;
+import org.springframework.boot.builder.SpringApplicationBuilder;
 import org.springframework.context.annotation.ComponentScan;
 
+import java.util.Arrays;
+
 
 /**
 
@@ -74,7 +78,20 @@ import org.springframework.context.annotation.ComponentScan;
 @SpringBootApplication(scanBasePackages = "com.rbs.bdd")
 public class EspSimulatorEngine {
 
+    private static final String BULK_INPUT_ARG = "--esp.simulator.bulk.input=";
+
+    /**
+     * Starts the SOAP simulator, or, with {@code --esp.simulator.bulk.input=<file>}, runs the offline bulk
+     * validation without a web server and exits.
+     *
+     * @param args command line arguments
+     */
     public static void main(String[] args) {
+        if (Arrays.stream(args).anyMatch(arg -> arg.startsWith(BULK_INPUT_ARG))) {
+            System.exit(SpringApplication.exit(new SpringApplicationBuilder(EspSimulatorEngine.class)
+                    .web(WebApplicationType.NONE)
+                    .run(args)));
+        }
         SpringApplication.run(EspSimulatorEngine.class, args);
     }
 }
@@ -89,15 +106,25 @@ package com.rbs.bdd.infrastructure.config;
 
 import com.rbs.bdd.application.exception.SchemaValidationException;
 import com.rbs.bdd.application.exception.XsdSchemaLoadingException;
+import com.rbs.bdd.application.service.PrecompiledSoapResponse;
+import com.rbs.bdd.common.ServiceConstants;
+import io.micrometer.core.instrument.FunctionCounter;
+import io.micrometer.core.instrument.Gauge;
+import io.micrometer.core.instrument.MeterRegistry;
+import org.springframework.beans.factory.ObjectProvider;
+import org.springframework.beans.factory.annotation.Value;
+import org.springframework.boot.web.servlet.FilterRegistrationBean;
 import org.springframework.boot.web.servlet.ServletRegistrationBean;
 import org.springframework.context.ApplicationContext;
 import org.springframework.context.annotation.Bean;
 import org.springframework.context.annotation.Configuration;
+import org.springframework.core.Ordered;
 import org.springframework.core.io.ClassPathResource;
 import org.springframework.ws.config.annotation.EnableWs;
 import org.springframework.ws.config.annotation.WsConfigurerAdapter;
 import org.springframework.ws.server.EndpointInterceptor;
 import org.springframework.ws.soap.server.endpoint.interceptor.PayloadValidatingInterceptor;
+import org.springframework.ws.soap.saaj.SaajSoapMessageFactory;
 import org.springframework.ws.transport.http.MessageDispatcherServlet;
 import org.springframework.ws.wsdl.wsdl11.DefaultWsdl11Definition;
 import org.springframework.xml.xsd.commons.CommonsXsdSchemaCollection;
@@ -112,6 +139,52 @@ import java.util.List;
 @EnableWs
 public class SoapWebServiceConfig extends WsConfigurerAdapter {
 
+    /** Eager SAAJ: every request and response is materialised as a full DOM (the historical behaviour). */
+    public static final String MESSAGE_FACTORY_SAAJ = "saaj";
+    /** Streaming: SOAP bodies are read with StAX and only parsed when accessed, see {@link LazySaajSoapMessageFactory}. */
+    public static final String MESSAGE_FACTORY_STREAMING = "streaming";
+
+    private final ObjectProvider<SchemaValidationCache> validationCache;
+
+    /**
+     * @param validationCache the opt-in schema validation cache, absent unless enabled
+     */
+    public SoapWebServiceConfig(ObjectProvider<SchemaValidationCache> validationCache) {
+        this.validationCache = validationCache;
+    }
+
+    /**
+     * Registers the SOAP message factory used by the {@link MessageDispatcherServlet}.
+     *
+     * @param mode {@value #MESSAGE_FACTORY_SAAJ} or {@value #MESSAGE_FACTORY_STREAMING}
+     * @return the message factory
+     */
+    @Bean(name = MessageDispatcherServlet.DEFAULT_MESSAGE_FACTORY_BEAN_NAME)
+    public SaajSoapMessageFactory messageFactory(
+            @Value("${esp.simulator.soap.message-factory:" + MESSAGE_FACTORY_SAAJ + "}") String mode) {
+        return createMessageFactory(mode);
+    }
+
+    /**
+     * Creates a message factory for the given mode; shared with the message factory benchmark.
+     *
+     * @param mode {@value #MESSAGE_FACTORY_SAAJ} or {@value #MESSAGE_FACTORY_STREAMING}
+     * @return the initialised message factory
+     * @throws IllegalArgumentException if the mode is unknown
+     */
+    public static SaajSoapMessageFactory createMessageFactory(String mode) {
+        SaajSoapMessageFactory factory;
+        if (MESSAGE_FACTORY_STREAMING.equalsIgnoreCase(mode)) {
+            factory = new LazySaajSoapMessageFactory();
+        } else if (MESSAGE_FACTORY_SAAJ.equalsIgnoreCase(mode)) {
+            factory = new SaajSoapMessageFactory();
+        } else {
+            throw new IllegalArgumentException("Unknown esp.simulator.soap.message-factory: " + mode);
+        }
+        factory.afterPropertiesSet();
+        return factory;
+    }
+
     /**
      * Registers the Spring WS {@link MessageDispatcherServlet}.
      *
@@ -126,6 +199,82 @@ public class SoapWebServiceConfig extends WsConfigurerAdapter {
         return new ServletRegistrationBean<>(servlet, "/ws/*");
     }
 
+    /**
+     * Holds the pre-compressed variants of the static WSDL/XSD documents, the precompiled SOAP faults and
+     * replayed responses, and the compression statistics. The faults are rendered through the configured
+     * message factory, so their variants match the bytes written to the wire.
+     *
+     * @param messageFactory   the SOAP message factory
+     * @param enabled          whether compression is enabled
+     * @param maxEntries       maximum number of cached document variants
+     * @param maxPrecompressed maximum number of pre-compressed SOAP bodies
+     * @return the variant cache
+     */
+    @Bean
+    public CompressedVariantCache compressedVariantCache(SaajSoapMessageFactory messageFactory,
+            @Value("${esp.simulator.compression.enabled:true}") boolean enabled,
+            @Value("${esp.simulator.compression.cache-size:64}") int maxEntries,
+            @Value("${esp.simulator.compression.precompressed-size:1024}") int maxPrecompressed) {
+        CompressedVariantCache cache = new CompressedVariantCache(maxEntries, maxPrecompressed);
+        if (enabled) {
+            for (String fault : List.of(ServiceConstants.OVERLOAD_FAULT_ENVELOPE,
+                    ServiceConstants.THROTTLED_FAULT_ENVELOPE)) {
+                cache.precompress(new PrecompiledSoapResponse(fault).render(messageFactory));
+            }
+        }
+        return cache;
+    }
+
+    /**
+     * Registers gzip/deflate negotiation and compressed request support on the {@code /ws} path.
+     *
+     * @param variants        the variant cache
+     * @param enabled         whether compression is enabled
+     * @param minSize         smallest response body worth compressing, in bytes
+     * @param maxInflatedSize largest accepted request body after inflating, in bytes
+     * @return FilterRegistrationBean for the compression filter
+     */
+    @Bean
+    public FilterRegistrationBean<SoapCompressionFilter> soapCompressionFilter(CompressedVariantCache variants,
+            @Value("${esp.simulator.compression.enabled:true}") boolean enabled,
+            @Value("${esp.simulator.compression.min-size:512}") int minSize,
+            @Value("${esp.simulator.compression.max-inflated-size:1048576}") int maxInflatedSize) {
+        FilterRegistrationBean<SoapCompressionFilter> registration =
+                new FilterRegistrationBean<>(new SoapCompressionFilter(variants, minSize, maxInflatedSize));
+        registration.addUrlPatterns("/ws/*");
+        registration.setEnabled(enabled);
+        registration.setOrder(Ordered.LOWEST_PRECEDENCE - 1);
+        return registration;
+    }
+
+    /**
+     * Serves the WSDL and XSD documents from pre-rendered, pre-compressed bytes with ETag support.
+     * Ordered inside the compression filter. Publishes {@code esp.wsdl.served}, {@code esp.wsdl.not.modified},
+     * {@code esp.wsdl.renders} and {@code esp.wsdl.variants}.
+     *
+     * @param variants    the variant cache
+     * @param registry    the metrics registry
+     * @param enabled     whether in-memory serving is enabled
+     * @param maxVariants maximum number of host/location variants kept
+     * @return FilterRegistrationBean for the WSDL document filter
+     */
+    @Bean
+    public FilterRegistrationBean<WsdlDocumentFilter> wsdlDocumentFilter(CompressedVariantCache variants,
+            MeterRegistry registry,
+            @Value("${esp.simulator.wsdl.cache.enabled:true}") boolean enabled,
+            @Value("${esp.simulator.wsdl.cache.max-variants:32}") int maxVariants) {
+        WsdlDocumentFilter filter = new WsdlDocumentFilter(variants, maxVariants);
+        FunctionCounter.builder("esp.wsdl.served", filter, WsdlDocumentFilter::served).register(registry);
+        FunctionCounter.builder("esp.wsdl.not.modified", filter, WsdlDocumentFilter::notModified).register(registry);
+        FunctionCounter.builder("esp.wsdl.renders", filter, WsdlDocumentFilter::renders).register(registry);
+        Gauge.builder("esp.wsdl.variants", filter, WsdlDocumentFilter::variants).register(registry);
+        FilterRegistrationBean<WsdlDocumentFilter> registration = new FilterRegistrationBean<>(filter);
+        registration.addUrlPatterns("/ws/*");
+        registration.setEnabled(enabled);
+        registration.setOrder(Ordered.LOWEST_PRECEDENCE);
+        return registration;
+    }
+
 
     /**
      * Adds a schema validating interceptor to validate all incoming requests.
@@ -134,7 +283,9 @@ public class SoapWebServiceConfig extends WsConfigurerAdapter {
      */
     @Override
     public void addInterceptors(List<EndpointInterceptor> interceptors) {
-        SchemaValidationInterceptor validatingInterceptor = new SchemaValidationInterceptor();
+        interceptors.add(new FlightRecorderInterceptor());
+        SchemaValidationInterceptor validatingInterceptor =
+                new SchemaValidationInterceptor(validationCache.getIfAvailable());
         validatingInterceptor.setValidateRequest(true);
         validatingInterceptor.setValidateResponse(false);
         try {
@@ -275,15 +426,25 @@ public class SoapLoggingInterceptor implements EndpointInterceptor {
 
 package com.rbs.bdd.infrastructure.config;
 import com.rbs.bdd.application.exception.SchemaValidationException;
-import jakarta.xml.soap.*;
+import com.rbs.bdd.infrastructure.profiling.SoapPipelineEvents;
+import com.rbs.bdd.infrastructure.profiling.SoapStageEvent;
 import org.slf4j.Logger;
 import org.slf4j.LoggerFactory;
-import org.springframework.ws.WebServiceMessage;
 import org.springframework.ws.context.MessageContext;
-import org.springframework.ws.soap.saaj.SaajSoapMessage;
+import org.springframework.ws.soap.SoapBody;
+import org.springframework.ws.soap.SoapFault;
+import org.springframework.ws.soap.SoapFaultException;
+import org.springframework.ws.soap.SoapMessage;
 import org.springframework.ws.soap.server.endpoint.interceptor.PayloadValidatingInterceptor;
+import org.xml.sax.SAXException;
 import org.xml.sax.SAXParseException;
 
+import javax.xml.transform.TransformerException;
+import javax.xml.transform.stream.StreamResult;
+import java.io.ByteArrayOutputStream;
+import java.io.IOException;
+import java.util.Locale;
+
 
 
 
@@ -293,12 +454,84 @@ import org.xml.sax.SAXParseException;
  * <p>
  * If schema validation fails, this interceptor returns a custom SOAP fault message
  * containing a simplified error description extracted from the first SAXParseException.
+ * With a {@link SchemaValidationCache}, outcomes of previously seen payloads are replayed
+ * instead of validating again.
  * </p>
  */
 public class SchemaValidationInterceptor extends PayloadValidatingInterceptor {
 
     private static final Logger logger = LoggerFactory.getLogger(SchemaValidationInterceptor.class);
 
+    private final SchemaValidationCache validationCache;
+    private final ThreadLocal<String> firstError = new ThreadLocal<>();
+
+    /**
+     * Creates an interceptor that validates every request.
+     */
+    public SchemaValidationInterceptor() {
+        this(null);
+    }
+
+    /**
+     * @param validationCache cache of validation outcomes, or null to validate every request
+     */
+    public SchemaValidationInterceptor(SchemaValidationCache validationCache) {
+        this.validationCache = validationCache;
+    }
+
+    /**
+     * Runs the XSD validation inside a {@code schemaValidation} flight recorder stage.
+     * The first validation error recorded for the cache is cleared on every path.
+     *
+     * @param messageContext the message context containing the request
+     * @param endpoint       the targeted endpoint
+     * @return true if the request is valid and processing should continue
+     */
+    @Override
+    public boolean handleRequest(MessageContext messageContext, Object endpoint)
+            throws IOException, SAXException, TransformerException {
+        SoapStageEvent stage = SoapPipelineEvents.beginStage(SoapPipelineEvents.STAGE_SCHEMA_VALIDATION);
+        String result = SoapPipelineEvents.OUTCOME_FAILED;
+        try {
+            boolean valid = validationCache != null
+                    ? validateCached(messageContext, endpoint)
+                    : super.handleRequest(messageContext, endpoint);
+            result = valid ? SoapPipelineEvents.OUTCOME_OK : SoapPipelineEvents.OUTCOME_INVALID;
+            return valid;
+        } finally {
+            firstError.remove();
+            SoapPipelineEvents.endStage(stage, result);
+        }
+    }
+
+    /**
+     * Looks the serialised payload up in the validation cache, validating and caching on a miss.
+     * A cached failure is reported through {@link #handleRequestValidationErrors} like a fresh one.
+     */
+    private boolean validateCached(MessageContext messageContext, Object endpoint)
+            throws IOException, SAXException, TransformerException {
+        ByteArrayOutputStream payload = new ByteArrayOutputStream(1024);
+        transform(getValidationRequestSource(messageContext.getRequest()), new StreamResult(payload));
+        byte[] bytes = payload.toByteArray();
+        SchemaValidationCache.maskTransactionIds(bytes, bytes.length);
+        SchemaValidationCache.Digest digest = validationCache.digest(bytes, bytes.length);
+
+        SchemaValidationCache.Outcome cached = validationCache.get(digest);
+        if (cached != null) {
+            if (cached.valid()) return true;
+            SAXParseException[] errors = cached.firstError() != null
+                    ? new SAXParseException[] {new SAXParseException(cached.firstError(), null)}
+                    : new SAXParseException[0];
+            return handleRequestValidationErrors(messageContext, errors);
+        }
+
+        long start = System.nanoTime();
+        boolean valid = super.handleRequest(messageContext, endpoint);
+        validationCache.put(digest, valid ? SchemaValidationCache.Outcome.VALID
+                : new SchemaValidationCache.Outcome(false, firstError.get()), System.nanoTime() - start);
+        return valid;
+    }
+
     /**
      * Overrides the default schema validation failure handling.
      * Constructs a SOAP fault message containing a custom error string instead of the default stack trace.
@@ -308,21 +541,16 @@ public class SchemaValidationInterceptor extends PayloadValidatingInterceptor {
     public boolean handleRequestValidationErrors(MessageContext messageContext, SAXParseException[] errors)
             throws SchemaValidationException {
 
+        firstError.set(errors.length > 0 ? errors[0].getMessage() : null);
         try {
-            WebServiceMessage response = messageContext.getResponse();
-            SaajSoapMessage saajMessage = (SaajSoapMessage) response;
-            SOAPBody body = saajMessage.getSaajMessage().getSOAPBody();
-            body.removeContents();
+            SoapBody body = ((SoapMessage) messageContext.getResponse()).getSoapBody();
 
             String errorMessage = "Schema validation failed: " + (errors.length > 0 ? errors[0].getMessage() : "Unknown error");
-            SOAPFactory soapFactory= SOAPFactory.newInstance();
-            Name faultCode= soapFactory.createName("Client","",SOAPConstants.URI_NS_SOAP_1_1_ENVELOPE);
-            SOAPFault fault= body.addFault(faultCode,errorMessage);
-            logger.debug("SOAPFault created: {}", fault.getFaultCode(), fault.getFaultString());
-            logger.debug("FaultCode: {}", faultCode);
+            SoapFault fault = body.addClientOrSenderFault(errorMessage, Locale.ENGLISH);
+            logger.debug("SOAPFault created: {} {}", fault.getFaultCode(), fault.getFaultStringOrReason());
             logger.warn("Custom schema validation error returned: {}", errorMessage);
 
-        } catch (SOAPException e) {
+        } catch (SoapFaultException e) {
             logger.error("Error constructing SOAP fault: {}", e.getMessage(), e);
             throw new SchemaValidationException("Failed to write SOAP fault due to schema validation error", e);
         }
@@ -434,11 +662,58 @@ public final class ServiceConstants {
 
     // XML/XPath constants
     public static final String RESPONSE_XML_PATH = "static-response/response1.xml";
+    public static final String ERROR_RESPONSE_XML_PATH = "static-response/error-response.xml";
+
+    // Routing rules
+    public static final String ROUTING_RULES_PATH = "rules/account-routing.rules";
+
+    // Admission control
+    public static final String OVERLOAD_FAULT_ENVELOPE =
+            "<soapenv:Envelope xmlns:soapenv=\"http://schemas.xmlsoap.org/soap/envelope/\">"
+            + "<soapenv:Body><soapenv:Fault>"
+            + "<faultcode>soapenv:Server</faultcode>"
+            + "<faultstring>Service Unavailable: ESP simulator is overloaded, retry later</faultstring>"
+            + "</soapenv:Fault></soapenv:Body></soapenv:Envelope>";
+
+    public static final String THROTTLED_FAULT_ENVELOPE =
+            "<soapenv:Envelope xmlns:soapenv=\"http://schemas.xmlsoap.org/soap/envelope/\">"
+            + "<soapenv:Body><soapenv:Fault>"
+            + "<faultcode>soapenv:Server</faultcode>"
+            + "<faultstring>Request Throttled</faultstring>"
+            + "<detail><exception>"
+            + "<responseId><systemId>ESP</systemId></responseId>"
+            + "<serviceName>ArrValidationForPayment</serviceName>"
+            + "<operationName>validateArrangementForPayment</operationName>"
+            + "<cmdStatus>Failed</cmdStatus>"
+            + "<cmdNotifications><returnCode>ERR013</returnCode><category>Error</category>"
+            + "<description>Request Throttled. The consumer has exceeded the permitted request rate for this service operation.</description>"
+            + "</cmdNotifications>"
+            + "</exception></detail>"
+            + "</soapenv:Fault></soapenv:Body></soapenv:Envelope>";
+
+    // Modulus checking
+    public static final String MODULUS_WEIGHTS_PATH = "modulus/valacdos.txt";
+
+    // Sort code directory
+    public static final String SORT_CODE_DIRECTORY_PATH = "classpath:sortcode/sortcode-directory.csv";
+    public static final String SORT_CODE_FAILURES_PATH = "classpath:sortcode/failures.rules";
 
     public static final String XPATH_TRANSACTION_ID = "//*[local-name()='transactionId']";
     public static final String XPATH_ACCOUNT_STATUS = "//*[local-name()='accountingUnits']/*[local-name()='status']/*[local-name()='codeValue']";
     public static final String XPATH_SWITCHING_STATUS = "//*[local-name()='switchingStatus']/*[local-name()='codeValue']";
     public static final String XPATH_MODULUS_STATUS = "//*[local-name()='modulusCheckStatus']/*[local-name()='codeValue']";
+    public static final String XPATH_BANK_NAME = "//*[local-name()='bankName']";
+    public static final String XPATH_BRANCH_NAME = "//*[local-name()='branchName']";
+
+    public static final String XPATH_RESPONSE_TRANSACTION_ID = "//*[local-name()='responseId']/*[local-name()='transactionId']";
+    public static final String XPATH_REF_TRANSACTION_ID = "//*[local-name()='refRequestIds']/*[local-name()='transactionId']";
+    public static final String XPATH_CMD_RETURN_CODE = "//*[local-name()='cmdNotifications']/*[local-name()='returnCode']";
+    public static final String XPATH_CMD_DESCRIPTION = "//*[local-name()='cmdNotifications']/*[local-name()='description']";
+    public static final String XPATH_CMD_TIMESTAMP = "//*[local-name()='cmdNotifications']/*[local-name()='timestamp']";
+    public static final String XPATH_SYSTEM_NOTIFICATIONS = "//*[local-name()='systemNotifications']";
+    public static final String XPATH_SYSTEM_RETURN_CODE = "//*[local-name()='systemNotifications']/*[local-name()='returnCode']";
+    public static final String XPATH_SYSTEM_DESCRIPTION = "//*[local-name()='systemNotifications']/*[local-name()='description']";
+    public static final String XPATH_SYSTEM_PROCESSING_ID = "//*[local-name()='systemNotifications']/*[local-name()='processingId']/*[local-name()='systemId']";
 }
 
 
@@ -447,37 +722,176 @@ public final class ServiceConstants {
 
 package com.rbs.bdd.application.service;
 
+import com.rbs.bdd.application.admission.ClientThrottle;
+import com.rbs.bdd.application.admission.ConcurrencyLimiter;
+import com.rbs.bdd.application.exception.AccountValidationException;
+import com.rbs.bdd.application.idempotency.ReplayCache;
 import com.rbs.bdd.application.port.out.AccountValidationPort;
 import com.rbs.bdd.application.port.in.PaymentValidationPort;
+import com.rbs.bdd.application.state.SharedScenarioState;
+import com.rbs.bdd.common.SecureXml;
+import com.rbs.bdd.common.ServiceConstants;
+import com.rbs.bdd.common.SoapMessages;
 import com.rbs.bdd.generated.ValidateArrangementForPaymentRequest;
+import com.rbs.bdd.infrastructure.config.WarmupProperties;
+import jakarta.xml.soap.SOAPException;
 import lombok.RequiredArgsConstructor;
+import org.slf4j.Logger;
+import org.slf4j.LoggerFactory;
 import org.springframework.stereotype.Service;
 import org.springframework.ws.WebServiceMessage;
 
+import javax.xml.transform.TransformerException;
+import javax.xml.transform.stream.StreamResult;
+import java.io.ByteArrayOutputStream;
+import java.io.IOException;
+
 /**
  * Service class responsible for orchestrating the validation flow of payment arrangement requests.
  * Implements {@link PaymentValidationPort} and delegates schema and business rule validation
- * to the appropriate output port.
+ * to the appropriate output port, behind the {@link ConcurrencyLimiter}.
+ * Retries of a {@code (systemId, transactionId)} seen within the {@link ReplayCache} window
+ * get the stored response bytes back, provided the request payload is unchanged. Warm-up requests,
+ * recognised by the warm-up {@code systemId}, are neither counted in the shared scenario state nor
+ * stored for replay.
  */
 @Service
 @RequiredArgsConstructor
 public class PaymentOrchestrator implements PaymentValidationPort {
 
-    private final AccountValidationPort accountValidationPort;
+    private static final Logger logger = LoggerFactory.getLogger(PaymentOrchestrator.class);
+    private static final PrecompiledSoapResponse OVERLOAD_FAULT =
+            new PrecompiledSoapResponse(ServiceConstants.OVERLOAD_FAULT_ENVELOPE);
 
+    private static final PrecompiledSoapResponse THROTTLED_FAULT =
+            new PrecompiledSoapResponse(ServiceConstants.THROTTLED_FAULT_ENVELOPE);
 
+    private final AccountValidationPort accountValidationPort;
+    private final ConcurrencyLimiter concurrencyLimiter;
+    private final ClientThrottle clientThrottle;
+    private final ReplayCache replayCache;
+    private final SharedScenarioState sharedScenarioState;
+    private final WarmupProperties warmupProperties;
 
 
     /**
      * Entry point for handling the SOAP request. Validates schema and applies business rules.
+     * Callers over their rate get the precompiled throttling fault, retries are answered from the
+     * replay cache, and when the concurrency limit is reached the precompiled overload fault is returned immediately.
      *
-     * @param request the incoming SOAP request payload
-     * @param message the SOAP WebServiceMessage used to write the final response
+     * @param request        the incoming SOAP request payload
+     * @param requestMessage the incoming SOAP message, digested to tell retries from reused transaction ids
+     * @param message        the SOAP WebServiceMessage used to write the final response
      */
     @Override
-    public void validateArrangementForPayment(ValidateArrangementForPaymentRequest request,WebServiceMessage message) {
-        accountValidationPort.validateSchema(request); // automatic validation through interceptors
-         accountValidationPort.validateBusinessRules(request,message);
+    public void validateArrangementForPayment(ValidateArrangementForPaymentRequest request,
+                                              WebServiceMessage requestMessage, WebServiceMessage message) {
+        String systemId = extractSystemId(request);
+        String operatingBrand = request.getRequestHeader() != null ? request.getRequestHeader().getOperatingBrand() : null;
+        if (!clientThrottle.tryAcquire(systemId, operatingBrand)) {
+            logger.debug("Throttling {}/{}", systemId, operatingBrand);
+            THROTTLED_FAULT.writeTo(message);
+            return;
+        }
+        ReplayCache.Key replayKey = replayCache.keyFor(systemId, extractTransactionId(request));
+        byte[] requestDigest = replayKey != null ? requestDigest(requestMessage) : null;
+        if (requestDigest == null) replayKey = null;
+        if (replayKey != null && replay(replayKey, requestDigest, message)) {
+            logger.debug("Replaying response for {}", replayKey);
+            return;
+        }
+        if (!concurrencyLimiter.tryAcquire()) {
+            logger.debug("Concurrency limit {} reached, returning overload fault", concurrencyLimiter.limit());
+            OVERLOAD_FAULT.writeTo(message);
+            return;
+        }
+        long start = System.nanoTime();
+        try {
+            accountValidationPort.validateSchema(request); // automatic validation through interceptors
+            accountValidationPort.validateBusinessRules(request,message);
+        } finally {
+            concurrencyLimiter.release(System.nanoTime() - start);
+        }
+        if (warmupProperties.systemId().equals(systemId)) return;
+        if (request.getArrangementIdentifier() != null && request.getArrangementIdentifier().getIdentifier() != null) {
+            sharedScenarioState.incrementAccount(request.getArrangementIdentifier().getIdentifier());
+        }
+        if (replayKey != null) remember(replayKey, requestDigest, message);
+    }
+
+    /**
+     * Digests the request payload so a stored response is only replayed for the same request.
+     *
+     * @return the digest, or null if the payload cannot be read and the request is not replayed
+     */
+    private byte[] requestDigest(WebServiceMessage requestMessage) {
+        try {
+            ByteArrayOutputStream payload = new ByteArrayOutputStream(1024);
+            SecureXml.transformer().transform(requestMessage.getPayloadSource(), new StreamResult(payload));
+            return ReplayCache.digest(payload.toByteArray());
+        } catch (TransformerException e) {
+            logger.warn("Request payload not digested, replay skipped: {}", e.getMessage());
+            return null;
+        }
+    }
+
+    /**
+     * Writes the stored response for {@code key} into {@code message}.
+     *
+     * @return true if a response was replayed
+     */
+    private boolean replay(ReplayCache.Key key, byte[] requestDigest, WebServiceMessage message) {
+        byte[] response = replayCache.get(key, requestDigest);
+        if (response == null) return false;
+        try {
+            SoapMessages.replaceEnvelope(message, response);
+            return true;
+        } catch (SOAPException | TransformerException e) {
+            throw new AccountValidationException("Failed to replay stored response", e);
+        }
+    }
+
+    /**
+     * Stores the rendered response for later retries.
+     */
+    private void remember(ReplayCache.Key key, byte[] requestDigest, WebServiceMessage message) {
+        try {
+            ByteArrayOutputStream out = new ByteArrayOutputStream(2048);
+            message.writeTo(out);
+            replayCache.put(key, requestDigest, out.toByteArray());
+        } catch (IOException e) {
+            logger.warn("Response for {} not stored for replay: {}", key, e.getMessage());
+        }
+    }
+
+    /**
+     * Returns the first non-blank {@code requestIds/transactionId} of the request header.
+     *
+     * @param request SOAP request
+     * @return the transaction id, or null if the tag is missing or empty
+     */
+    private String extractTransactionId(ValidateArrangementForPaymentRequest request) {
+        if (request.getRequestHeader() == null || request.getRequestHeader().getRequestIds() == null) return null;
+        return request.getRequestHeader().getRequestIds().stream()
+                .map(ids -> ids.getTransactionId())
+                .filter(id -> id != null && !id.isBlank())
+                .findFirst()
+                .orElse(null);
+    }
+
+    /**
+     * Returns the first {@code requestIds/systemId} of the request header.
+     *
+     * @param request SOAP request
+     * @return the system id, or null if missing
+     */
+    private String extractSystemId(ValidateArrangementForPaymentRequest request) {
+        if (request.getRequestHeader() == null || request.getRequestHeader().getRequestIds() == null) return null;
+        return request.getRequestHeader().getRequestIds().stream()
+                .map(ids -> ids.getSystemId())
+                .filter(id -> id != null && !id.isBlank())
+                .findFirst()
+                .orElse(null);
     }
 
 }
@@ -491,35 +905,37 @@ import com.rbs.bdd.application.exception.AccountValidationException;
 import com.rbs.bdd.application.exception.SchemaValidationException;
 import com.rbs.bdd.application.exception.XmlParsingException;
 import com.rbs.bdd.application.port.out.AccountValidationPort;
+import com.rbs.bdd.common.SecureXml;
 import com.rbs.bdd.common.ServiceConstants;
-import com.rbs.bdd.domain.enums.AccountStatus;
+import com.rbs.bdd.common.SoapMessages;
 import com.rbs.bdd.domain.enums.ModulusCheckStatus;
-import com.rbs.bdd.domain.enums.SwitchingStatus;
+import com.rbs.bdd.domain.enums.RuleAction;
+import com.rbs.bdd.domain.modulus.ModulusCheckEngine;
+import com.rbs.bdd.domain.rules.AccountIndex;
+import com.rbs.bdd.domain.rules.CompiledRuleSet;
+import com.rbs.bdd.domain.rules.RoutingRule;
+import com.rbs.bdd.domain.rules.RuleOutcome;
+import com.rbs.bdd.domain.sortcode.SortCodeDirectory;
 import com.rbs.bdd.generated.ValidateArrangementForPaymentRequest;
+import com.rbs.bdd.infrastructure.profiling.SoapPipelineEvents;
+import com.rbs.bdd.infrastructure.profiling.SoapStageEvent;
 import lombok.RequiredArgsConstructor;
 import org.slf4j.Logger;
 import org.slf4j.LoggerFactory;
 import org.springframework.stereotype.Service;
 import org.springframework.ws.WebServiceMessage;
-import org.springframework.ws.soap.saaj.SaajSoapMessage;
 import org.w3c.dom.Document;
 import org.w3c.dom.Node;
-import javax.xml.XMLConstants;
-import javax.xml.parsers.DocumentBuilder;
-import javax.xml.parsers.DocumentBuilderFactory;
-import javax.xml.parsers.ParserConfigurationException;
-import javax.xml.transform.Transformer;
-import javax.xml.transform.TransformerFactory;
 import javax.xml.transform.dom.DOMSource;
 import javax.xml.transform.stream.StreamResult;
-import javax.xml.transform.stream.StreamSource;
 import javax.xml.xpath.XPath;
 import javax.xml.xpath.XPathConstants;
 import javax.xml.xpath.XPathExpressionException;
-import javax.xml.xpath.XPathFactory;
-import java.io.ByteArrayInputStream;
 import java.io.ByteArrayOutputStream;
 import java.io.InputStream;
+import java.time.OffsetDateTime;
+import java.time.ZoneId;
+import java.time.format.DateTimeFormatter;
 import java.util.Optional;
 import java.util.UUID;
 
@@ -528,14 +944,19 @@ import java.util.UUID;
  * to return a transformed static SOAP response using DOM and XPath.
  *
  * Implements {@link AccountValidationPort} as part of the hexagonal architecture.
- * Uses account identifier and code type to determine if the account should be considered
- * valid, and if so, transforms a static response template by injecting dynamic fields.
+ * Evaluates the request against the {@link CompiledRuleSet} and, depending on the matched rule,
+ * transforms either the static success or the static error template by injecting dynamic fields.
  */
 @Service
 @RequiredArgsConstructor
 public class AccountValidationService implements AccountValidationPort {
 
     private static final Logger logger = LoggerFactory.getLogger(AccountValidationService.class);
+    private static final String SORT_CODE_FAILURE_RULE = "sortCodeFailure";
+    private final CompiledRuleSet routingRules;
+    private final AccountIndex accountIndex;
+    private final ModulusCheckEngine modulusCheckEngine;
+    private final SortCodeDirectory sortCodeDirectory;
 
     /**
      * Validates the XSD schema. This is a placeholder as Spring WS performs schema validation via interceptors.
@@ -556,33 +977,71 @@ public class AccountValidationService implements AccountValidationPort {
      */
     @Override
     public void validateBusinessRules(ValidateArrangementForPaymentRequest request, WebServiceMessage message) {
-        try (InputStream xml = getClass().getClassLoader().getResourceAsStream(ServiceConstants.RESPONSE_XML_PATH)) {
-            if (xml == null) throw new SchemaValidationException("Static response XML not found");
-
-            DocumentBuilderFactory factory = createSecureDocumentBuilderFactory();
-            DocumentBuilder builder = factory.newDocumentBuilder();
-            Document doc = builder.parse(xml);
-            XPath xpath = XPathFactory.newInstance().newXPath();
-
-            RequestParams params = extractRequestDetails(request);
-            logger.debug("Request:- Account no - " +params.identifier);
-            logger.debug("Request:- Account Type - " +params.codeValue);
-            logger.debug("Number of Digits in account no  : "+ params.numberOfDigits);
-            ResponseConfig config = determineMatchingConfig(params)
-                    .orElseThrow(() -> new AccountValidationException("Account Validation failed: account not found"));
-            logger.info("Account Type: "+config.status);
-            logger.info("Account Switching Type: "+config.switching());
-            logger.info("Account Modulus : "+config.modulus());
-            updateResponseDocument(doc, xpath, config);
+        SoapStageEvent stage = SoapPipelineEvents.beginStage(SoapPipelineEvents.STAGE_BUSINESS_RULES);
+        String result = SoapPipelineEvents.OUTCOME_FAILED;
+        try {
+            result = applyBusinessRules(request, message).name();
+        } finally {
+            SoapPipelineEvents.endStage(stage, result);
+        }
+    }
 
-            ByteArrayOutputStream out = new ByteArrayOutputStream();
-            TransformerFactory transformerFactory = TransformerFactory.newInstance();
-            transformerFactory.setAttribute(XMLConstants.ACCESS_EXTERNAL_DTD,"");
-            transformerFactory.setAttribute(XMLConstants.ACCESS_EXTERNAL_STYLESHEET,"");
-            Transformer transformer = transformerFactory.newTransformer();
-            transformer.transform(new DOMSource(doc), new StreamResult(out));
-            ((SaajSoapMessage) message).getSaajMessage().getSOAPPart()
-                    .setContent(new StreamSource(new ByteArrayInputStream(out.toByteArray())));
+    /**
+     * Matches the request against the routing rules and writes the success or error response.
+     *
+     * @param request the incoming SOAP request
+     * @param message the outgoing response message to populate
+     * @return the action of the outcome that was written
+     */
+    private RuleAction applyBusinessRules(ValidateArrangementForPaymentRequest request, WebServiceMessage message) {
+        RequestParams params = extractRequestDetails(request);
+        logger.debug("Request:- Account no - " +params.identifier);
+        logger.debug("Request:- Account Type - " +params.codeValue);
+        logger.debug("Number of Digits in account no  : "+ params.numberOfDigits);
+        AccountDecision decision = decide(params.identifier(), params.codeValue(), params.transactionId() != null)
+                .orElseThrow(() -> {
+                    logger.info("Account Not Found");
+                    return new AccountValidationException("Account Validation failed: account not found");
+                });
+        logger.info("Matched routing rule: {}", decision.ruleName());
+        SoapPipelineEvents.tag(decision.ruleName(), params.transactionId());
+        int sortCode = decision.sortCode();
+        RuleOutcome outcome = decision.outcome();
+        if (decision.injectedFailure()) {
+            logger.info("Injected sort code failure for {}", sortCode);
+        }
+        String template = outcome.action() == RuleAction.ERROR
+                ? ServiceConstants.ERROR_RESPONSE_XML_PATH
+                : ServiceConstants.RESPONSE_XML_PATH;
+
+        try (InputStream xml = getClass().getClassLoader().getResourceAsStream(template)) {
+            if (xml == null) throw new SchemaValidationException("Static response XML not found: " + template);
+
+            Document doc = SecureXml.parse(xml);
+            XPath xpath = SecureXml.xpath();
+
+            if (outcome.action() == RuleAction.ERROR) {
+                logger.info("Returning error {} / {}", outcome.returnCode(), outcome.systemReturnCode());
+                updateErrorDocument(doc, xpath, outcome, params);
+            } else {
+                logger.info("Account Type: "+outcome.status());
+                logger.info("Account Switching Type: "+outcome.switching());
+                logger.info("Account Modulus : "+outcome.modulus());
+                updateResponseDocument(doc, xpath, outcome, outcome.modulus());
+                updateSortCodeDetails(doc, xpath, sortCode);
+            }
+
+            SoapStageEvent serialization = SoapPipelineEvents.beginStage(SoapPipelineEvents.STAGE_SERIALIZATION);
+            String serialized = SoapPipelineEvents.OUTCOME_FAILED;
+            try {
+                ByteArrayOutputStream out = new ByteArrayOutputStream();
+                SecureXml.transformer().transform(new DOMSource(doc), new StreamResult(out));
+                SoapMessages.replaceEnvelope(message, out.toByteArray());
+                serialized = SoapPipelineEvents.OUTCOME_OK;
+            } finally {
+                SoapPipelineEvents.endStage(serialization, serialized);
+            }
+            return outcome.action();
 
         } catch (AccountValidationException e) {
             logger.error("Validation exception: {}", e.getMessage(), e);
@@ -594,7 +1053,47 @@ public class AccountValidationService implements AccountValidationPort {
     }
 
     /**
-     * Extracts identifier, code value, and number of digits from the request payload.
+     * Runs an account through the routing rules, injected sort code failures and the modulus check,
+     * without rendering a response. A rule's modulus status, when present, overrides the computed one.
+     * Injected failures apply whether or not a rule matches, but never replace an error rule, so header
+     * and identifier shape errors are still reported first. Requests carrying a transaction id are looked
+     * up in the {@link AccountIndex} before the rule trie; dataset accounts rank like the fixture rules,
+     * below the header checks. Shared with the bulk validator.
+     *
+     * @param identifier       the arrangement identifier, may be null
+     * @param codeValue        the identifier code value, may be null
+     * @param hasTransactionId whether the request carries a transaction id
+     * @return the decision, or empty if neither a rule nor an injected failure applies
+     */
+    public Optional<AccountDecision> decide(String identifier, String codeValue, boolean hasTransactionId) {
+        int sortCode = SortCodeDirectory.sortCodeOf(identifier, codeValue);
+        RuleOutcome injectedFailure = sortCodeDirectory.failureFor(sortCode);
+        RuleOutcome listed = hasTransactionId ? accountIndex.find(identifier, codeValue) : null;
+        if (listed != null) {
+            return Optional.of(injectedFailure != null
+                    ? new AccountDecision(AccountIndex.RULE_NAME, injectedFailure, sortCode, true)
+                    : new AccountDecision(AccountIndex.RULE_NAME, withModulus(listed, identifier, codeValue), sortCode, false));
+        }
+        Optional<RoutingRule> matched = routingRules.evaluate(identifier, codeValue, hasTransactionId);
+        if (injectedFailure != null && matched.map(rule -> rule.outcome().action() == RuleAction.RESPOND).orElse(true)) {
+            String ruleName = matched.map(RoutingRule::name).orElse(SORT_CODE_FAILURE_RULE);
+            return Optional.of(new AccountDecision(ruleName, injectedFailure, sortCode, true));
+        }
+        return matched.map(rule -> new AccountDecision(rule.name(), withModulus(rule.outcome(), identifier, codeValue),
+                sortCode, false));
+    }
+
+    /**
+     * Fills in the computed modulus status of a success outcome that does not override it.
+     */
+    private RuleOutcome withModulus(RuleOutcome outcome, String identifier, String codeValue) {
+        if (outcome.action() != RuleAction.RESPOND || outcome.modulus() != null) return outcome;
+        ModulusCheckStatus modulus = modulusCheckEngine.check(identifier, codeValue);
+        return RuleOutcome.respond(outcome.status(), outcome.switching(), modulus);
+    }
+
+    /**
+     * Extracts identifier, code value, number of digits and transaction id from the request payload.
      *
      * @param request SOAP request
      * @return parsed request params
@@ -603,82 +1102,93 @@ public class AccountValidationService implements AccountValidationPort {
         String identifier = request.getArrangementIdentifier().getIdentifier();
         String codeValue = request.getArrangementIdentifier().getContext().getCodeValue();
         int length = identifier != null ? identifier.length() : 0;
-        return new RequestParams(identifier, codeValue, length);
+        return new RequestParams(identifier, codeValue, length, extractTransactionId(request));
     }
 
     /**
-     * Determines the appropriate response based on the incoming request fields.
+     * Returns the first non-blank {@code requestIds/transactionId} of the request header.
      *
-     * @param p request parameter holder
-     * @return optional config to update the response with
+     * @param request SOAP request
+     * @return the transaction id, or null if the tag is missing or empty
      */
-    private Optional<ResponseConfig> determineMatchingConfig(RequestParams p) {
-        ResponseConfig result=null;
-
-      if (isMatch(p, ServiceConstants.IBAN_1) ){
-          logger.info("Account is Domestic-Restricted, Switched, and modulus is passed");
-          result= new ResponseConfig(AccountStatus.DOMESTIC_RESTRICTED, SwitchingStatus.SWITCHED, ModulusCheckStatus.PASS);
-      }
-      else if( isMatch(p, ServiceConstants.IBAN_2) )
-      {
-          logger.info("Account is Domestic-Restricted, NotSwitching, and modulus is passed");
-          result= new ResponseConfig(AccountStatus.DOMESTIC_RESTRICTED, SwitchingStatus.NOT_SWITCHING, ModulusCheckStatus.PASS);
-      }
-      else if(isMatch(p, ServiceConstants.IBAN_3))
-      {
-          logger.info("Account is Domestic-Unrestricted, Switched, and modulus is passed");
-          result = new ResponseConfig(AccountStatus.DOMESTIC_UNRESTRICTED, SwitchingStatus.SWITCHED, ModulusCheckStatus.PASS);
-      }
-      else if(isMatch(p, ServiceConstants.IBAN_4))
-      {
-          logger.info("Account is Domestic-Unrestricted, NotSwitching, and modulus is failed");
-          result= new ResponseConfig(AccountStatus.DOMESTIC_UNRESTRICTED, SwitchingStatus.NOT_SWITCHING, ModulusCheckStatus.FAILED);
-      }
-      else{
-          logger.info("Account Not Found");
-        }
-      return  Optional.ofNullable(result);
+    private String extractTransactionId(ValidateArrangementForPaymentRequest request) {
+        if (request.getRequestHeader() == null || request.getRequestHeader().getRequestIds() == null) return null;
+        return request.getRequestHeader().getRequestIds().stream()
+                .map(ids -> ids.getTransactionId())
+                .filter(id -> id != null && !id.isBlank())
+                .findFirst()
+                .orElse(null);
     }
 
     /**
-     * Checks if a request matches a given IBAN rule.
+     * Updates response document nodes using XPath with values from the matched rule.
      *
-     * @param p    the request parameters
-     * @param iban the full IBAN to match against
-     * @return true if matches either full IBAN or UK version
+     * @param doc     the DOM document to modify
+     * @param xpath   XPath engine
+     * @param outcome the new values to set
+     * @param modulus the configured or computed modulus check result
+     * @throws XPathExpressionException if XPath fails
      */
-    private boolean isMatch(RequestParams p, String iban) {
-        if(iban==null || p==null) return false;
-
-        String ukEquivalent = extractLast14Digits(iban);
-        if(ukEquivalent==null) return false;
-        return (p.numberOfDigits() == 22 && ServiceConstants.INTL_BANK_ACCOUNT.equals(p.codeValue()) && iban.equals(p.identifier()))
-                || (p.numberOfDigits() == 14 && ServiceConstants.UK_BASIC_BANK_ACCOUNT.equals(p.codeValue()) && ukEquivalent.equals(p.identifier()));
+    private void updateResponseDocument(Document doc, XPath xpath, RuleOutcome outcome, ModulusCheckStatus modulus)
+            throws XPathExpressionException {
+        set(xpath, doc, ServiceConstants.XPATH_TRANSACTION_ID, generateTransactionId());
+        set(xpath, doc, ServiceConstants.XPATH_ACCOUNT_STATUS, outcome.status().getValue());
+        set(xpath, doc, ServiceConstants.XPATH_SWITCHING_STATUS, outcome.switching().getValue());
+        set(xpath, doc, ServiceConstants.XPATH_MODULUS_STATUS, modulus.getValue());
     }
 
     /**
-     * Extracts the last 14 characters from an IBAN string.
+     * Copies the bank and branch attributes of the request sort code into the response.
+     * Sort codes missing from the directory leave the template values untouched.
      *
-     * @param value input string (typically an IBAN)
-     * @return last 14 characters or entire input if shorter
+     * @param doc      the DOM document to modify
+     * @param xpath    XPath engine
+     * @param sortCode the sort code of the request, or -1
+     * @throws XPathExpressionException if XPath fails
      */
-    private String extractLast14Digits(String value) {
-        return value != null && value.length() >= 14 ? value.substring(value.length() - 14) : value;
+    private void updateSortCodeDetails(Document doc, XPath xpath, int sortCode) throws XPathExpressionException {
+        int index = sortCodeDirectory.indexOf(sortCode);
+        if (index < 0) return;
+        set(xpath, doc, ServiceConstants.XPATH_BANK_NAME, sortCodeDirectory.bankName(index));
+        set(xpath, doc, ServiceConstants.XPATH_BRANCH_NAME, sortCodeDirectory.branchName(index));
     }
 
     /**
-     * Updates response document nodes using XPath with values from business logic.
+     * Populates the static error template with the codes and description of an error rule.
+     * When the rule carries no processing system, the system notification block is dropped and
+     * the description is reported on the command notification instead.
      *
-     * @param doc    the DOM document to modify
-     * @param xpath  XPath engine
-     * @param config the new values to set
+     * @param doc     the DOM error document to modify
+     * @param xpath   XPath engine
+     * @param outcome the error values to set
+     * @param params  request values echoed back in {@code refRequestIds}
      * @throws XPathExpressionException if XPath fails
      */
-    private void updateResponseDocument(Document doc, XPath xpath, ResponseConfig config) throws XPathExpressionException {
-        set(xpath, doc, ServiceConstants.XPATH_TRANSACTION_ID, generateTransactionId());
-        set(xpath, doc, ServiceConstants.XPATH_ACCOUNT_STATUS, config.status().getValue());
-        set(xpath, doc, ServiceConstants.XPATH_SWITCHING_STATUS, config.switching().getValue());
-        set(xpath, doc, ServiceConstants.XPATH_MODULUS_STATUS, config.modulus().getValue());
+    private void updateErrorDocument(Document doc, XPath xpath, RuleOutcome outcome, RequestParams params)
+            throws XPathExpressionException {
+        set(xpath, doc, ServiceConstants.XPATH_RESPONSE_TRANSACTION_ID, generateErrorTransactionId());
+        set(xpath, doc, ServiceConstants.XPATH_CMD_RETURN_CODE, outcome.returnCode());
+        set(xpath, doc, ServiceConstants.XPATH_CMD_TIMESTAMP,
+                OffsetDateTime.now(ZoneId.of("Europe/London")).format(DateTimeFormatter.ISO_OFFSET_DATE_TIME));
+
+        if (params.transactionId() != null) {
+            set(xpath, doc, ServiceConstants.XPATH_REF_TRANSACTION_ID, params.transactionId());
+        } else {
+            remove(xpath, doc, ServiceConstants.XPATH_REF_TRANSACTION_ID);
+        }
+
+        if (outcome.systemId() == null) {
+            set(xpath, doc, ServiceConstants.XPATH_CMD_DESCRIPTION, outcome.description());
+            remove(xpath, doc, ServiceConstants.XPATH_SYSTEM_NOTIFICATIONS);
+            return;
+        }
+        set(xpath, doc, ServiceConstants.XPATH_SYSTEM_DESCRIPTION, outcome.description());
+        set(xpath, doc, ServiceConstants.XPATH_SYSTEM_PROCESSING_ID, outcome.systemId());
+        if (outcome.systemReturnCode() != null) {
+            set(xpath, doc, ServiceConstants.XPATH_SYSTEM_RETURN_CODE, outcome.systemReturnCode());
+        } else {
+            remove(xpath, doc, ServiceConstants.XPATH_SYSTEM_RETURN_CODE);
+        }
     }
 
     /**
@@ -695,6 +1205,19 @@ public class AccountValidationService implements AccountValidationPort {
         if (node != null) node.setTextContent(value);
     }
 
+    /**
+     * Removes the node selected by the XPath expression, if present.
+     *
+     * @param xpath XPath engine
+     * @param doc   DOM document
+     * @param expr  XPath expression
+     * @throws XPathExpressionException if the expression is invalid
+     */
+    private void remove(XPath xpath, Document doc, String expr) throws XPathExpressionException {
+        Node node = (Node) xpath.evaluate(expr, doc, XPathConstants.NODE);
+        if (node != null) node.getParentNode().removeChild(node);
+    }
+
     /**
      * Generates a unique transaction ID used in the response.
      *
@@ -704,52 +1227,29 @@ public class AccountValidationService implements AccountValidationPort {
         return "3flS" + UUID.randomUUID().toString().replace("-", "") + "h";
     }
 
+    /**
+     * Generates a unique transaction ID used in error responses.
+     *
+     * @return UUID-based transaction ID
+     */
+    private String generateErrorTransactionId() {
+        return "1alN" + UUID.randomUUID().toString().replace("-", "") + "h";
+    }
+
 
     /**
      * Immutable record representing extracted request values.
-     * This encapsulates the input fields required to determine which account configuration applies.
+     * This encapsulates the input fields required to determine which routing rule applies.
      * @param identifier      the IBAN or UK account number
      * @param codeValue       the code type (e.g., InternationalBankAccountNumber)
      * @param numberOfDigits  number of characters in the identifier
+     * @param transactionId   the request transactionId, or null when missing
      */
     @SuppressWarnings("unused")
-    private record RequestParams(String identifier, String codeValue, int numberOfDigits) {
+    private record RequestParams(String identifier, String codeValue, int numberOfDigits, String transactionId) {
         //This record act as data carrier between schema parsing and business rule engine
 
     }
-
-    /**
-     * Immutable record representing business rule results to apply in the response.
-     * This holds the mapped response values after matching input against business rules.
-     * @param status    the account status
-     * @param switching the switching status
-     * @param modulus   the modulus check result
-     */
-
-    @SuppressWarnings("unused")
-    private record ResponseConfig(AccountStatus status, SwitchingStatus switching, ModulusCheckStatus modulus) {
-    // Acts as a container for response attributes derived from business rules.
-
-}
-    /**
-     * Creates a secure, namespace-aware {@link DocumentBuilderFactory} instance configured
-     * to protect against XML External Entity (XXE) attacks and unsafe XML parsing behavior.
-     *
-     * @return a secure {@link DocumentBuilderFactory}
-     * @throws ParserConfigurationException if factory features cannot be set
-     */
-    private DocumentBuilderFactory createSecureDocumentBuilderFactory() throws  ParserConfigurationException {
-        DocumentBuilderFactory factory = DocumentBuilderFactory.newInstance();
-        factory.setNamespaceAware(true);
-        factory.setFeature(XMLConstants.FEATURE_SECURE_PROCESSING, true);
-        factory.setFeature("http://apache.org/xml/features/disallow-doctype-decl", true);
-        factory.setFeature("http://xml.org/sax/features/external-general-entities", false);
-        factory.setFeature("http://xml.org/sax/features/external-parameter-entities", false);
-        factory.setFeature("http://apache.org/xml/features/nonvalidating/load-external-dtd", false);
-        factory.setXIncludeAware(false);
-        factory.setExpandEntityReferences(false);
-        return factory;
-    }
 }
 
 
@@ -807,10 +1307,12 @@ public interface PaymentValidationPort {
     /**
      * Validates a payment arrangement request by delegating to the underlying orchestrator/service.
      *
-     * @param request The SOAP request payload.
-     * @param message The outgoing WebServiceMessage to be modified and returned.
+     * @param request        The SOAP request payload.
+     * @param requestMessage The incoming WebServiceMessage the payload was read from.
+     * @param message        The outgoing WebServiceMessage to be modified and returned.
      */
-    void validateArrangementForPayment(ValidateArrangementForPaymentRequest request,WebServiceMessage message);
+    void validateArrangementForPayment(ValidateArrangementForPaymentRequest request, WebServiceMessage requestMessage,
+                                       WebServiceMessage message);
 
 
 
@@ -941,6 +1443,6450 @@ public class XsdSchemaLoadingException extends RuntimeException{
     }
 }
 
+---------------------------------------
+
+package com.rbs.bdd.application.exception;
+
+/**
+ * Exception thrown when the routing rule definitions cannot be loaded or parsed.
+ */
+public class RuleDefinitionException extends RuntimeException {
+
+    /**
+     * Constructs a new RuleDefinitionException with a specific message.
+     *
+     * @param message the detail message
+     */
+    public RuleDefinitionException(String message) {
+        super(message);
+    }
+
+    /**
+     * Constructs a new RuleDefinitionException with a message and cause.
+     *
+     * @param message the detail message
+     * @param cause the cause of the exception
+     */
+    public RuleDefinitionException(String message, Throwable cause) {
+        super(message, cause);
+    }
+}
+
+
+---------------------------------------
+
+package com.rbs.bdd.domain.enums;
+
+/**
+ * Enum representing what the simulator returns once a routing rule matches.
+ */
+public enum RuleAction {
+    RESPOND,
+    ERROR
+}
+
+
+---------------------------------------
+
+package com.rbs.bdd.domain.rules;
+
+import com.rbs.bdd.domain.modulus.ModulusCheckEngine;
+
+/**
+ * Immutable record describing the request fields a routing rule applies to.
+ * The identifier prefix is matched by the trie in {@link CompiledRuleSet}; the remaining
+ * conditions are checked by {@link #matches(String, String, int, boolean, int)}.
+ *
+ * @param prefix               identifier prefix ("" matches every identifier)
+ * @param exactIdentifier      true if the identifier must be equal to the prefix
+ * @param codeValue            required codeValue, or null for any
+ * @param codeValueNegated     true if the codeValue must NOT be equal to {@code codeValue}
+ * @param length               required identifier length, or -1 for any
+ * @param lengthNegated        true if the length must NOT be equal to {@code length}
+ * @param transactionIdPresent required presence of requestIds/transactionId, or null for any
+ * @param mod97Valid           required outcome of the IBAN mod-97 checksum, or null for any
+ */
+public record RuleCondition(String prefix, boolean exactIdentifier, String codeValue, boolean codeValueNegated,
+                            int length, boolean lengthNegated, Boolean transactionIdPresent, Boolean mod97Valid) {
+
+    /**
+     * Checks the non-prefix conditions of the rule. The mod-97 checksum is evaluated last and only
+     * for rules that ask for it.
+     *
+     * @param identifier         the identifier of the request
+     * @param requestCodeValue   the codeValue of the request
+     * @param requestLength      the identifier length of the request
+     * @param hasTransactionId   whether the request carries a transactionId
+     * @param matchedDepth       number of identifier characters consumed by the trie
+     * @return true if the rule applies
+     */
+    public boolean matches(String identifier, String requestCodeValue, int requestLength, boolean hasTransactionId,
+                           int matchedDepth) {
+        if (exactIdentifier && matchedDepth != requestLength) return false;
+        if (length >= 0 && (requestLength == length) == lengthNegated) return false;
+        if (transactionIdPresent != null && transactionIdPresent != hasTransactionId) return false;
+        if (codeValue != null && codeValue.equals(requestCodeValue) == codeValueNegated) return false;
+        return mod97Valid == null || ModulusCheckEngine.isValidIban(identifier) == mod97Valid;
+    }
+}
+
+
+---------------------------------------
+
+package com.rbs.bdd.domain.rules;
+
+import com.rbs.bdd.domain.enums.AccountStatus;
+import com.rbs.bdd.domain.enums.ModulusCheckStatus;
+import com.rbs.bdd.domain.enums.RuleAction;
+import com.rbs.bdd.domain.enums.SwitchingStatus;
+
+/**
+ * Immutable record representing what the simulator returns for a matched routing rule.
+ * A {@link RuleAction#RESPOND} outcome carries the account attributes of the success response,
+ * a {@link RuleAction#ERROR} outcome carries the codes of the ESP exception envelope.
+ *
+ * @param action           whether a success or an error response is returned
+ * @param status           the account status (RESPOND only)
+ * @param switching        the switching status (RESPOND only)
+ * @param modulus          the modulus check result, or null to compute it from the identifier (RESPOND only)
+ * @param returnCode       the cmdNotifications return code, e.g. ERR006 (ERROR only)
+ * @param systemReturnCode the systemNotifications return code, e.g. 0013, or null (ERROR only)
+ * @param systemId         the processing system, e.g. PMP or BPP, or null (ERROR only)
+ * @param description      the error description (ERROR only)
+ */
+public record RuleOutcome(RuleAction action, AccountStatus status, SwitchingStatus switching,
+                          ModulusCheckStatus modulus, String returnCode, String systemReturnCode,
+                          String systemId, String description) {
+
+    /**
+     * Creates an outcome that returns the static success response.
+     *
+     * @param status    the account status
+     * @param switching the switching status
+     * @param modulus   the modulus check result
+     * @return the outcome
+     */
+    public static RuleOutcome respond(AccountStatus status, SwitchingStatus switching, ModulusCheckStatus modulus) {
+        return new RuleOutcome(RuleAction.RESPOND, status, switching, modulus, null, null, null, null);
+    }
+
+    /**
+     * Creates an outcome that returns the static error response.
+     *
+     * @param returnCode       the cmdNotifications return code
+     * @param systemReturnCode the systemNotifications return code, or null
+     * @param systemId         the processing system, or null
+     * @param description      the error description
+     * @return the outcome
+     */
+    public static RuleOutcome error(String returnCode, String systemReturnCode, String systemId, String description) {
+        return new RuleOutcome(RuleAction.ERROR, null, null, null, returnCode, systemReturnCode, systemId, description);
+    }
+}
+
+
+---------------------------------------
+
+package com.rbs.bdd.domain.rules;
+
+/**
+ * Immutable record representing a single declarative routing rule.
+ * Rules with a lower precedence value win; rules with equal precedence are resolved in declaration order.
+ *
+ * @param name       rule name used for logging and hit counters
+ * @param precedence rule precedence, lower values win
+ * @param condition  the request fields the rule applies to
+ * @param outcome    the response returned when the rule matches
+ */
+public record RoutingRule(String name, int precedence, RuleCondition condition, RuleOutcome outcome) {
+
+    /**
+     * Derives the UK basic bank account form of an exact IBAN rule: the last 14 characters
+     * of the IBAN (sort code and account number), matched with codeValue UKBasicBankAccountNumber.
+     *
+     * @param ukCodeValue the codeValue used by UK basic bank account requests
+     * @return the alias rule, sharing precedence and outcome with this rule
+     */
+    public RoutingRule ukAlias(String ukCodeValue) {
+        String iban = condition.prefix();
+        String account = iban.length() >= 14 ? iban.substring(iban.length() - 14) : iban;
+        RuleCondition alias = new RuleCondition(account, true, ukCodeValue, false, 14, false,
+                condition.transactionIdPresent(), null);
+        return new RoutingRule(name + "#uk", precedence, alias, outcome);
+    }
+}
+
+
+---------------------------------------
+
+package com.rbs.bdd.domain.rules;
+
+import java.util.ArrayList;
+import java.util.Arrays;
+import java.util.Comparator;
+import java.util.HashMap;
+import java.util.LinkedHashMap;
+import java.util.List;
+import java.util.Map;
+import java.util.Optional;
+import java.util.concurrent.atomic.LongAdder;
+
+/**
+ * Routing rules compiled into a prefix trie on the identifier, with codeValue dispatch at every node.
+ * <p>
+ * {@link #evaluate(String, String, boolean)} walks the identifier once; at each node it only inspects
+ * the rules registered for the request codeValue plus the codeValue-independent rules, each bucket
+ * already sorted by precedence, so a bucket is abandoned as soon as it cannot beat the current best.
+ * Every rule keeps its own hit counter.
+ * </p>
+ */
+public final class CompiledRuleSet {
+
+    private static final CompiledRule[] NO_RULES = new CompiledRule[0];
+
+    private final TrieNode root;
+    private final List<CompiledRule> rules;
+
+    private CompiledRuleSet(TrieNode root, List<CompiledRule> rules) {
+        this.root = root;
+        this.rules = rules;
+    }
+
+    /**
+     * Compiles the given rules into a decision trie.
+     *
+     * @param definitions rules in declaration order
+     * @return the compiled rule set
+     */
+    public static CompiledRuleSet compile(List<RoutingRule> definitions) {
+        TrieNode root = new TrieNode();
+        List<CompiledRule> compiled = new ArrayList<>(definitions.size());
+        for (RoutingRule rule : definitions) {
+            CompiledRule entry = new CompiledRule(rule, compiled.size());
+            compiled.add(entry);
+            TrieNode node = root;
+            String prefix = rule.condition().prefix();
+            for (int i = 0; i < prefix.length(); i++) {
+                node = node.childOrCreate(prefix.charAt(i));
+            }
+            node.add(entry);
+        }
+        root.freeze();
+        return new CompiledRuleSet(root, List.copyOf(compiled));
+    }
+
+    /**
+     * Finds the highest-precedence rule matching the request, in a single pass over the identifier.
+     *
+     * @param identifier       the request identifier, may be null
+     * @param codeValue        the request codeValue, may be null
+     * @param hasTransactionId whether the request carries a transactionId
+     * @return the matching rule, or empty if none applies
+     */
+    public Optional<RoutingRule> evaluate(String identifier, String codeValue, boolean hasTransactionId) {
+        int length = identifier != null ? identifier.length() : 0;
+        TrieNode node = root;
+        CompiledRule best = node.select(null, identifier, codeValue, length, hasTransactionId, 0);
+        for (int depth = 0; depth < length; depth++) {
+            node = node.child(identifier.charAt(depth));
+            if (node == null) break;
+            best = node.select(best, identifier, codeValue, length, hasTransactionId, depth + 1);
+        }
+        if (best == null) return Optional.empty();
+        best.hits.increment();
+        return Optional.of(best.rule);
+    }
+
+    /**
+     * Returns the number of times each rule was selected, in declaration order.
+     *
+     * @return rule name to hit count
+     */
+    public Map<String, Long> hitCounts() {
+        Map<String, Long> counts = new LinkedHashMap<>();
+        for (CompiledRule rule : rules) {
+            counts.put(rule.rule.name(), rule.hits.sum());
+        }
+        return counts;
+    }
+
+    /**
+     * @param index rule index, in declaration order
+     * @return the name of the rule
+     */
+    public String ruleName(int index) {
+        return rules.get(index).rule.name();
+    }
+
+    /**
+     * @param index rule index, in declaration order
+     * @return the number of times the rule was selected
+     */
+    public long hitCount(int index) {
+        return rules.get(index).hits.sum();
+    }
+
+    /**
+     * @return number of compiled rules
+     */
+    public int size() {
+        return rules.size();
+    }
+
+    /**
+     * A rule together with its declaration order and hit counter.
+     */
+    private static final class CompiledRule {
+        private final RoutingRule rule;
+        private final int order;
+        private final LongAdder hits = new LongAdder();
+
+        private CompiledRule(RoutingRule rule, int order) {
+            this.rule = rule;
+            this.order = order;
+        }
+
+        private boolean beats(CompiledRule other) {
+            return other == null || rule.precedence() < other.rule.precedence()
+                    || (rule.precedence() == other.rule.precedence() && order < other.order);
+        }
+    }
+
+    /**
+     * Trie node keyed by identifier character; children are kept in a sorted char array for binary search.
+     */
+    private static final class TrieNode {
+        private static final Comparator<CompiledRule> BY_PRECEDENCE =
+                Comparator.comparingInt((CompiledRule r) -> r.rule.precedence()).thenComparingInt(r -> r.order);
+
+        private char[] keys = new char[0];
+        private TrieNode[] children = new TrieNode[0];
+        private Map<String, List<CompiledRule>> pendingByCodeValue = new HashMap<>();
+        private List<CompiledRule> pendingAny = new ArrayList<>();
+        private Map<String, CompiledRule[]> byCodeValue = Map.of();
+        private CompiledRule[] anyCodeValue = NO_RULES;
+
+        private TrieNode child(char c) {
+            int i = Arrays.binarySearch(keys, c);
+            return i >= 0 ? children[i] : null;
+        }
+
+        private TrieNode childOrCreate(char c) {
+            int i = Arrays.binarySearch(keys, c);
+            if (i >= 0) return children[i];
+            int at = -i - 1;
+            char[] newKeys = new char[keys.length + 1];
+            TrieNode[] newChildren = new TrieNode[children.length + 1];
+            System.arraycopy(keys, 0, newKeys, 0, at);
+            System.arraycopy(children, 0, newChildren, 0, at);
+            newKeys[at] = c;
+            newChildren[at] = new TrieNode();
+            System.arraycopy(keys, at, newKeys, at + 1, keys.length - at);
+            System.arraycopy(children, at, newChildren, at + 1, children.length - at);
+            keys = newKeys;
+            children = newChildren;
+            return newChildren[at];
+        }
+
+        private void add(CompiledRule rule) {
+            RuleCondition condition = rule.rule.condition();
+            if (condition.codeValue() != null && !condition.codeValueNegated()) {
+                pendingByCodeValue.computeIfAbsent(condition.codeValue(), k -> new ArrayList<>()).add(rule);
+            } else {
+                pendingAny.add(rule);
+            }
+        }
+
+        private void freeze() {
+            Map<String, CompiledRule[]> frozen = new HashMap<>();
+            pendingByCodeValue.forEach((code, list) -> frozen.put(code, sorted(list)));
+            byCodeValue = Map.copyOf(frozen);
+            anyCodeValue = sorted(pendingAny);
+            pendingByCodeValue = null;
+            pendingAny = null;
+            for (TrieNode child : children) {
+                child.freeze();
+            }
+        }
+
+        private static CompiledRule[] sorted(List<CompiledRule> list) {
+            if (list.isEmpty()) return NO_RULES;
+            CompiledRule[] array = list.toArray(NO_RULES);
+            Arrays.sort(array, BY_PRECEDENCE);
+            return array;
+        }
+
+        private CompiledRule select(CompiledRule best, String identifier, String codeValue, int length,
+                                    boolean hasTransactionId, int depth) {
+            if (codeValue != null && !byCodeValue.isEmpty()) {
+                CompiledRule[] bucket = byCodeValue.get(codeValue);
+                if (bucket != null) best = firstMatch(bucket, best, identifier, codeValue, length, hasTransactionId, depth);
+            }
+            return firstMatch(anyCodeValue, best, identifier, codeValue, length, hasTransactionId, depth);
+        }
+
+        private static CompiledRule firstMatch(CompiledRule[] bucket, CompiledRule best, String identifier,
+                                               String codeValue, int length, boolean hasTransactionId, int depth) {
+            for (CompiledRule candidate : bucket) {
+                if (!candidate.beats(best)) break;
+                if (candidate.rule.condition().matches(identifier, codeValue, length, hasTransactionId, depth)) {
+                    return candidate;
+                }
+            }
+            return best;
+        }
+    }
+}
+
+
+---------------------------------------
+
+package com.rbs.bdd.infrastructure.config;
+
+import com.rbs.bdd.application.exception.RuleDefinitionException;
+import com.rbs.bdd.common.ServiceConstants;
+import com.rbs.bdd.domain.enums.AccountStatus;
+import com.rbs.bdd.domain.enums.ModulusCheckStatus;
+import com.rbs.bdd.domain.enums.SwitchingStatus;
+import com.rbs.bdd.domain.rules.AccountIndex;
+import com.rbs.bdd.domain.rules.CompiledRuleSet;
+import com.rbs.bdd.domain.rules.RoutingRule;
+import com.rbs.bdd.domain.rules.RuleCondition;
+import com.rbs.bdd.domain.rules.RuleOutcome;
+import io.micrometer.core.instrument.FunctionCounter;
+import io.micrometer.core.instrument.MeterRegistry;
+import org.slf4j.Logger;
+import org.slf4j.LoggerFactory;
+import org.springframework.beans.factory.annotation.Value;
+import org.springframework.context.annotation.Bean;
+import org.springframework.context.annotation.Configuration;
+import org.springframework.core.io.ClassPathResource;
+import org.springframework.core.io.Resource;
+
+import java.io.BufferedReader;
+import java.io.IOException;
+import java.io.InputStreamReader;
+import java.nio.charset.StandardCharsets;
+import java.util.ArrayList;
+import java.util.HashMap;
+import java.util.List;
+import java.util.Map;
+
+/**
+ * Loads the declarative routing rules from {@link ServiceConstants#ROUTING_RULES_PATH}, plus any additional
+ * rule files, and publishes them as a {@link CompiledRuleSet}. Generated account datasets are loaded
+ * separately into an {@link AccountIndex}.
+ * <p>
+ * One rule per line, {@code key=value} pairs separated by {@code ;}; blank lines and lines starting
+ * with {@code #} are ignored. Supported keys:
+ * <ul>
+ *     <li>{@code name}, {@code precedence} (lower wins)</li>
+ *     <li>{@code prefix} or {@code identifier} (exact), plus {@code ukAlias=true} to also match the
+ *     14-character UK basic bank account form of an exact IBAN</li>
+ *     <li>{@code codeValue} / {@code codeValue!}, {@code length} / {@code length!},
+ *     {@code transactionId=present|absent}, {@code mod97=pass|fail}</li>
+ *     <li>{@code respond=ACCOUNT_STATUS,SWITCHING_STATUS[,MODULUS_STATUS]} (the modulus is computed by
+ *     {@code ModulusCheckEngine}; a MODULUS_STATUS overrides it for fixture accounts) or
+ *     {@code error=returnCode:systemReturnCode:systemId:description} (empty parts mean "not reported")</li>
+ * </ul>
+ * Each rule's hit count is published as {@code esp.rules.hits{rule=<name>}}, accounts answered from the
+ * index as {@code esp.rules.hits{rule=accountDataset}}.
+ * </p>
+ */
+@Configuration
+public class RoutingRuleConfig {
+
+    private static final Logger logger = LoggerFactory.getLogger(RoutingRuleConfig.class);
+
+    /**
+     * Compiles the routing rules shipped on the classpath, followed by any rule files listed in
+     * {@code esp.simulator.rules.datasets} (comma-separated resource URLs, e.g. {@code file:}).
+     *
+     * @param datasets additional rule files, in order
+     * @param registry the metrics registry
+     * @return the compiled rule set
+     * @throws RuleDefinitionException if the rules cannot be read or parsed
+     */
+    @Bean
+    public CompiledRuleSet compiledRuleSet(@Value("${esp.simulator.rules.datasets:}") Resource[] datasets,
+                                           MeterRegistry registry) {
+        List<RoutingRule> rules = new ArrayList<>(read(new ClassPathResource(ServiceConstants.ROUTING_RULES_PATH)));
+        for (Resource dataset : datasets) {
+            rules.addAll(read(dataset));
+        }
+        CompiledRuleSet compiled = CompiledRuleSet.compile(rules);
+        logger.info("Compiled {} routing rules from {} and {} datasets",
+                compiled.size(), ServiceConstants.ROUTING_RULES_PATH, datasets.length);
+        for (int i = 0; i < compiled.size(); i++) {
+            int index = i;
+            FunctionCounter.builder("esp.rules.hits", compiled, c -> c.hitCount(index))
+                    .tag("rule", compiled.ruleName(index))
+                    .register(registry);
+        }
+        return compiled;
+    }
+
+    /**
+     * Loads the account datasets listed in {@code esp.simulator.accounts.datasets} (comma-separated
+     * resource URLs) into an {@link AccountIndex}. Each file starts with a header line, followed by one
+     * {@code iban,accountStatus,switchingStatus[,modulusCheckStatus]} line per account; the modulus is
+     * computed unless the fourth column overrides it. Files are streamed, only the index is kept.
+     *
+     * @param datasets the account datasets, in order
+     * @param registry the metrics registry
+     * @return the account index
+     * @throws RuleDefinitionException if a dataset cannot be read or parsed
+     */
+    @Bean
+    public AccountIndex accountIndex(@Value("${esp.simulator.accounts.datasets:}") Resource[] datasets,
+                                     MeterRegistry registry) {
+        AccountIndex.Builder builder = AccountIndex.builder();
+        for (Resource dataset : datasets) {
+            readAccounts(dataset, builder);
+        }
+        AccountIndex index;
+        try {
+            index = builder.build();
+        } catch (IllegalArgumentException e) {
+            throw new RuleDefinitionException("Invalid account dataset", e);
+        }
+        logger.info("Indexed {} accounts from {} datasets", index.size(), datasets.length);
+        FunctionCounter.builder("esp.rules.hits", index, AccountIndex::hits)
+                .tag("rule", AccountIndex.RULE_NAME)
+                .register(registry);
+        return index;
+    }
+
+    private void readAccounts(Resource resource, AccountIndex.Builder builder) {
+        try (BufferedReader reader = new BufferedReader(
+                new InputStreamReader(resource.getInputStream(), StandardCharsets.UTF_8))) {
+            reader.readLine();
+            String line;
+            int lineNumber = 1;
+            while ((line = reader.readLine()) != null) {
+                lineNumber++;
+                if (line.isBlank() || line.startsWith("#")) continue;
+                String[] columns = line.split(",");
+                try {
+                    if (columns.length < 3 || columns.length > 4) {
+                        throw new RuleDefinitionException("Expected three or four columns");
+                    }
+                    builder.add(columns[0].trim(), RuleOutcome.respond(AccountStatus.valueOf(columns[1].trim()),
+                            SwitchingStatus.valueOf(columns[2].trim()),
+                            columns.length == 4 ? ModulusCheckStatus.valueOf(columns[3].trim()) : null));
+                } catch (RuntimeException e) {
+                    throw new RuleDefinitionException("Invalid account on line " + lineNumber + " of "
+                            + resource.getDescription() + ": " + line, e);
+                }
+            }
+        } catch (IOException e) {
+            throw new RuleDefinitionException("Failed to load accounts from " + resource.getDescription(), e);
+        }
+    }
+
+    private List<RoutingRule> read(Resource resource) {
+        try (BufferedReader reader = new BufferedReader(
+                new InputStreamReader(resource.getInputStream(), StandardCharsets.UTF_8))) {
+            return parse(reader.lines().toList());
+        } catch (IOException e) {
+            throw new RuleDefinitionException("Failed to load routing rules from " + resource.getDescription(), e);
+        }
+    }
+
+    /**
+     * Parses rule definition lines.
+     *
+     * @param lines the rule file lines
+     * @return parsed rules, including derived UK aliases, in declaration order
+     * @throws RuleDefinitionException if a line is invalid
+     */
+    public static List<RoutingRule> parse(List<String> lines) {
+        List<RoutingRule> rules = new ArrayList<>();
+        for (int i = 0; i < lines.size(); i++) {
+            String line = lines.get(i).trim();
+            if (line.isEmpty() || line.startsWith("#")) continue;
+            try {
+                rules.addAll(parseLine(line));
+            } catch (RuntimeException e) {
+                throw new RuleDefinitionException("Invalid routing rule on line " + (i + 1) + ": " + line, e);
+            }
+        }
+        return rules;
+    }
+
+    private static List<RoutingRule> parseLine(String line) {
+        Map<String, String> fields = new HashMap<>();
+        for (String pair : line.split(";")) {
+            int eq = pair.indexOf('=');
+            if (eq <= 0) throw new RuleDefinitionException("Expected key=value but found '" + pair + "'");
+            fields.put(pair.substring(0, eq).trim(), pair.substring(eq + 1).trim());
+        }
+
+        String name = required(fields, "name");
+        int precedence = Integer.parseInt(required(fields, "precedence"));
+        boolean exact = fields.containsKey("identifier");
+        String prefix = exact ? fields.get("identifier") : fields.getOrDefault("prefix", "");
+        boolean codeNegated = fields.containsKey("codeValue!");
+        String codeValue = codeNegated ? fields.get("codeValue!") : fields.get("codeValue");
+        boolean lengthNegated = fields.containsKey("length!");
+        String length = lengthNegated ? fields.get("length!") : fields.get("length");
+        String txn = fields.get("transactionId");
+        Boolean txnPresent = txn == null ? null : "present".equalsIgnoreCase(txn);
+        String mod97 = fields.get("mod97");
+        Boolean mod97Valid = mod97 == null ? null : "pass".equalsIgnoreCase(mod97);
+
+        RuleCondition condition = new RuleCondition(prefix, exact, codeValue, codeNegated,
+                length != null ? Integer.parseInt(length) : -1, lengthNegated, txnPresent, mod97Valid);
+        RoutingRule rule = new RoutingRule(name, precedence, condition, parseOutcome(fields));
+
+        if (Boolean.parseBoolean(fields.get("ukAlias"))) {
+            if (!exact) throw new RuleDefinitionException("ukAlias requires an exact identifier");
+            return List.of(rule, rule.ukAlias(ServiceConstants.UK_BASIC_BANK_ACCOUNT));
+        }
+        return List.of(rule);
+    }
+
+    private static RuleOutcome parseOutcome(Map<String, String> fields) {
+        if (fields.containsKey("respond")) {
+            String[] values = fields.get("respond").split(",");
+            if (values.length < 2 || values.length > 3) throw new RuleDefinitionException("respond expects two or three statuses");
+            return RuleOutcome.respond(AccountStatus.valueOf(values[0].trim()),
+                    SwitchingStatus.valueOf(values[1].trim()),
+                    values.length == 3 ? ModulusCheckStatus.valueOf(values[2].trim()) : null);
+        }
+        return parseError(required(fields, "error"));
+    }
+
+    /**
+     * Parses an error specification of the form {@code returnCode:systemReturnCode:systemId:description}.
+     * The description may itself contain {@code :}.
+     *
+     * @param spec the error specification
+     * @return the error outcome
+     * @throws RuleDefinitionException if the specification is incomplete
+     */
+    public static RuleOutcome parseError(String spec) {
+        String[] parts = spec.split(":", 4);
+        if (parts.length != 4) throw new RuleDefinitionException("error expects returnCode:systemReturnCode:systemId:description");
+        return RuleOutcome.error(parts[0], emptyToNull(parts[1]), emptyToNull(parts[2]), parts[3]);
+    }
+
+    private static String required(Map<String, String> fields, String key) {
+        String value = fields.get(key);
+        if (value == null || value.isEmpty()) throw new RuleDefinitionException("Missing '" + key + "'");
+        return value;
+    }
+
+    private static String emptyToNull(String value) {
+        return value == null || value.isEmpty() ? null : value;
+    }
+}
+
+
+---------------------------------------
+
+# rules/account-routing.rules
+
+# Request header checks
+name=missingTransactionId;precedence=10;transactionId=absent;error=ERR001:::Message Not Formatted Correctly. Validation of the message failed in the request, response or exception e.g. XSD or WSDL validations. The input message has failed schema validation for service operation validateArrangementForPayment.
+
+# Identifier shape checks
+name=invalidIbanLength;precedence=20;codeValue=InternationalBankAccountNumber;length!=22;error=ERR006:0013:PMP:Length of IBAN is Invalid
+name=gbIdentifierNotIban;precedence=30;prefix=GB;codeValue!=InternationalBankAccountNumber;error=ERR006::BPP:500|Service GRPUB.OA_GET_SORTCODE_DETAILS.(OA2.2105271236) execution failed due to SQLCODE=-551 SQLSTATE=42501, CPOA001G DOES NOT HAVE THE PRIVILEGE TO PERFORM OPERATION EXECUTE PACKAGE ON OBJECT GRPUB.OA_GET_SORTCODE_DETAILS. Error Location:DSNLJACC:35
+
+# Known accounts (fixture IBANs, their MODULUS_STATUS overrides the computed check)
+name=iban1;precedence=100;identifier=GB29NWBK60161331926801;codeValue=InternationalBankAccountNumber;length=22;ukAlias=true;respond=DOMESTIC_RESTRICTED,SWITCHED,PASS
+name=iban2;precedence=100;identifier=GB82WEST12345698765437;codeValue=InternationalBankAccountNumber;length=22;ukAlias=true;respond=DOMESTIC_RESTRICTED,NOT_SWITCHING,PASS
+name=iban3;precedence=100;identifier=GB94BARC10201530093422;codeValue=InternationalBankAccountNumber;length=22;ukAlias=true;respond=DOMESTIC_UNRESTRICTED,SWITCHED,PASS
+name=iban4;precedence=100;identifier=GB33BUKB20201555555567;codeValue=InternationalBankAccountNumber;length=22;ukAlias=true;respond=DOMESTIC_UNRESTRICTED,NOT_SWITCHING,FAILED
+
+# Unknown accounts (the fixture IBANs above are not checksum-valid, so this must rank after them)
+name=mod97Failure;precedence=200;codeValue=InternationalBankAccountNumber;length=22;mod97=fail;error=ERR006:0020:PMP:MOD97 failure for the IBAN
+
+# Any other account is "account not found". Uncomment to answer every checksum-valid IBAN and every
+# UK basic bank account with a success response instead.
+#name=validIban;precedence=300;codeValue=InternationalBankAccountNumber;length=22;mod97=pass;respond=DOMESTIC_UNRESTRICTED,NOT_SWITCHING
+#name=ukBasicBankAccount;precedence=300;codeValue=UKBasicBankAccountNumber;length=14;respond=DOMESTIC_UNRESTRICTED,NOT_SWITCHING
+
+
+---------------------------------------
+
+<!-- static-response/error-response.xml -->
+<soapenv:Envelope xmlns:nsVer="http://com/rbsg/soa/C040PaymentManagement/ArrValidationForPayment/V01/" xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/">
+   <soapenv:Body>
+      <nsVer:validateArrangementForPaymentResponse>
+         <exception>
+            <responseId>
+               <systemId>ESP</systemId>
+               <transactionId>RESPONSE_ID_PLACEHOLDER</transactionId>
+            </responseId>
+            <refRequestIds>
+               <systemId>RequestID</systemId>
+               <transactionId>TXN_ID_PLACEHOLDER</transactionId>
+            </refRequestIds>
+            <operatingBrand>ALL</operatingBrand>
+            <serviceName>ArrValidationForPayment</serviceName>
+            <operationName>validateArrangementForPayment</operationName>
+            <cmdStatus>Failed</cmdStatus>
+            <cmdNotifications>
+               <returnCode>ERR006</returnCode>
+               <category>Error</category>
+               <description>Unable to Complete Request</description>
+               <timestamp>TIMESTAMP_PLACEHOLDER</timestamp>
+               <systemNotifications>
+                  <returnCode>0000</returnCode>
+                  <category>Error</category>
+                  <description>DESCRIPTION_PLACEHOLDER</description>
+                  <processingId>
+                     <systemId>PMP</systemId>
+                  </processingId>
+               </systemNotifications>
+            </cmdNotifications>
+         </exception>
+      </nsVer:validateArrangementForPaymentResponse>
+   </soapenv:Body>
+</soapenv:Envelope>
+
+
+---------------------------------------
+
+package com.rbs.bdd.domain.modulus;
+
+import com.rbs.bdd.common.ServiceConstants;
+import com.rbs.bdd.domain.enums.ModulusCheckStatus;
+
+import java.util.Arrays;
+import java.util.Comparator;
+import java.util.List;
+import java.util.stream.IntStream;
+
+/**
+ * Computes the ISO 13616 IBAN mod-97 checksum and the UK sort code / account number modulus check.
+ * <p>
+ * All checks work directly on the identifier characters: the mod-97 remainder is folded in one
+ * character at a time and the UK weights are read from flat primitive arrays, so no
+ * {@code BigInteger}, substring or boxed value is created per identifier. The UK weight table uses
+ * the VocaLink layout ({@code sortFrom sortTo MOD10|MOD11|DBLAL w1..w14 [exception]}); sort codes
+ * without a row are not modulus checked and therefore pass. Exception codes are read but not applied,
+ * rows carrying one are evaluated with their standard weights.
+ * </p>
+ */
+public final class ModulusCheckEngine {
+
+    private static final byte METHOD_MOD10 = 0;
+    private static final byte METHOD_MOD11 = 1;
+    private static final byte METHOD_DBLAL = 2;
+    private static final int DIGITS = 14;
+    private static final int GB_IBAN_LENGTH = 22;
+    private static final int GB_IBAN_SORT_CODE_OFFSET = 8;
+    private static final int BULK_CHUNK = 16_384;
+
+    private final int[] rangeStart;
+    private final int[] rangeEnd;
+    private final byte[] method;
+    private final int[] weights;
+
+    private ModulusCheckEngine(int[] rangeStart, int[] rangeEnd, byte[] method, int[] weights) {
+        this.rangeStart = rangeStart;
+        this.rangeEnd = rangeEnd;
+        this.method = method;
+        this.weights = weights;
+    }
+
+    /**
+     * @return an engine without UK weights; only the IBAN checksum is enforced
+     */
+    public static ModulusCheckEngine empty() {
+        return new ModulusCheckEngine(new int[0], new int[0], new byte[0], new int[0]);
+    }
+
+    /**
+     * @return true if a UK weight table is loaded, so checksum-valid accounts can fail the modulus check
+     */
+    public boolean hasWeights() {
+        return rangeStart.length > 0;
+    }
+
+    /**
+     * Builds an engine from weight table lines. Blank lines and lines starting with {@code #} are ignored.
+     *
+     * @param lines the weight table lines
+     * @return the engine
+     * @throws IllegalArgumentException if a row is malformed
+     */
+    public static ModulusCheckEngine parse(List<String> lines) {
+        List<String[]> rows = lines.stream()
+                .map(String::trim)
+                .filter(line -> !line.isEmpty() && !line.startsWith("#"))
+                .map(line -> line.split("\\s+"))
+                .sorted(Comparator.comparingInt(row -> Integer.parseInt(row[0])))
+                .toList();
+
+        int[] start = new int[rows.size()];
+        int[] end = new int[rows.size()];
+        byte[] methods = new byte[rows.size()];
+        int[] table = new int[rows.size() * DIGITS];
+        for (int r = 0; r < rows.size(); r++) {
+            String[] row = rows.get(r);
+            if (row.length < 3 + DIGITS) {
+                throw new IllegalArgumentException("Weight row needs 17 columns: " + String.join(" ", row));
+            }
+            start[r] = Integer.parseInt(row[0]);
+            end[r] = Integer.parseInt(row[1]);
+            methods[r] = switch (row[2]) {
+                case "MOD10" -> METHOD_MOD10;
+                case "MOD11" -> METHOD_MOD11;
+                case "DBLAL" -> METHOD_DBLAL;
+                default -> throw new IllegalArgumentException("Unknown modulus method: " + row[2]);
+            };
+            for (int i = 0; i < DIGITS; i++) {
+                table[r * DIGITS + i] = Integer.parseInt(row[3 + i]);
+            }
+        }
+        return new ModulusCheckEngine(start, end, methods, table);
+    }
+
+    /**
+     * Validates the ISO 13616 mod-97 checksum of an IBAN.
+     *
+     * @param iban the IBAN, upper case without spaces
+     * @return true if the checksum is valid
+     */
+    public static boolean isValidIban(CharSequence iban) {
+        if (iban == null) return false;
+        int length = iban.length();
+        if (length < 15 || length > 34) return false;
+        int remainder = 0;
+        for (int i = 0; i < length; i++) {
+            remainder = mod97Step(remainder, iban.charAt((i + 4) % length));
+            if (remainder < 0) return false;
+        }
+        return remainder == 1;
+    }
+
+    /**
+     * Computes the two IBAN check digits for a country code and BBAN.
+     *
+     * @param countryCode the two-letter country code
+     * @param bban        the basic bank account number
+     * @return the check digits, between 2 and 98
+     * @throws IllegalArgumentException if the input contains characters outside 0-9 and A-Z
+     */
+    public static int ibanCheckDigits(CharSequence countryCode, CharSequence bban) {
+        int remainder = 0;
+        for (int i = 0; i < bban.length(); i++) {
+            remainder = mod97Step(remainder, bban.charAt(i));
+            if (remainder < 0) throw new IllegalArgumentException("Invalid BBAN character at " + i);
+        }
+        for (int i = 0; i < countryCode.length(); i++) {
+            remainder = mod97Step(remainder, countryCode.charAt(i));
+            if (remainder < 0) throw new IllegalArgumentException("Invalid country code");
+        }
+        remainder = (remainder * 100) % 97;
+        return 98 - remainder;
+    }
+
+    private static int mod97Step(int remainder, char c) {
+        if (c >= '0' && c <= '9') return (remainder * 10 + (c - '0')) % 97;
+        if (c >= 'A' && c <= 'Z') return (remainder * 100 + (c - 'A' + 10)) % 97;
+        return -1;
+    }
+
+    /**
+     * Validates 14 digits (6-digit sort code followed by 8-digit account number) against the weight table.
+     *
+     * @param chars  the characters holding the digits
+     * @param offset position of the first sort code digit
+     * @return true if every applicable weight row passes
+     */
+    public boolean isValidUkAccount(CharSequence chars, int offset) {
+        if (chars == null || chars.length() < offset + DIGITS) return false;
+        int sortCode = 0;
+        for (int i = 0; i < DIGITS; i++) {
+            char c = chars.charAt(offset + i);
+            if (c < '0' || c > '9') return false;
+            if (i < 6) sortCode = sortCode * 10 + (c - '0');
+        }
+        int row = firstRow(sortCode);
+        if (row < 0) return true;
+        for (int r = row; r < rangeStart.length && rangeStart[r] == rangeStart[row]; r++) {
+            if (!passes(chars, offset, r)) return false;
+        }
+        return true;
+    }
+
+    /**
+     * Validates an identifier according to its codeValue: mod-97 plus UK modulus for GB IBANs,
+     * UK modulus for 14-character UK basic bank account numbers.
+     *
+     * @param identifier the request identifier
+     * @param codeValue  the request codeValue
+     * @return true if the identifier passes
+     */
+    public boolean isValid(CharSequence identifier, String codeValue) {
+        if (identifier == null) return false;
+        if (ServiceConstants.INTL_BANK_ACCOUNT.equals(codeValue)) {
+            return isValidIban(identifier) && (!isGbIban(identifier) || isValidUkAccount(identifier, GB_IBAN_SORT_CODE_OFFSET));
+        }
+        if (ServiceConstants.UK_BASIC_BANK_ACCOUNT.equals(codeValue)) {
+            return identifier.length() == DIGITS && isValidUkAccount(identifier, 0);
+        }
+        return false;
+    }
+
+    /**
+     * Same as {@link #isValid(CharSequence, String)}, mapped to the response status.
+     *
+     * @param identifier the request identifier
+     * @param codeValue  the request codeValue
+     * @return PASS or FAILED
+     */
+    public ModulusCheckStatus check(CharSequence identifier, String codeValue) {
+        return isValid(identifier, codeValue) ? ModulusCheckStatus.PASS : ModulusCheckStatus.FAILED;
+    }
+
+    /**
+     * Validates a batch of identifiers sharing the same codeValue on the calling thread.
+     *
+     * @param identifiers the identifiers
+     * @param codeValue   their codeValue
+     * @param results     receives the result for each identifier, same length as {@code identifiers}
+     * @return the number of identifiers that passed
+     */
+    public int checkAll(CharSequence[] identifiers, String codeValue, boolean[] results) {
+        requireSameLength(identifiers, results);
+        return checkRange(identifiers, codeValue, results, 0, identifiers.length);
+    }
+
+    /**
+     * Validates a batch of identifiers across the common fork-join pool, in fixed-size chunks.
+     *
+     * @param identifiers the identifiers
+     * @param codeValue   their codeValue
+     * @param results     receives the result for each identifier, same length as {@code identifiers}
+     * @return the number of identifiers that passed
+     */
+    public int checkAllParallel(CharSequence[] identifiers, String codeValue, boolean[] results) {
+        requireSameLength(identifiers, results);
+        int chunks = (identifiers.length + BULK_CHUNK - 1) / BULK_CHUNK;
+        return IntStream.range(0, chunks)
+                .parallel()
+                .map(c -> checkRange(identifiers, codeValue, results, c * BULK_CHUNK,
+                        Math.min(identifiers.length, (c + 1) * BULK_CHUNK)))
+                .sum();
+    }
+
+    private int checkRange(CharSequence[] identifiers, String codeValue, boolean[] results, int from, int to) {
+        int passed = 0;
+        for (int i = from; i < to; i++) {
+            boolean valid = isValid(identifiers[i], codeValue);
+            results[i] = valid;
+            if (valid) passed++;
+        }
+        return passed;
+    }
+
+    private static void requireSameLength(CharSequence[] identifiers, boolean[] results) {
+        if (identifiers.length != results.length) {
+            throw new IllegalArgumentException("results must have the same length as identifiers");
+        }
+    }
+
+    private static boolean isGbIban(CharSequence identifier) {
+        return identifier.length() == GB_IBAN_LENGTH && identifier.charAt(0) == 'G' && identifier.charAt(1) == 'B';
+    }
+
+    private int firstRow(int sortCode) {
+        int lo = 0;
+        int hi = rangeStart.length - 1;
+        int found = -1;
+        while (lo <= hi) {
+            int mid = (lo + hi) >>> 1;
+            if (rangeStart[mid] <= sortCode) {
+                found = mid;
+                lo = mid + 1;
+            } else {
+                hi = mid - 1;
+            }
+        }
+        if (found < 0 || rangeEnd[found] < sortCode) return -1;
+        while (found > 0 && rangeStart[found - 1] == rangeStart[found]) found--;
+        return found;
+    }
+
+    private boolean passes(CharSequence chars, int offset, int row) {
+        int base = row * DIGITS;
+        int total = 0;
+        for (int i = 0; i < DIGITS; i++) {
+            int product = (chars.charAt(offset + i) - '0') * weights[base + i];
+            total += method[row] == METHOD_DBLAL ? product / 10 + product % 10 : product;
+        }
+        return method[row] == METHOD_MOD11 ? total % 11 == 0 : total % 10 == 0;
+    }
+}
+
+
+---------------------------------------
+
+package com.rbs.bdd.application.exception;
+
+/**
+ * Exception thrown when the UK modulus weight table cannot be loaded.
+ */
+public class ModulusTableLoadingException extends RuntimeException {
+
+    /**
+     * Constructs a new ModulusTableLoadingException with a specific message.
+     *
+     * @param message the detail message
+     */
+    public ModulusTableLoadingException(String message) {
+        super(message);
+    }
+
+    /**
+     * Constructs a new ModulusTableLoadingException with a message and cause.
+     *
+     * @param message the detail message
+     * @param cause the cause of the exception
+     */
+    public ModulusTableLoadingException(String message, Throwable cause) {
+        super(message, cause);
+    }
+}
+
+
+---------------------------------------
+
+package com.rbs.bdd.infrastructure.config;
+
+import com.rbs.bdd.application.exception.ModulusTableLoadingException;
+import com.rbs.bdd.common.ServiceConstants;
+import com.rbs.bdd.domain.modulus.ModulusCheckEngine;
+import org.slf4j.Logger;
+import org.slf4j.LoggerFactory;
+import org.springframework.context.annotation.Bean;
+import org.springframework.context.annotation.Configuration;
+import org.springframework.core.io.ClassPathResource;
+
+import java.io.BufferedReader;
+import java.io.IOException;
+import java.io.InputStreamReader;
+import java.nio.charset.StandardCharsets;
+
+/**
+ * Publishes the {@link ModulusCheckEngine} built from the UK weight table at
+ * {@link ServiceConstants#MODULUS_WEIGHTS_PATH}. Without the table only the IBAN checksum is enforced.
+ */
+@Configuration
+public class ModulusCheckConfig {
+
+    private static final Logger logger = LoggerFactory.getLogger(ModulusCheckConfig.class);
+
+    /**
+     * Loads the modulus weight table.
+     *
+     * @return the modulus check engine
+     * @throws ModulusTableLoadingException if the table exists but cannot be read or parsed
+     */
+    @Bean
+    public ModulusCheckEngine modulusCheckEngine() {
+        ClassPathResource resource = new ClassPathResource(ServiceConstants.MODULUS_WEIGHTS_PATH);
+        if (!resource.exists()) {
+            logger.warn("{} not found, UK modulus checking is disabled", ServiceConstants.MODULUS_WEIGHTS_PATH);
+            return ModulusCheckEngine.empty();
+        }
+        try (BufferedReader reader = new BufferedReader(
+                new InputStreamReader(resource.getInputStream(), StandardCharsets.UTF_8))) {
+            return ModulusCheckEngine.parse(reader.lines().toList());
+        } catch (IOException | IllegalArgumentException e) {
+            throw new ModulusTableLoadingException("Failed to load modulus weight table", e);
+        }
+    }
+}
+
+
+---------------------------------------
+
+package com.rbs.bdd.benchmark;
+
+import com.rbs.bdd.common.ServiceConstants;
+import com.rbs.bdd.domain.modulus.ModulusCheckEngine;
+import org.openjdk.jmh.annotations.Benchmark;
+import org.openjdk.jmh.annotations.BenchmarkMode;
+import org.openjdk.jmh.annotations.Fork;
+import org.openjdk.jmh.annotations.Measurement;
+import org.openjdk.jmh.annotations.Mode;
+import org.openjdk.jmh.annotations.OutputTimeUnit;
+import org.openjdk.jmh.annotations.Param;
+import org.openjdk.jmh.annotations.Scope;
+import org.openjdk.jmh.annotations.Setup;
+import org.openjdk.jmh.annotations.State;
+import org.openjdk.jmh.annotations.Warmup;
+
+import java.util.List;
+import java.util.SplittableRandom;
+import java.util.concurrent.TimeUnit;
+
+/**
+ * JMH benchmarks for {@link ModulusCheckEngine}: single-identifier latency and bulk throughput,
+ * sequential and parallel. Run with {@code ./gradlew jmh} (src/jmh/java).
+ */
+@State(Scope.Benchmark)
+@Fork(1)
+@Warmup(iterations = 3, time = 2)
+@Measurement(iterations = 5, time = 2)
+public class ModulusCheckBenchmark {
+
+    @Param({"1000000"})
+    private int size;
+
+    private ModulusCheckEngine engine;
+    private String[] ibans;
+    private boolean[] results;
+    private int next;
+
+    /**
+     * Generates checksum-valid GB IBANs and a small weight table covering part of the sort code space.
+     */
+    @Setup
+    public void setUp() {
+        engine = ModulusCheckEngine.parse(List.of(
+                "070116 070116 MOD10 0 0 0 0 0 0 2 1 2 1 2 1 2 1",
+                "200000 209999 MOD11 0 0 0 0 0 0 8 7 6 5 4 3 2 1",
+                "600000 609999 DBLAL 2 1 2 1 2 1 2 1 2 1 2 1 2 1"));
+        SplittableRandom random = new SplittableRandom(42);
+        ibans = new String[size];
+        results = new boolean[size];
+        for (int i = 0; i < size; i++) {
+            String bban = "NWBK" + String.format("%06d%08d", random.nextInt(1_000_000), random.nextInt(100_000_000));
+            ibans[i] = String.format("GB%02d%s", ModulusCheckEngine.ibanCheckDigits("GB", bban), bban);
+        }
+    }
+
+    @Benchmark
+    @BenchmarkMode(Mode.AverageTime)
+    @OutputTimeUnit(TimeUnit.NANOSECONDS)
+    public boolean single() {
+        String iban = ibans[next];
+        next = next + 1 == size ? 0 : next + 1;
+        return engine.isValid(iban, ServiceConstants.INTL_BANK_ACCOUNT);
+    }
+
+    @Benchmark
+    @BenchmarkMode(Mode.Throughput)
+    @OutputTimeUnit(TimeUnit.SECONDS)
+    public int bulkSequential() {
+        return engine.checkAll(ibans, ServiceConstants.INTL_BANK_ACCOUNT, results);
+    }
+
+    @Benchmark
+    @BenchmarkMode(Mode.Throughput)
+    @OutputTimeUnit(TimeUnit.SECONDS)
+    public int bulkParallel() {
+        return engine.checkAllParallel(ibans, ServiceConstants.INTL_BANK_ACCOUNT, results);
+    }
+}
+
+
+---------------------------------------
+
+package com.rbs.bdd.domain.sortcode;
+
+import com.rbs.bdd.common.ServiceConstants;
+import com.rbs.bdd.domain.rules.RuleOutcome;
+
+import java.util.ArrayList;
+import java.util.Arrays;
+import java.util.HashMap;
+import java.util.LinkedHashMap;
+import java.util.List;
+import java.util.Map;
+import java.util.stream.IntStream;
+
+/**
+ * In-memory sort code directory standing in for {@code GRPUB.OA_GET_SORTCODE_DETAILS}.
+ * <p>
+ * Sort codes are held as a sorted {@code int[]} and looked up by binary search; bank names are
+ * dictionary-encoded because a handful of banks own most sort codes. Injected failures are kept in
+ * their own sorted array so they can target sort codes that are not in the directory.
+ * </p>
+ */
+public final class SortCodeDirectory {
+
+    private static final int GB_IBAN_LENGTH = 22;
+    private static final int GB_IBAN_SORT_CODE_OFFSET = 8;
+    private static final int UK_ACCOUNT_LENGTH = 14;
+
+    private final int[] sortCodes;
+    private final int[] bankIds;
+    private final String[] bankNames;
+    private final String[] branchNames;
+    private final int[] failureSortCodes;
+    private final RuleOutcome[] failures;
+
+    private SortCodeDirectory(int[] sortCodes, int[] bankIds, String[] bankNames, String[] branchNames,
+                              int[] failureSortCodes, RuleOutcome[] failures) {
+        this.sortCodes = sortCodes;
+        this.bankIds = bankIds;
+        this.bankNames = bankNames;
+        this.branchNames = branchNames;
+        this.failureSortCodes = failureSortCodes;
+        this.failures = failures;
+    }
+
+    /**
+     * @return a directory without entries or failures
+     */
+    public static SortCodeDirectory empty() {
+        return builder().build();
+    }
+
+    /**
+     * @return a builder collecting directory rows and injected failures
+     */
+    public static Builder builder() {
+        return new Builder();
+    }
+
+    /**
+     * Reads the six sort code digits of a GB IBAN or a UK basic bank account number.
+     *
+     * @param identifier the request identifier
+     * @param codeValue  the request codeValue
+     * @return the sort code, or -1 if the identifier does not carry one
+     */
+    public static int sortCodeOf(CharSequence identifier, String codeValue) {
+        if (identifier == null) return -1;
+        if (ServiceConstants.INTL_BANK_ACCOUNT.equals(codeValue) && identifier.length() == GB_IBAN_LENGTH
+                && identifier.charAt(0) == 'G' && identifier.charAt(1) == 'B') {
+            return parseSortCode(identifier, GB_IBAN_SORT_CODE_OFFSET);
+        }
+        if (ServiceConstants.UK_BASIC_BANK_ACCOUNT.equals(codeValue) && identifier.length() == UK_ACCOUNT_LENGTH) {
+            return parseSortCode(identifier, 0);
+        }
+        return -1;
+    }
+
+    /**
+     * Parses six digits starting at {@code offset}.
+     *
+     * @param chars  the characters
+     * @param offset position of the first digit
+     * @return the sort code, or -1 if the characters are not six digits
+     */
+    public static int parseSortCode(CharSequence chars, int offset) {
+        if (chars.length() < offset + 6) return -1;
+        int sortCode = 0;
+        for (int i = offset; i < offset + 6; i++) {
+            char c = chars.charAt(i);
+            if (c < '0' || c > '9') return -1;
+            sortCode = sortCode * 10 + (c - '0');
+        }
+        return sortCode;
+    }
+
+    /**
+     * @param sortCode the sort code
+     * @return the entry index, or -1 if the sort code is not in the directory
+     */
+    public int indexOf(int sortCode) {
+        if (sortCode < 0) return -1;
+        int index = Arrays.binarySearch(sortCodes, sortCode);
+        return index >= 0 ? index : -1;
+    }
+
+    /**
+     * @param fromSortCode inclusive lower bound
+     * @return index of the first entry with a sort code greater or equal to {@code fromSortCode}
+     */
+    public int rangeStart(int fromSortCode) {
+        int index = Arrays.binarySearch(sortCodes, fromSortCode);
+        return index >= 0 ? index : -index - 1;
+    }
+
+    /**
+     * @param toSortCode inclusive upper bound
+     * @return index after the last entry with a sort code lower or equal to {@code toSortCode}
+     */
+    public int rangeEnd(int toSortCode) {
+        int index = Arrays.binarySearch(sortCodes, toSortCode);
+        return index >= 0 ? index + 1 : -index - 1;
+    }
+
+    /**
+     * Returns the entry indexes whose sort code falls in {@code [fromSortCode, toSortCode]}.
+     *
+     * @param fromSortCode inclusive lower bound
+     * @param toSortCode   inclusive upper bound
+     * @return the entry indexes, in sort code order
+     */
+    public IntStream range(int fromSortCode, int toSortCode) {
+        return IntStream.range(rangeStart(fromSortCode), Math.max(rangeStart(fromSortCode), rangeEnd(toSortCode)));
+    }
+
+    public int sortCode(int index) {
+        return sortCodes[index];
+    }
+
+    public String bankName(int index) {
+        return bankNames[bankIds[index]];
+    }
+
+    public String branchName(int index) {
+        return branchNames[index];
+    }
+
+    public int size() {
+        return sortCodes.length;
+    }
+
+    /**
+     * @param sortCode the sort code
+     * @return the injected failure attached to the sort code, or null
+     */
+    public RuleOutcome failureFor(int sortCode) {
+        if (sortCode < 0) return null;
+        int index = Arrays.binarySearch(failureSortCodes, sortCode);
+        return index >= 0 ? failures[index] : null;
+    }
+
+    /**
+     * Collects rows in any order and sorts them into the primitive index on {@link #build()}.
+     */
+    public static final class Builder {
+        private final List<int[]> rows = new ArrayList<>();
+        private final List<String> branches = new ArrayList<>();
+        private final Map<String, Integer> bankDictionary = new LinkedHashMap<>();
+        private final Map<Integer, RuleOutcome> injected = new HashMap<>();
+
+        private Builder() {
+        }
+
+        /**
+         * @param sortCode   the six-digit sort code
+         * @param bankName   the owning bank
+         * @param branchName the branch
+         * @return this builder
+         */
+        public Builder add(int sortCode, String bankName, String branchName) {
+            int bankId = bankDictionary.computeIfAbsent(bankName, k -> bankDictionary.size());
+            rows.add(new int[] {sortCode, bankId, branches.size()});
+            branches.add(branchName);
+            return this;
+        }
+
+        /**
+         * @param sortCode the sort code the failure is attached to
+         * @param failure  the error outcome returned for it
+         * @return this builder
+         */
+        public Builder fail(int sortCode, RuleOutcome failure) {
+            injected.put(sortCode, failure);
+            return this;
+        }
+
+        /**
+         * @return the directory
+         * @throws IllegalArgumentException if a sort code appears twice
+         */
+        public SortCodeDirectory build() {
+            rows.sort((a, b) -> Integer.compare(a[0], b[0]));
+            int[] codes = new int[rows.size()];
+            int[] banks = new int[rows.size()];
+            String[] branchNames = new String[rows.size()];
+            for (int i = 0; i < rows.size(); i++) {
+                int[] row = rows.get(i);
+                if (i > 0 && codes[i - 1] == row[0]) {
+                    throw new IllegalArgumentException("Duplicate sort code " + row[0]);
+                }
+                codes[i] = row[0];
+                banks[i] = row[1];
+                branchNames[i] = branches.get(row[2]);
+            }
+            int[] failureCodes = injected.keySet().stream().mapToInt(Integer::intValue).sorted().toArray();
+            RuleOutcome[] failureOutcomes = new RuleOutcome[failureCodes.length];
+            for (int i = 0; i < failureCodes.length; i++) {
+                failureOutcomes[i] = injected.get(failureCodes[i]);
+            }
+            return new SortCodeDirectory(codes, banks, bankDictionary.keySet().toArray(new String[0]), branchNames,
+                    failureCodes, failureOutcomes);
+        }
+    }
+}
+
+
+---------------------------------------
+
+package com.rbs.bdd.application.exception;
+
+/**
+ * Exception thrown when the sort code directory or its injected failures cannot be loaded.
+ */
+public class SortCodeDirectoryException extends RuntimeException {
+
+    /**
+     * Constructs a new SortCodeDirectoryException with a specific message.
+     *
+     * @param message the detail message
+     */
+    public SortCodeDirectoryException(String message) {
+        super(message);
+    }
+
+    /**
+     * Constructs a new SortCodeDirectoryException with a message and cause.
+     *
+     * @param message the detail message
+     * @param cause the cause of the exception
+     */
+    public SortCodeDirectoryException(String message, Throwable cause) {
+        super(message, cause);
+    }
+}
+
+
+---------------------------------------
+
+package com.rbs.bdd.infrastructure.config;
+
+import com.rbs.bdd.application.exception.SortCodeDirectoryException;
+import com.rbs.bdd.common.ServiceConstants;
+import com.rbs.bdd.domain.sortcode.SortCodeDirectory;
+import org.slf4j.Logger;
+import org.slf4j.LoggerFactory;
+import org.springframework.beans.factory.annotation.Value;
+import org.springframework.context.annotation.Bean;
+import org.springframework.context.annotation.Configuration;
+import org.springframework.core.io.Resource;
+
+import java.io.BufferedReader;
+import java.io.IOException;
+import java.io.InputStreamReader;
+import java.nio.charset.StandardCharsets;
+import java.util.List;
+
+/**
+ * Loads the {@link SortCodeDirectory} and its injected failures.
+ * <p>
+ * Both locations accept any Spring resource URL, so a local file can be used with {@code file:}:
+ * <ul>
+ *     <li>{@code esp.simulator.sortcode.directory}: CSV with header {@code sortCode,bankName,branchName}</li>
+ *     <li>{@code esp.simulator.sortcode.failures}: one {@code sortCode=NNNNNN;error=returnCode:systemReturnCode:systemId:description}
+ *     per line, same error format as the routing rules</li>
+ * </ul>
+ * Missing files leave the directory empty.
+ * </p>
+ */
+@Configuration
+public class SortCodeDirectoryConfig {
+
+    private static final Logger logger = LoggerFactory.getLogger(SortCodeDirectoryConfig.class);
+
+    /**
+     * Builds the sort code directory.
+     *
+     * @param directory the directory CSV
+     * @param failures  the injected failure definitions
+     * @return the sort code directory
+     * @throws SortCodeDirectoryException if a file exists but cannot be read or parsed
+     */
+    @Bean
+    public SortCodeDirectory sortCodeDirectory(
+            @Value("${esp.simulator.sortcode.directory:" + ServiceConstants.SORT_CODE_DIRECTORY_PATH + "}") Resource directory,
+            @Value("${esp.simulator.sortcode.failures:" + ServiceConstants.SORT_CODE_FAILURES_PATH + "}") Resource failures) {
+        SortCodeDirectory.Builder builder = SortCodeDirectory.builder();
+        try {
+            List<String> rows = readLines(directory);
+            for (int i = 1; i < rows.size(); i++) {
+                String[] columns = rows.get(i).split(",", 3);
+                if (columns.length != 3) throw new SortCodeDirectoryException("Invalid directory row " + (i + 1));
+                builder.add(Integer.parseInt(columns[0].trim()), columns[1].trim(), columns[2].trim());
+            }
+            for (String line : readLines(failures)) {
+                if (!line.startsWith("sortCode=")) throw new SortCodeDirectoryException("Invalid failure: " + line);
+                String[] parts = line.split(";error=", 2);
+                if (parts.length != 2) throw new SortCodeDirectoryException("Invalid failure: " + line);
+                builder.fail(Integer.parseInt(parts[0].substring("sortCode=".length()).trim()),
+                        RoutingRuleConfig.parseError(parts[1]));
+            }
+            SortCodeDirectory sortCodes = builder.build();
+            logger.info("Loaded {} sort codes from {}", sortCodes.size(), directory.getDescription());
+            return sortCodes;
+        } catch (IOException | IllegalArgumentException e) {
+            throw new SortCodeDirectoryException("Failed to load sort code directory", e);
+        }
+    }
+
+    private List<String> readLines(Resource resource) throws IOException {
+        if (!resource.exists()) {
+            logger.warn("{} not found", resource.getDescription());
+            return List.of();
+        }
+        try (BufferedReader reader = new BufferedReader(
+                new InputStreamReader(resource.getInputStream(), StandardCharsets.UTF_8))) {
+            return reader.lines()
+                    .map(String::trim)
+                    .filter(line -> !line.isEmpty() && !line.startsWith("#"))
+                    .toList();
+        }
+    }
+}
+
+
+---------------------------------------
+
+# sortcode/sortcode-directory.csv
+sortCode,bankName,branchName
+102015,Barclays Bank PLC,Leicester
+123456,Westminster Bank,London City
+202015,Barclays Bank UK PLC,Birmingham
+309634,Lloyds Bank PLC,Edinburgh
+601613,National Westminster Bank PLC,Piccadilly
+
+
+---------------------------------------
+
+# sortcode/failures.rules
+# Applied before the routing rules miss, e.g. GB07LOYD30963412345678 (warm-up scenario sortCodeFailure)
+sortCode=309634;error=ERR006::BPP:500|Service GRPUB.OA_GET_SORTCODE_DETAILS.(OA2.2105271236) execution failed due to SQLCODE=-551 SQLSTATE=42501, CPOA001G DOES NOT HAVE THE PRIVILEGE TO PERFORM OPERATION EXECUTE PACKAGE ON OBJECT GRPUB.OA_GET_SORTCODE_DETAILS. Error Location:DSNLJACC:35
+
+
+---------------------------------------
+
+package com.rbs.bdd.infrastructure.config;
+
+import java.io.ByteArrayOutputStream;
+import java.io.IOException;
+import java.io.UncheckedIOException;
+import java.util.Arrays;
+import java.util.Collections;
+import java.util.LinkedHashMap;
+import java.util.Map;
+import java.util.concurrent.atomic.LongAdder;
+import java.util.zip.DeflaterOutputStream;
+import java.util.zip.GZIPOutputStream;
+
+/**
+ * Bounded cache of compressed variants keyed by the uncompressed bytes.
+ * <p>
+ * Static documents (WSDL/XSD) are byte-identical on every fetch, so their gzip and deflate forms are
+ * compressed once through {@link #compress} and served from here afterwards. Entries are compared on the
+ * full content, so a hash collision can never return another body. SOAP responses carry a fresh
+ * transaction id and timestamp, so they would never hit; they go through {@link #compressOnce} and are
+ * not kept. SOAP bodies that are sent repeatedly, the precompiled faults and replayed responses, are
+ * compressed ahead of time through {@link #precompress} and found by {@link #precompressed}. Also records
+ * the compression ratio and the time spent compressing.
+ * </p>
+ */
+public class CompressedVariantCache {
+
+    /**
+     * Supported content codings.
+     */
+    public enum Coding {
+        GZIP("gzip"),
+        DEFLATE("deflate");
+
+        private final String value;
+
+        Coding(String value) {
+            this.value = value;
+        }
+
+        public String getValue() {
+            return value;
+        }
+    }
+
+    private final Map<Key, byte[]> variants;
+    private final Map<Key, byte[]> precompressedVariants;
+    private final LongAdder uncompressedBytes = new LongAdder();
+    private final LongAdder compressedBytes = new LongAdder();
+    private final LongAdder compressNanos = new LongAdder();
+    private final LongAdder compressions = new LongAdder();
+    private final LongAdder cacheHits = new LongAdder();
+
+    /**
+     * @param maxEntries        maximum number of cached variants, least recently used are evicted first
+     * @param maxPrecompressed  maximum number of pre-compressed SOAP variants, least recently used are evicted first
+     */
+    public CompressedVariantCache(int maxEntries, int maxPrecompressed) {
+        this.variants = boundedMap(maxEntries);
+        this.precompressedVariants = boundedMap(maxPrecompressed);
+    }
+
+    private static Map<Key, byte[]> boundedMap(int maxEntries) {
+        return Collections.synchronizedMap(new LinkedHashMap<>(16, 0.75f, true) {
+            @Override
+            protected boolean removeEldestEntry(Map.Entry<Key, byte[]> eldest) {
+                return size() > maxEntries;
+            }
+        });
+    }
+
+    /**
+     * Returns the compressed form of {@code body}, compressing only on a cache miss.
+     *
+     * @param body   the uncompressed bytes
+     * @param length number of valid bytes in {@code body}
+     * @param coding the content coding
+     * @return the compressed bytes
+     */
+    public byte[] compress(byte[] body, int length, Coding coding) {
+        byte[] content = body.length == length ? body : Arrays.copyOf(body, length);
+        Key key = new Key(coding, content);
+        byte[] cached = variants.get(key);
+        uncompressedBytes.add(length);
+        if (cached != null) {
+            cacheHits.increment();
+            compressedBytes.add(cached.length);
+            return cached;
+        }
+        long start = System.nanoTime();
+        byte[] compressed = encode(content, length, coding);
+        compressNanos.add(System.nanoTime() - start);
+        compressions.increment();
+        compressedBytes.add(compressed.length);
+        variants.put(key, compressed);
+        return compressed;
+    }
+
+    /**
+     * Compresses a body that is unique to one response, without looking it up or keeping it.
+     *
+     * @param body   the uncompressed bytes
+     * @param length number of valid bytes in {@code body}
+     * @param coding the content coding
+     * @return the compressed bytes
+     */
+    public byte[] compressOnce(byte[] body, int length, Coding coding) {
+        uncompressedBytes.add(length);
+        long start = System.nanoTime();
+        byte[] compressed = encode(body, length, coding);
+        compressNanos.add(System.nanoTime() - start);
+        compressions.increment();
+        compressedBytes.add(compressed.length);
+        return compressed;
+    }
+
+    /**
+     * Builds the gzip and deflate variants of a SOAP body that will be sent again, such as a precompiled
+     * fault at startup or a response stored for replay.
+     *
+     * @param body the complete uncompressed body, as written to the HTTP response
+     */
+    public void precompress(byte[] body) {
+        for (Coding coding : Coding.values()) {
+            long start = System.nanoTime();
+            byte[] compressed = encode(body, body.length, coding);
+            compressNanos.add(System.nanoTime() - start);
+            compressions.increment();
+            precompressedVariants.put(new Key(coding, body), compressed);
+        }
+    }
+
+    /**
+     * Looks up a variant built by {@link #precompress}.
+     *
+     * @param body   the uncompressed bytes
+     * @param length number of valid bytes in {@code body}
+     * @param coding the content coding
+     * @return the compressed bytes, or null if {@code body} was not pre-compressed
+     */
+    public byte[] precompressed(byte[] body, int length, Coding coding) {
+        if (precompressedVariants.isEmpty()) return null;
+        byte[] content = body.length == length ? body : Arrays.copyOf(body, length);
+        byte[] cached = precompressedVariants.get(new Key(coding, content));
+        if (cached != null) {
+            uncompressedBytes.add(length);
+            compressedBytes.add(cached.length);
+            cacheHits.increment();
+        }
+        return cached;
+    }
+
+    /**
+     * @return snapshot of the compression statistics
+     */
+    public CompressionStats stats() {
+        return new CompressionStats(uncompressedBytes.sum(), compressedBytes.sum(), compressions.sum(),
+                cacheHits.sum(), compressNanos.sum());
+    }
+
+    private static byte[] encode(byte[] content, int length, Coding coding) {
+        ByteArrayOutputStream out = new ByteArrayOutputStream(Math.max(64, length / 4));
+        try (DeflaterOutputStream zip = coding == Coding.GZIP ? new GZIPOutputStream(out) : new DeflaterOutputStream(out)) {
+            zip.write(content, 0, length);
+        } catch (IOException e) {
+            throw new UncheckedIOException(e);
+        }
+        return out.toByteArray();
+    }
+
+    /**
+     * Cache key comparing the full content; the hash is computed once.
+     */
+    private static final class Key {
+        private final Coding coding;
+        private final byte[] content;
+        private final int hash;
+
+        private Key(Coding coding, byte[] content) {
+            this.coding = coding;
+            this.content = content;
+            this.hash = 31 * coding.hashCode() + Arrays.hashCode(content);
+        }
+
+        @Override
+        public boolean equals(Object o) {
+            return o instanceof Key other && coding == other.coding && hash == other.hash
+                    && Arrays.equals(content, other.content);
+        }
+
+        @Override
+        public int hashCode() {
+            return hash;
+        }
+    }
+
+    /**
+     * Compression statistics.
+     *
+     * @param uncompressedBytes bytes before compression
+     * @param compressedBytes   bytes sent compressed
+     * @param compressions      bodies actually compressed
+     * @param cacheHits         bodies served from a pre-compressed variant
+     * @param compressNanos     wall time spent compressing
+     */
+    public record CompressionStats(long uncompressedBytes, long compressedBytes, long compressions,
+                                   long cacheHits, long compressNanos) {
+
+        /**
+         * @return compressed size as a fraction of the uncompressed size
+         */
+        public double ratio() {
+            return uncompressedBytes == 0 ? 1.0 : (double) compressedBytes / uncompressedBytes;
+        }
+
+        /**
+         * @return average compression cost per compressed body in microseconds
+         */
+        public double averageCompressMicros() {
+            return compressions == 0 ? 0.0 : compressNanos / 1_000.0 / compressions;
+        }
+    }
+}
+
+
+---------------------------------------
+
+package com.rbs.bdd.infrastructure.config;
+
+import jakarta.servlet.FilterChain;
+import jakarta.servlet.ReadListener;
+import jakarta.servlet.ServletException;
+import jakarta.servlet.ServletInputStream;
+import jakarta.servlet.http.HttpServletRequest;
+import jakarta.servlet.http.HttpServletRequestWrapper;
+import jakarta.servlet.http.HttpServletResponse;
+import org.slf4j.Logger;
+import org.slf4j.LoggerFactory;
+import org.springframework.http.HttpHeaders;
+import org.springframework.web.filter.OncePerRequestFilter;
+import org.springframework.web.util.ContentCachingResponseWrapper;
+
+import java.io.ByteArrayInputStream;
+import java.io.EOFException;
+import java.io.IOException;
+import java.io.InputStream;
+import java.util.Locale;
+import java.util.concurrent.atomic.AtomicLong;
+import java.util.zip.GZIPInputStream;
+import java.util.zip.InflaterInputStream;
+import java.util.zip.ZipException;
+
+/**
+ * Servlet filter adding HTTP compression to the {@code MessageDispatcherServlet} path.
+ * <p>
+ * Request bodies sent with {@code Content-Encoding: gzip|deflate} are inflated into memory before Spring WS
+ * reads them; a body inflating beyond the configured maximum is rejected with 413, any other content coding
+ * with 415 and a corrupt compressed body with 400. Responses are buffered and, when the client accepts gzip
+ * or deflate and the body is larger than the configured minimum, served from a variant built by
+ * {@link CompressedVariantCache#precompress} (precompiled faults, replayed responses) or else compressed
+ * through {@link CompressedVariantCache#compressOnce}; other SOAP responses are unique per request, so they
+ * are not cached.
+ * </p>
+ */
+public class SoapCompressionFilter extends OncePerRequestFilter {
+
+    private static final Logger logger = LoggerFactory.getLogger(SoapCompressionFilter.class);
+    private static final long STATS_LOG_INTERVAL = 10_000;
+
+    private final CompressedVariantCache variants;
+    private final int minSize;
+    private final int maxInflatedSize;
+    private final AtomicLong compressedResponses = new AtomicLong();
+
+    /**
+     * @param variants        cache of compressed variants
+     * @param minSize         smallest response body worth compressing, in bytes
+     * @param maxInflatedSize largest accepted request body after inflating, in bytes
+     */
+    public SoapCompressionFilter(CompressedVariantCache variants, int minSize, int maxInflatedSize) {
+        this.variants = variants;
+        this.minSize = minSize;
+        this.maxInflatedSize = maxInflatedSize;
+    }
+
+    @Override
+    protected void doFilterInternal(HttpServletRequest request, HttpServletResponse response, FilterChain chain)
+            throws ServletException, IOException {
+        HttpServletRequest effectiveRequest = decompressIfNeeded(request, response);
+        if (effectiveRequest == null) return;
+        CompressedVariantCache.Coding coding = negotiate(request.getHeader(HttpHeaders.ACCEPT_ENCODING));
+        if (coding == null) {
+            chain.doFilter(effectiveRequest, response);
+            return;
+        }
+
+        ContentCachingResponseWrapper buffered = new ContentCachingResponseWrapper(response);
+        chain.doFilter(effectiveRequest, buffered);
+
+        int length = buffered.getContentSize();
+        response.addHeader(HttpHeaders.VARY, HttpHeaders.ACCEPT_ENCODING);
+        if (length < minSize || buffered.containsHeader(HttpHeaders.CONTENT_ENCODING)) {
+            buffered.copyBodyToResponse();
+            return;
+        }
+        byte[] body = buffered.getContentAsByteArray();
+        byte[] compressed = variants.precompressed(body, length, coding);
+        if (compressed == null) compressed = variants.compressOnce(body, length, coding);
+        buffered.resetBuffer();
+        response.setHeader(HttpHeaders.CONTENT_ENCODING, coding.getValue());
+        response.setContentLength(compressed.length);
+        response.getOutputStream().write(compressed);
+        logger.debug("Compressed SOAP response {} -> {} bytes ({})", length, compressed.length, coding.getValue());
+        if (compressedResponses.incrementAndGet() % STATS_LOG_INTERVAL == 0) {
+            CompressedVariantCache.CompressionStats stats = variants.stats();
+            logger.info("SOAP compression: ratio {}, {} compressed, {} pre-compressed hits, {} us avg CPU per compression",
+                    String.format("%.3f", stats.ratio()), stats.compressions(), stats.cacheHits(),
+                    String.format("%.1f", stats.averageCompressMicros()));
+        }
+    }
+
+    /**
+     * Picks gzip over deflate when both are acceptable; a {@code q=0} entry disables a coding.
+     *
+     * @param acceptEncoding the Accept-Encoding header
+     * @return the coding to use, or null for identity
+     */
+    static CompressedVariantCache.Coding negotiate(String acceptEncoding) {
+        if (acceptEncoding == null) return null;
+        boolean deflate = false;
+        for (String entry : acceptEncoding.toLowerCase(Locale.ROOT).split(",")) {
+            String[] parts = entry.trim().split(";");
+            if (parts[0].isEmpty() || isRejected(parts)) continue;
+            if ("gzip".equals(parts[0]) || "*".equals(parts[0])) return CompressedVariantCache.Coding.GZIP;
+            if ("deflate".equals(parts[0])) deflate = true;
+        }
+        return deflate ? CompressedVariantCache.Coding.DEFLATE : null;
+    }
+
+    private static boolean isRejected(String[] parts) {
+        for (int i = 1; i < parts.length; i++) {
+            String param = parts[i].trim();
+            if (param.startsWith("q=")) {
+                try {
+                    return Double.parseDouble(param.substring(2)) <= 0.0;
+                } catch (NumberFormatException e) {
+                    return true;
+                }
+            }
+        }
+        return false;
+    }
+
+    /**
+     * Inflates a compressed request body, at most {@code maxInflatedSize} bytes of it.
+     *
+     * @return the request to pass on, or null if an error status was sent instead
+     */
+    private HttpServletRequest decompressIfNeeded(HttpServletRequest request, HttpServletResponse response)
+            throws IOException {
+        String encoding = request.getHeader(HttpHeaders.CONTENT_ENCODING);
+        if (encoding == null) return request;
+        String coding = encoding.trim().toLowerCase(Locale.ROOT);
+        if (coding.isEmpty() || "identity".equals(coding)) return request;
+        if (!"gzip".equals(coding) && !"deflate".equals(coding)) {
+            response.sendError(HttpServletResponse.SC_UNSUPPORTED_MEDIA_TYPE,
+                    "Unsupported Content-Encoding: " + encoding);
+            return null;
+        }
+        byte[] body;
+        try (InputStream inflated = "gzip".equals(coding)
+                ? new GZIPInputStream(request.getInputStream())
+                : new InflaterInputStream(request.getInputStream())) {
+            body = inflated.readNBytes(maxInflatedSize + 1);
+        } catch (ZipException | EOFException e) {
+            response.sendError(HttpServletResponse.SC_BAD_REQUEST, "Invalid " + coding + " request body");
+            return null;
+        }
+        if (body.length > maxInflatedSize) {
+            logger.warn("Rejected {} request body inflating beyond {} bytes", coding, maxInflatedSize);
+            response.sendError(HttpServletResponse.SC_REQUEST_ENTITY_TOO_LARGE,
+                    "Request body exceeds " + maxInflatedSize + " bytes");
+            return null;
+        }
+        return new DecompressingRequest(request, body);
+    }
+
+    /**
+     * Request wrapper exposing the inflated body and hiding the original encoding.
+     */
+    private static final class DecompressingRequest extends HttpServletRequestWrapper {
+        private final ServletInputStream body;
+        private final int length;
+
+        private DecompressingRequest(HttpServletRequest request, byte[] content) {
+            super(request);
+            this.length = content.length;
+            InputStream inflated = new ByteArrayInputStream(content);
+            this.body = new ServletInputStream() {
+                private boolean finished;
+
+                @Override
+                public int read() throws IOException {
+                    int b = inflated.read();
+                    finished = b < 0;
+                    return b;
+                }
+
+                @Override
+                public int read(byte[] buffer, int offset, int length) throws IOException {
+                    int n = inflated.read(buffer, offset, length);
+                    finished = n < 0;
+                    return n;
+                }
+
+                @Override
+                public boolean isFinished() {
+                    return finished;
+                }
+
+                @Override
+                public boolean isReady() {
+                    return true;
+                }
+
+                @Override
+                public void setReadListener(ReadListener listener) {
+                    throw new UnsupportedOperationException("Non-blocking reads are not supported");
+                }
+            };
+        }
+
+        @Override
+        public ServletInputStream getInputStream() {
+            return body;
+        }
+
+        @Override
+        public String getHeader(String name) {
+            return HttpHeaders.CONTENT_ENCODING.equalsIgnoreCase(name) ? null : super.getHeader(name);
+        }
+
+        @Override
+        public int getContentLength() {
+            return length;
+        }
+
+        @Override
+        public long getContentLengthLong() {
+            return length;
+        }
+    }
+}
+
+
+---------------------------------------
+
+package com.rbs.bdd.infrastructure.profiling;
+
+import jdk.jfr.Category;
+import jdk.jfr.Description;
+import jdk.jfr.Event;
+import jdk.jfr.Label;
+import jdk.jfr.Name;
+import jdk.jfr.StackTrace;
+
+/**
+ * Java Flight Recorder event spanning one {@code validateArrangementForPayment} request.
+ */
+@Name("com.rbs.bdd.SoapRequest")
+@Label("SOAP Request")
+@Category({"ESP Simulator", "SOAP"})
+@Description("One validateArrangementForPayment request through the Spring WS pipeline")
+@StackTrace(false)
+public class SoapRequestEvent extends Event {
+
+    @Label("Scenario")
+    String scenario;
+
+    @Label("Transaction Id")
+    String transactionId;
+
+    @Label("Outcome")
+    String outcome;
+}
+
+
+---------------------------------------
+
+package com.rbs.bdd.infrastructure.profiling;
+
+import jdk.jfr.Category;
+import jdk.jfr.Description;
+import jdk.jfr.Event;
+import jdk.jfr.Label;
+import jdk.jfr.Name;
+import jdk.jfr.StackTrace;
+
+/**
+ * Java Flight Recorder event spanning one stage of the SOAP pipeline, tagged like its {@link SoapRequestEvent}.
+ */
+@Name("com.rbs.bdd.SoapStage")
+@Label("SOAP Pipeline Stage")
+@Category({"ESP Simulator", "SOAP"})
+@Description("Schema validation, business rules, serialization or malformed XML handling of a request")
+@StackTrace(false)
+public class SoapStageEvent extends Event {
+
+    @Label("Stage")
+    String stage;
+
+    @Label("Scenario")
+    String scenario;
+
+    @Label("Transaction Id")
+    String transactionId;
+
+    @Label("Outcome")
+    String outcome;
+}
+
+
+---------------------------------------
+
+package com.rbs.bdd.infrastructure.profiling;
+
+import org.springframework.ws.WebServiceMessage;
+import org.w3c.dom.Element;
+import org.w3c.dom.NodeList;
+
+import javax.xml.transform.Source;
+import javax.xml.transform.dom.DOMSource;
+
+/**
+ * Creates and commits the simulator flight recorder events.
+ * <p>
+ * Spring WS handles a request on a single thread, so the request event is kept in a thread local:
+ * stages read the scenario and transactionId from it. The request is tagged from its payload when it
+ * starts, so schema validation is already attributed, and the business rules replace the scenario once
+ * the routing rule is known. Events are cheap no-ops when no recording is running.
+ * </p>
+ */
+public final class SoapPipelineEvents {
+
+    public static final String STAGE_SCHEMA_VALIDATION = "schemaValidation";
+    public static final String STAGE_BUSINESS_RULES = "businessRules";
+    public static final String STAGE_SERIALIZATION = "serialization";
+    public static final String STAGE_MALFORMED_XML = "malformedXmlResolver";
+
+    public static final String OUTCOME_OK = "OK";
+    public static final String OUTCOME_INVALID = "INVALID";
+    public static final String OUTCOME_FAULT = "FAULT";
+    public static final String OUTCOME_FAILED = "FAILED";
+
+    public static final String SCENARIO_UNMATCHED = "unmatched";
+    public static final String SCENARIO_MALFORMED_XML = "malformedXml";
+
+    private static final ThreadLocal<SoapRequestEvent> CURRENT = new ThreadLocal<>();
+
+    private SoapPipelineEvents() {
+        // Prevent instantiation
+    }
+
+    /**
+     * Starts the request event of the current thread.
+     */
+    public static void beginRequest() {
+        SoapRequestEvent event = new SoapRequestEvent();
+        event.begin();
+        CURRENT.set(event);
+    }
+
+    /**
+     * Starts the request event of the current thread, tagged with the transactionId of the payload and
+     * the {@link #SCENARIO_UNMATCHED} scenario until a routing rule is known. The payload is only read
+     * while a recording is running.
+     *
+     * @param request the request message
+     */
+    public static void beginRequest(WebServiceMessage request) {
+        beginRequest();
+        SoapRequestEvent event = CURRENT.get();
+        if (!event.isEnabled()) return;
+        event.scenario = SCENARIO_UNMATCHED;
+        event.transactionId = transactionIdOf(request);
+    }
+
+    /**
+     * Tags the current request with its scenario and transactionId.
+     *
+     * @param scenario      the matched routing rule
+     * @param transactionId the request transactionId, may be null
+     */
+    public static void tag(String scenario, String transactionId) {
+        SoapRequestEvent event = CURRENT.get();
+        if (event == null) return;
+        event.scenario = scenario;
+        event.transactionId = transactionId;
+    }
+
+    /**
+     * Commits the request event of the current thread.
+     *
+     * @param outcome the request outcome
+     */
+    public static void endRequest(String outcome) {
+        SoapRequestEvent event = CURRENT.get();
+        CURRENT.remove();
+        if (event == null) return;
+        event.end();
+        if (event.shouldCommit()) {
+            event.outcome = outcome;
+            event.commit();
+        }
+    }
+
+    /**
+     * Starts a stage event.
+     *
+     * @param stage the stage name
+     * @return the started event, to be passed to {@link #endStage(SoapStageEvent, String)}
+     */
+    public static SoapStageEvent beginStage(String stage) {
+        return beginStage(stage, null);
+    }
+
+    /**
+     * Starts a stage event with a scenario used when no request event is running, e.g. for a payload
+     * that failed to parse before the interceptors ran.
+     *
+     * @param stage    the stage name
+     * @param scenario the fallback scenario
+     * @return the started event, to be passed to {@link #endStage(SoapStageEvent, String)}
+     */
+    public static SoapStageEvent beginStage(String stage, String scenario) {
+        SoapStageEvent event = new SoapStageEvent();
+        event.stage = stage;
+        event.scenario = scenario;
+        event.begin();
+        return event;
+    }
+
+    /**
+     * Commits a stage event with the tags of the current request.
+     *
+     * @param event   the stage event
+     * @param outcome the stage outcome
+     */
+    public static void endStage(SoapStageEvent event, String outcome) {
+        event.end();
+        if (!event.shouldCommit()) return;
+        SoapRequestEvent request = CURRENT.get();
+        if (request != null) {
+            if (request.scenario != null) event.scenario = request.scenario;
+            event.transactionId = request.transactionId;
+        }
+        event.outcome = outcome;
+        event.commit();
+    }
+
+    /**
+     * Returns the first non-blank {@code transactionId} of a DOM payload; payloads that are not DOM
+     * or cannot be read yield null, as the schema validation reports them.
+     */
+    private static String transactionIdOf(WebServiceMessage request) {
+        try {
+            Source payload = request.getPayloadSource();
+            if (!(payload instanceof DOMSource dom) || !(dom.getNode() instanceof Element root)) return null;
+            NodeList ids = root.getElementsByTagNameNS("*", "transactionId");
+            for (int i = 0; i < ids.getLength(); i++) {
+                String id = ids.item(i).getTextContent();
+                if (id != null && !id.isBlank()) return id.trim();
+            }
+            return null;
+        } catch (RuntimeException e) {
+            return null;
+        }
+    }
+}
+
+
+---------------------------------------
+
+package com.rbs.bdd.infrastructure.config;
+
+import com.rbs.bdd.infrastructure.profiling.SoapPipelineEvents;
+import org.springframework.ws.FaultAwareWebServiceMessage;
+import org.springframework.ws.WebServiceMessage;
+import org.springframework.ws.context.MessageContext;
+import org.springframework.ws.server.EndpointInterceptor;
+
+/**
+ * Interceptor that wraps every SOAP request in a {@code SoapRequestEvent}, tagged from the payload.
+ * Registered first so the event covers schema validation and the endpoint.
+ */
+public class FlightRecorderInterceptor implements EndpointInterceptor {
+
+    @Override
+    public boolean handleRequest(MessageContext messageContext, Object endpoint) {
+        SoapPipelineEvents.beginRequest(messageContext.getRequest());
+        return true;
+    }
+
+    @Override
+    public boolean handleResponse(MessageContext messageContext, Object endpoint) {
+        return true;
+    }
+
+    @Override
+    public boolean handleFault(MessageContext messageContext, Object endpoint) {
+        return true;
+    }
+
+    /**
+     * Commits the request event with the final outcome: the exception type, FAULT or OK.
+     */
+    @Override
+    public void afterCompletion(MessageContext messageContext, Object endpoint, Exception ex) {
+        String outcome = SoapPipelineEvents.OUTCOME_OK;
+        if (ex != null) {
+            outcome = ex.getClass().getSimpleName();
+        } else if (messageContext.hasResponse()) {
+            WebServiceMessage response = messageContext.getResponse();
+            if (response instanceof FaultAwareWebServiceMessage faultAware && faultAware.hasFault()) {
+                outcome = SoapPipelineEvents.OUTCOME_FAULT;
+            }
+        }
+        SoapPipelineEvents.endRequest(outcome);
+    }
+}
+
+
+---------------------------------------
+
+package com.rbs.bdd.infrastructure.profiling;
+
+import jdk.jfr.Configuration;
+import jdk.jfr.Recording;
+import org.slf4j.Logger;
+import org.slf4j.LoggerFactory;
+import org.springframework.beans.factory.annotation.Value;
+import org.springframework.boot.autoconfigure.condition.ConditionalOnProperty;
+import org.springframework.http.HttpStatus;
+import org.springframework.http.ResponseEntity;
+import org.springframework.web.bind.annotation.PostMapping;
+import org.springframework.web.bind.annotation.RequestMapping;
+import org.springframework.web.bind.annotation.RequestParam;
+import org.springframework.web.bind.annotation.RestController;
+
+import java.io.IOException;
+import java.nio.file.Files;
+import java.nio.file.Path;
+import java.text.ParseException;
+import java.time.Duration;
+import java.time.LocalDateTime;
+import java.time.format.DateTimeFormatter;
+import java.util.Map;
+
+/**
+ * Admin operations starting and stopping a bounded flight recording at runtime.
+ * <p>
+ * {@code POST /admin/profiling/start} starts a recording with the JDK {@code profile} settings plus the
+ * simulator events, bounded by age and size; {@code POST /admin/profiling/stop} writes it to the
+ * configured directory and returns the file. Only one recording runs at a time. The endpoints are
+ * unauthenticated and write to disk, so they are only registered when
+ * {@code esp.simulator.profiling.admin.enabled=true}.
+ * </p>
+ */
+@RestController
+@RequestMapping("/admin/profiling")
+@ConditionalOnProperty(prefix = "esp.simulator.profiling.admin", name = "enabled", havingValue = "true")
+public class ProfilingAdminController {
+
+    private static final Logger logger = LoggerFactory.getLogger(ProfilingAdminController.class);
+    private static final DateTimeFormatter FILE_TIMESTAMP = DateTimeFormatter.ofPattern("yyyyMMdd-HHmmss");
+
+    private final Path outputDirectory;
+    private Recording recording;
+
+    /**
+     * @param outputDirectory directory the recordings are written to
+     */
+    public ProfilingAdminController(@Value("${esp.simulator.profiling.directory:recordings}") Path outputDirectory) {
+        this.outputDirectory = outputDirectory;
+    }
+
+    /**
+     * Starts a bounded recording.
+     *
+     * @param maxAgeSeconds oldest data kept in the recording buffer
+     * @param maxSizeMb     largest size of the recording buffer
+     * @return the recording id, or 409 if a recording is already running
+     */
+    @PostMapping("/start")
+    public synchronized ResponseEntity<Map<String, Object>> start(
+            @RequestParam(defaultValue = "300") long maxAgeSeconds,
+            @RequestParam(defaultValue = "100") long maxSizeMb) throws IOException, ParseException {
+        if (recording != null) {
+            return ResponseEntity.status(HttpStatus.CONFLICT).body(Map.of("error", "Recording already running"));
+        }
+        Recording started = new Recording(Configuration.getConfiguration("profile"));
+        started.setName("esp-simulator");
+        started.setMaxAge(Duration.ofSeconds(maxAgeSeconds));
+        started.setMaxSize(maxSizeMb * 1024 * 1024);
+        started.enable(SoapRequestEvent.class);
+        started.enable(SoapStageEvent.class);
+        started.start();
+        recording = started;
+        logger.info("Started flight recording {} (maxAge {}s, maxSize {}MB)", started.getId(), maxAgeSeconds, maxSizeMb);
+        return ResponseEntity.ok(Map.of("recordingId", started.getId()));
+    }
+
+    /**
+     * Stops the running recording and writes it to disk.
+     *
+     * @return the written file, or 409 if no recording is running
+     */
+    @PostMapping("/stop")
+    public synchronized ResponseEntity<Map<String, Object>> stop() throws IOException {
+        if (recording == null) {
+            return ResponseEntity.status(HttpStatus.CONFLICT).body(Map.of("error", "No recording running"));
+        }
+        Files.createDirectories(outputDirectory);
+        Path file = outputDirectory.resolve("esp-simulator-" + LocalDateTime.now().format(FILE_TIMESTAMP) + ".jfr");
+        try {
+            recording.stop();
+            recording.dump(file);
+        } finally {
+            recording.close();
+            recording = null;
+        }
+        logger.info("Flight recording written to {}", file.toAbsolutePath());
+        return ResponseEntity.ok(Map.of("file", file.toAbsolutePath().toString()));
+    }
+}
+
+
+---------------------------------------
+
+package com.rbs.bdd.application.service;
+
+import com.rbs.bdd.application.exception.AccountValidationException;
+import com.rbs.bdd.common.SoapMessages;
+import jakarta.xml.soap.SOAPException;
+import org.springframework.ws.WebServiceMessage;
+import org.springframework.ws.WebServiceMessageFactory;
+
+import javax.xml.transform.TransformerException;
+import java.io.ByteArrayOutputStream;
+import java.io.IOException;
+import java.io.UncheckedIOException;
+import java.nio.charset.StandardCharsets;
+
+/**
+ * A SOAP envelope encoded once at startup and copied verbatim into response messages,
+ * for replies that must not pay for template parsing or XPath updates (e.g. overload faults).
+ */
+public final class PrecompiledSoapResponse {
+
+    private final byte[] envelope;
+
+    /**
+     * @param envelope the complete SOAP envelope
+     */
+    public PrecompiledSoapResponse(String envelope) {
+        this.envelope = envelope.getBytes(StandardCharsets.UTF_8);
+    }
+
+    /**
+     * Replaces the content of the response message with the precompiled envelope.
+     *
+     * @param message the outgoing response message
+     * @throws AccountValidationException if the message cannot be written
+     */
+    public void writeTo(WebServiceMessage message) {
+        try {
+            SoapMessages.replaceEnvelope(message, envelope);
+        } catch (SOAPException | TransformerException e) {
+            throw new AccountValidationException("Failed to write precompiled SOAP response", e);
+        }
+    }
+
+    /**
+     * Renders the envelope the way a response message of {@code messageFactory} writes it to the wire,
+     * e.g. to pre-compress it.
+     *
+     * @param messageFactory the factory creating response messages
+     * @return the serialised response message
+     */
+    public byte[] render(WebServiceMessageFactory messageFactory) {
+        WebServiceMessage message = messageFactory.createWebServiceMessage();
+        writeTo(message);
+        ByteArrayOutputStream out = new ByteArrayOutputStream(envelope.length + 256);
+        try {
+            message.writeTo(out);
+        } catch (IOException e) {
+            throw new UncheckedIOException(e);
+        }
+        return out.toByteArray();
+    }
+}
+
+
+---------------------------------------
+
+package com.rbs.bdd.application.admission;
+
+import java.util.concurrent.atomic.AtomicInteger;
+import java.util.concurrent.atomic.AtomicLong;
+import java.util.concurrent.atomic.LongAdder;
+import java.util.function.LongSupplier;
+
+/**
+ * Lock-free concurrency limiter with an optional AIMD (additive increase, multiplicative decrease) limit.
+ * <p>
+ * In fixed mode the limit never changes. In adaptive mode a completion slower than the latency
+ * threshold multiplies the limit by the backoff factor, at most once per latency threshold, so the
+ * requests caught in one latency spike back off once rather than once each. Every {@code limit} fast
+ * completions observed while at least half the limit is in use raise it by one, so the limit tracks the
+ * concurrency the simulator can serve. Requests over the limit are rejected, never queued.
+ * </p>
+ */
+public final class ConcurrencyLimiter {
+
+    private final AtomicInteger inFlight = new AtomicInteger();
+    private final AtomicInteger limit;
+    private final AtomicInteger fastCompletions = new AtomicInteger();
+    private final AtomicLong limitChanges = new AtomicLong();
+    private final AtomicLong lastDecrease;
+    private final LongAdder accepted = new LongAdder();
+    private final LongAdder rejected = new LongAdder();
+    private final int minLimit;
+    private final int maxLimit;
+    private final boolean adaptive;
+    private final long latencyThresholdNanos;
+    private final double backoff;
+    private final LongSupplier clock;
+
+    /**
+     * @param initialLimit          starting limit
+     * @param minLimit              lowest adaptive limit
+     * @param maxLimit              highest adaptive limit
+     * @param adaptive              whether the limit adapts to latency
+     * @param latencyThresholdNanos completions slower than this decrease the limit, at most once per threshold
+     * @param backoff               multiplicative decrease factor, between 0 and 1
+     * @param clock                 monotonic nanosecond clock
+     */
+    public ConcurrencyLimiter(int initialLimit, int minLimit, int maxLimit, boolean adaptive,
+                              long latencyThresholdNanos, double backoff, LongSupplier clock) {
+        if (minLimit < 1 || minLimit > initialLimit || initialLimit > maxLimit) {
+            throw new IllegalArgumentException("Expected 1 <= minLimit <= initialLimit <= maxLimit");
+        }
+        if (backoff <= 0.0 || backoff >= 1.0) {
+            throw new IllegalArgumentException("backoff must be between 0 and 1");
+        }
+        this.limit = new AtomicInteger(initialLimit);
+        this.minLimit = minLimit;
+        this.maxLimit = maxLimit;
+        this.adaptive = adaptive;
+        this.latencyThresholdNanos = latencyThresholdNanos;
+        this.backoff = backoff;
+        this.clock = clock;
+        this.lastDecrease = new AtomicLong(clock.getAsLong() - latencyThresholdNanos);
+    }
+
+    /**
+     * Takes a slot if the current limit allows it.
+     *
+     * @return true if the request is admitted and {@link #release(long)} must be called
+     */
+    public boolean tryAcquire() {
+        while (true) {
+            int current = inFlight.get();
+            if (current >= limit.get()) {
+                rejected.increment();
+                return false;
+            }
+            if (inFlight.compareAndSet(current, current + 1)) {
+                accepted.increment();
+                return true;
+            }
+        }
+    }
+
+    /**
+     * Returns a slot and feeds the request latency to the adaptive limit.
+     *
+     * @param latencyNanos time the admitted request took
+     */
+    public void release(long latencyNanos) {
+        int busy = inFlight.getAndDecrement();
+        if (!adaptive) return;
+        if (latencyNanos > latencyThresholdNanos) {
+            decrease();
+        } else if (busy * 2 >= limit.get()) {
+            increase();
+        }
+    }
+
+    private void decrease() {
+        fastCompletions.set(0);
+        long now = clock.getAsLong();
+        long last = lastDecrease.get();
+        if (now - last < latencyThresholdNanos || !lastDecrease.compareAndSet(last, now)) return;
+        int current = limit.get();
+        int next = Math.max(minLimit, (int) (current * backoff));
+        if (next != current && limit.compareAndSet(current, next)) limitChanges.incrementAndGet();
+    }
+
+    private void increase() {
+        int current = limit.get();
+        if (current >= maxLimit || fastCompletions.incrementAndGet() < current) return;
+        fastCompletions.set(0);
+        if (limit.compareAndSet(current, current + 1)) limitChanges.incrementAndGet();
+    }
+
+    public int limit() {
+        return limit.get();
+    }
+
+    /**
+     * @return admitted requests that have not been released yet
+     */
+    public int inFlight() {
+        return inFlight.get();
+    }
+
+    public long accepted() {
+        return accepted.sum();
+    }
+
+    public long rejected() {
+        return rejected.sum();
+    }
+
+    public long limitChanges() {
+        return limitChanges.get();
+    }
+}
+
+
+---------------------------------------
+
+package com.rbs.bdd.infrastructure.config;
+
+import com.rbs.bdd.application.admission.ConcurrencyLimiter;
+import io.micrometer.core.instrument.FunctionCounter;
+import io.micrometer.core.instrument.Gauge;
+import io.micrometer.core.instrument.MeterRegistry;
+import org.springframework.beans.factory.annotation.Value;
+import org.springframework.context.annotation.Bean;
+import org.springframework.context.annotation.Configuration;
+
+import java.time.Duration;
+
+/**
+ * Configures admission control in front of the payment orchestrator and publishes its metrics:
+ * {@code esp.admission.active} (admitted requests being served), {@code esp.admission.limit},
+ * {@code esp.admission.accepted}, {@code esp.admission.rejected} and {@code esp.admission.limit.changes}.
+ * The limiter has no queue: a request over the limit gets the overload fault at once, so there is no
+ * queue depth to report. Requests waiting for a worker thread queue in Tomcat, before the limiter.
+ * <p>
+ * The limiter is acquired in the orchestrator, after Tomcat has assigned a worker thread and Spring WS
+ * has parsed and validated the request. It only sheds load if the limit stays below the worker pool
+ * ({@code server.tomcat.threads.max}, 200 by default); otherwise requests queue in the container before
+ * reaching it. The default limit of 150 leaves that headroom, raise both together. The limit is fixed
+ * unless {@code esp.simulator.admission.adaptive=true}.
+ * </p>
+ */
+@Configuration
+public class AdmissionControlConfig {
+
+    /**
+     * Creates the concurrency limiter.
+     *
+     * @param registry          the metrics registry
+     * @param initialLimit      starting (or fixed) limit, kept below the servlet container worker pool
+     * @param minLimit          lowest adaptive limit
+     * @param maxLimit          highest adaptive limit
+     * @param adaptive          whether to use the AIMD limit
+     * @param latencyThreshold  completions slower than this decrease the limit, at most once per threshold
+     * @param backoff           multiplicative decrease factor
+     * @return the limiter
+     */
+    @Bean
+    public ConcurrencyLimiter concurrencyLimiter(MeterRegistry registry,
+            @Value("${esp.simulator.admission.limit:150}") int initialLimit,
+            @Value("${esp.simulator.admission.min-limit:10}") int minLimit,
+            @Value("${esp.simulator.admission.max-limit:190}") int maxLimit,
+            @Value("${esp.simulator.admission.adaptive:false}") boolean adaptive,
+            @Value("${esp.simulator.admission.latency-threshold:50ms}") Duration latencyThreshold,
+            @Value("${esp.simulator.admission.backoff:0.9}") double backoff) {
+        ConcurrencyLimiter limiter = new ConcurrencyLimiter(initialLimit, minLimit, maxLimit, adaptive,
+                latencyThreshold.toNanos(), backoff, System::nanoTime);
+        Gauge.builder("esp.admission.active", limiter, ConcurrencyLimiter::inFlight).register(registry);
+        Gauge.builder("esp.admission.limit", limiter, ConcurrencyLimiter::limit).register(registry);
+        FunctionCounter.builder("esp.admission.accepted", limiter, ConcurrencyLimiter::accepted).register(registry);
+        FunctionCounter.builder("esp.admission.rejected", limiter, ConcurrencyLimiter::rejected).register(registry);
+        FunctionCounter.builder("esp.admission.limit.changes", limiter, ConcurrencyLimiter::limitChanges)
+                .register(registry);
+        return limiter;
+    }
+}
+
+
+---------------------------------------
+
+package com.rbs.bdd.application.admission;
+
+import java.util.Map;
+import java.util.concurrent.ConcurrentHashMap;
+import java.util.concurrent.atomic.AtomicLong;
+import java.util.concurrent.atomic.LongAdder;
+import java.util.function.LongSupplier;
+
+/**
+ * Per-client rate limiting keyed on {@code systemId} and {@code operatingBrand}, simulating ESP throttling.
+ * <p>
+ * Each key is a token bucket implemented as GCRA (generic cell rate algorithm): the whole bucket state is a
+ * single "theoretical arrival time" in an {@link AtomicLong}, so an admission is one map lookup plus a
+ * CAS loop, without locks. Buckets untouched for longer than the idle timeout are removed by
+ * {@link #evictIdle()}, which is run periodically. Eviction retires a bucket with a CAS before removing it,
+ * so a request that looked the bucket up just before cannot use it afterwards; it looks the key up again
+ * and gets a fresh bucket.
+ * </p>
+ */
+public final class ClientThrottle {
+
+    private static final long NANOS_PER_SECOND = 1_000_000_000L;
+
+    private final Map<ClientKey, Bucket> buckets = new ConcurrentHashMap<>();
+    private final Map<ClientKey, Rate> rates;
+    private final Rate defaultRate;
+    private final long idleTimeoutNanos;
+    private final LongSupplier clock;
+    private final LongAdder throttled = new LongAdder();
+    private final LongAdder evicted = new LongAdder();
+
+    /**
+     * @param defaultRate      rate applied to keys without their own entry, or null to leave them unthrottled
+     * @param rates            per-key rates
+     * @param idleTimeoutNanos how long a bucket may stay unused before it is evicted
+     * @param clock            monotonic nanosecond clock
+     */
+    public ClientThrottle(Rate defaultRate, Map<ClientKey, Rate> rates, long idleTimeoutNanos, LongSupplier clock) {
+        this.defaultRate = defaultRate;
+        this.rates = Map.copyOf(rates);
+        this.idleTimeoutNanos = idleTimeoutNanos;
+        this.clock = clock;
+    }
+
+    /**
+     * Admits or throttles one request of the given client.
+     *
+     * @param systemId       the requestIds/systemId, may be null
+     * @param operatingBrand the operatingBrand, may be null
+     * @return true if the request is within the client's rate
+     */
+    public boolean tryAcquire(String systemId, String operatingBrand) {
+        ClientKey key = new ClientKey(systemId, operatingBrand);
+        Rate rate = rates.getOrDefault(key, defaultRate);
+        if (rate == null) return true;
+        long now = clock.getAsLong();
+        int result;
+        do {
+            result = buckets.computeIfAbsent(key, k -> new Bucket(rate)).tryAcquire(now);
+        } while (result == Bucket.RETIRED);
+        if (result == Bucket.ADMITTED) return true;
+        throttled.increment();
+        return false;
+    }
+
+    /**
+     * Removes the buckets that have been idle longer than the idle timeout. Each bucket is retired and
+     * removed atomically per key, so a concurrent {@link #tryAcquire} either admits on the bucket before
+     * it is retired, keeping it, or retries on a new one.
+     *
+     * @return number of buckets removed
+     */
+    public int evictIdle() {
+        long now = clock.getAsLong();
+        int removed = 0;
+        for (ClientKey key : buckets.keySet()) {
+            // Only eviction removes buckets, so null means this call retired and removed it
+            Bucket kept = buckets.computeIfPresent(key,
+                    (k, bucket) -> bucket.retireIfIdle(now, idleTimeoutNanos) ? null : bucket);
+            if (kept == null) removed++;
+        }
+        evicted.add(removed);
+        return removed;
+    }
+
+    public int activeKeys() {
+        return buckets.size();
+    }
+
+    public long throttled() {
+        return throttled.sum();
+    }
+
+    public long evicted() {
+        return evicted.sum();
+    }
+
+    /**
+     * Client identity.
+     *
+     * @param systemId       the requestIds/systemId
+     * @param operatingBrand the operatingBrand
+     */
+    public record ClientKey(String systemId, String operatingBrand) {
+    }
+
+    /**
+     * Sustained rate and burst size of a bucket.
+     *
+     * @param permitsPerSecond sustained rate
+     * @param burst            requests allowed back to back from a full bucket
+     */
+    public record Rate(double permitsPerSecond, int burst) {
+
+        public Rate {
+            if (permitsPerSecond <= 0 || burst < 1) {
+                throw new IllegalArgumentException("permitsPerSecond must be positive and burst at least 1");
+            }
+        }
+
+        private long emissionIntervalNanos() {
+            return Math.max(1L, (long) (NANOS_PER_SECOND / permitsPerSecond));
+        }
+    }
+
+    /**
+     * GCRA bucket: a request at {@code now} is admitted if the theoretical arrival time is no more than
+     * {@code (burst - 1)} emission intervals ahead of {@code now}. A retired bucket admits nothing.
+     */
+    private static final class Bucket {
+        private static final int ADMITTED = 0;
+        private static final int THROTTLED = 1;
+        private static final int RETIRED = 2;
+        private static final long RETIRED_TAT = Long.MAX_VALUE;
+
+        private final AtomicLong tat = new AtomicLong(Long.MIN_VALUE / 2);
+        private final long interval;
+        private final long tolerance;
+
+        private Bucket(Rate rate) {
+            this.interval = rate.emissionIntervalNanos();
+            this.tolerance = interval * (rate.burst() - 1L);
+        }
+
+        private int tryAcquire(long now) {
+            while (true) {
+                long current = tat.get();
+                if (current == RETIRED_TAT) return RETIRED;
+                long start = Math.max(current, now);
+                if (start - now > tolerance) return THROTTLED;
+                if (tat.compareAndSet(current, start + interval)) return ADMITTED;
+            }
+        }
+
+        /**
+         * Retires the bucket if it has not been used for {@code idleTimeoutNanos}; it is full again by then.
+         */
+        private boolean retireIfIdle(long now, long idleTimeoutNanos) {
+            long current = tat.get();
+            return now - current > idleTimeoutNanos && tat.compareAndSet(current, RETIRED_TAT);
+        }
+    }
+}
+
+
+---------------------------------------
+
+package com.rbs.bdd.infrastructure.config;
+
+import org.springframework.boot.context.properties.ConfigurationProperties;
+
+import java.time.Duration;
+import java.util.Map;
+
+/**
+ * Per-client throttling settings, bound from {@code esp.simulator.throttling}.
+ * Per-key rates are keyed {@code systemId/operatingBrand}, for example
+ * {@code esp.simulator.throttling.clients[RequestID/ALL].permits-per-second=50}.
+ *
+ * @param enabled     whether throttling is active
+ * @param defaultRate rate for clients without their own entry; null leaves them unthrottled
+ * @param clients     per-client rates
+ * @param idleTimeout how long an unused client bucket is kept
+ */
+@ConfigurationProperties("esp.simulator.throttling")
+public record ThrottlingProperties(boolean enabled, RateProperties defaultRate,
+                                   Map<String, RateProperties> clients, Duration idleTimeout) {
+
+    /**
+     * @param permitsPerSecond sustained requests per second
+     * @param burst            requests allowed back to back
+     */
+    public record RateProperties(double permitsPerSecond, int burst) {
+    }
+}
+
+
+---------------------------------------
+
+package com.rbs.bdd.infrastructure.config;
+
+import com.rbs.bdd.application.admission.ClientThrottle;
+import io.micrometer.core.instrument.FunctionCounter;
+import io.micrometer.core.instrument.Gauge;
+import io.micrometer.core.instrument.MeterRegistry;
+import org.slf4j.Logger;
+import org.slf4j.LoggerFactory;
+import org.springframework.boot.context.properties.EnableConfigurationProperties;
+import org.springframework.context.annotation.Bean;
+import org.springframework.context.annotation.Configuration;
+
+import java.time.Duration;
+import java.util.HashMap;
+import java.util.Map;
+import java.util.concurrent.Executors;
+import java.util.concurrent.ScheduledExecutorService;
+import java.util.concurrent.TimeUnit;
+
+/**
+ * Builds the {@link ClientThrottle} from {@link ThrottlingProperties}, schedules idle-key eviction and
+ * publishes {@code esp.throttling.keys}, {@code esp.throttling.rejected} and {@code esp.throttling.evicted}.
+ */
+@Configuration
+@EnableConfigurationProperties(ThrottlingProperties.class)
+public class ThrottlingConfig {
+
+    private static final Logger logger = LoggerFactory.getLogger(ThrottlingConfig.class);
+    private static final Duration DEFAULT_IDLE_TIMEOUT = Duration.ofMinutes(5);
+
+    /**
+     * Creates the client throttle; when throttling is disabled every client is admitted.
+     *
+     * @param properties the throttling settings
+     * @param registry   the metrics registry
+     * @return the client throttle
+     */
+    @Bean
+    public ClientThrottle clientThrottle(ThrottlingProperties properties, MeterRegistry registry) {
+        Duration idleTimeout = properties.idleTimeout() != null ? properties.idleTimeout() : DEFAULT_IDLE_TIMEOUT;
+        Map<ClientThrottle.ClientKey, ClientThrottle.Rate> rates = new HashMap<>();
+        ClientThrottle.Rate defaultRate = null;
+        if (properties.enabled()) {
+            if (properties.clients() != null) {
+                properties.clients().forEach((key, rate) -> rates.put(parseKey(key), toRate(rate)));
+            }
+            defaultRate = properties.defaultRate() != null ? toRate(properties.defaultRate()) : null;
+            logger.info("Client throttling enabled for {} clients (default rate {})", rates.size(), defaultRate);
+        }
+        ClientThrottle throttle = new ClientThrottle(defaultRate, rates, idleTimeout.toNanos(), System::nanoTime);
+        Gauge.builder("esp.throttling.keys", throttle, ClientThrottle::activeKeys).register(registry);
+        FunctionCounter.builder("esp.throttling.rejected", throttle, ClientThrottle::throttled).register(registry);
+        FunctionCounter.builder("esp.throttling.evicted", throttle, ClientThrottle::evicted).register(registry);
+        return throttle;
+    }
+
+    /**
+     * Runs idle-key eviction at a quarter of the idle timeout.
+     *
+     * @param throttle   the client throttle
+     * @param properties the throttling settings
+     * @return the scheduler, shut down with the context
+     */
+    @Bean(destroyMethod = "shutdownNow")
+    public ScheduledExecutorService throttleEvictionScheduler(ClientThrottle throttle, ThrottlingProperties properties) {
+        Duration idleTimeout = properties.idleTimeout() != null ? properties.idleTimeout() : DEFAULT_IDLE_TIMEOUT;
+        long period = Math.max(1_000, idleTimeout.toMillis() / 4);
+        ScheduledExecutorService scheduler = Executors.newSingleThreadScheduledExecutor(runnable -> {
+            Thread thread = new Thread(runnable, "throttle-eviction");
+            thread.setDaemon(true);
+            return thread;
+        });
+        scheduler.scheduleAtFixedRate(throttle::evictIdle, period, period, TimeUnit.MILLISECONDS);
+        return scheduler;
+    }
+
+    private static ClientThrottle.ClientKey parseKey(String key) {
+        int slash = key.indexOf('/');
+        if (slash < 0) return new ClientThrottle.ClientKey(key, null);
+        return new ClientThrottle.ClientKey(key.substring(0, slash), key.substring(slash + 1));
+    }
+
+    private static ClientThrottle.Rate toRate(ThrottlingProperties.RateProperties rate) {
+        return new ClientThrottle.Rate(rate.permitsPerSecond(), Math.max(1, rate.burst()));
+    }
+}
+
+
+---------------------------------------
+
+package com.rbs.bdd.tools;
+
+import com.rbs.bdd.common.ServiceConstants;
+import com.rbs.bdd.domain.enums.AccountStatus;
+import com.rbs.bdd.domain.enums.ModulusCheckStatus;
+import com.rbs.bdd.domain.enums.SwitchingStatus;
+import com.rbs.bdd.domain.modulus.ModulusCheckEngine;
+import org.slf4j.Logger;
+import org.slf4j.LoggerFactory;
+
+import java.io.BufferedWriter;
+import java.io.IOException;
+import java.io.InputStream;
+import java.nio.charset.StandardCharsets;
+import java.nio.file.Files;
+import java.nio.file.Path;
+import java.util.ArrayDeque;
+import java.util.Deque;
+import java.util.HashMap;
+import java.util.List;
+import java.util.Map;
+import java.util.SplittableRandom;
+import java.util.concurrent.ExecutionException;
+import java.util.concurrent.ExecutorService;
+import java.util.concurrent.Executors;
+import java.util.concurrent.Future;
+import java.util.concurrent.atomic.LongAdder;
+
+/**
+ * Generates checksum-valid synthetic GB accounts as an account dataset plus a matching request fixture.
+ * <p>
+ * Writes {@code generated-accounts.csv} ({@code iban,accountStatus,switchingStatus}, loadable through
+ * {@code esp.simulator.accounts.datasets} into the account index) and {@code generated-requests.csv}
+ * ({@code identifier,codeValue,transactionId,accountStatus,switchingStatus,modulusCheckStatus}) for load tests.
+ * The first 13 digits of sort code + account number are a bijection of the account index, so every IBAN is
+ * unique; the UK basic bank account form is the last 14 characters, as in the routing rules.
+ * The modulus check status is drawn from {@code --modulus-status} and made true by choosing the last account
+ * digit: digits are tried in order until the same {@link ModulusCheckEngine} weight table the simulator
+ * loads gives the requested status, and the IBAN check digits are computed for the chosen account. FAILED
+ * accounts need a weight table, without one every checksum-valid account passes.
+ * Chunks are generated in parallel, each with its own random stream derived from the seed and chunk index,
+ * and written in order through a bounded window, so output is reproducible and memory stays constant.
+ * </p>
+ * Usage: {@code SyntheticAccountGenerator --count=1000000 --seed=42 --out=target/dataset [--threads=N]
+ * [--uk-share=0.3] [--account-status=DOMESTIC_RESTRICTED:0.5,DOMESTIC_UNRESTRICTED:0.5]
+ * [--switching-status=SWITCHED:0.2,NOT_SWITCHING:0.8] [--modulus-status=PASS:0.9,FAILED:0.1]
+ * [--weights=path/to/valacdos.txt]}
+ */
+public final class SyntheticAccountGenerator {
+
+    private static final Logger logger = LoggerFactory.getLogger(SyntheticAccountGenerator.class);
+
+    private static final String[] BANK_CODES = {"NWBK", "RBOS", "BARC", "LOYD", "HBUK", "MIDL"};
+    private static final long ACCOUNT_SPACE = 10_000_000_000_000L;
+    private static final long PERMUTATION_MULTIPLIER = 982_451_653L;
+    private static final long PERMUTATION_OFFSET = 1_000_000_000_000L;
+    private static final long MAX_COUNT = (Long.MAX_VALUE - PERMUTATION_OFFSET) / PERMUTATION_MULTIPLIER;
+    private static final long SEED_STRIDE = 0x9E3779B97F4A7C15L;
+    private static final int CHUNK_SIZE = 10_000;
+
+    private final long count;
+    private final long seed;
+    private final int threads;
+    private final double ukShare;
+    private final Distribution<AccountStatus> accountStatus;
+    private final Distribution<SwitchingStatus> switchingStatus;
+    private final Distribution<ModulusCheckStatus> modulusStatus;
+    private final ModulusCheckEngine modulusCheckEngine;
+    private final LongAdder modulusFailures = new LongAdder();
+    private final LongAdder modulusMismatches = new LongAdder();
+
+    /**
+     * @param count              number of accounts, at most {@value #MAX_COUNT} so the permutation cannot overflow
+     * @param seed               random seed
+     * @param threads            generator threads
+     * @param ukShare            share of fixture requests using the UK basic bank account form
+     * @param accountStatus      account status distribution
+     * @param switchingStatus    switching status distribution
+     * @param modulusStatus      modulus check status distribution
+     * @param modulusCheckEngine engine the accounts are chosen against
+     * @throws IllegalArgumentException if {@code count} is out of range, or FAILED accounts are requested
+     *                                  from an engine without a weight table
+     */
+    public SyntheticAccountGenerator(long count, long seed, int threads, double ukShare,
+                                     Distribution<AccountStatus> accountStatus,
+                                     Distribution<SwitchingStatus> switchingStatus,
+                                     Distribution<ModulusCheckStatus> modulusStatus,
+                                     ModulusCheckEngine modulusCheckEngine) {
+        if (count < 0 || count > MAX_COUNT) throw new IllegalArgumentException("count must be between 0 and " + MAX_COUNT);
+        if (modulusStatus.weight(ModulusCheckStatus.FAILED) > 0 && !modulusCheckEngine.hasWeights()) {
+            throw new IllegalArgumentException("--modulus-status requests FAILED accounts but no weight table is loaded;"
+                    + " pass --weights or add " + ServiceConstants.MODULUS_WEIGHTS_PATH + " to the classpath");
+        }
+        this.count = count;
+        this.seed = seed;
+        this.threads = Math.max(1, threads);
+        this.ukShare = ukShare;
+        this.accountStatus = accountStatus;
+        this.switchingStatus = switchingStatus;
+        this.modulusStatus = modulusStatus;
+        this.modulusCheckEngine = modulusCheckEngine;
+    }
+
+    public static void main(String[] args) throws IOException, InterruptedException {
+        Map<String, String> options = new HashMap<>();
+        for (String arg : args) {
+            int eq = arg.indexOf('=');
+            if (!arg.startsWith("--") || eq < 0) throw new IllegalArgumentException("Expected --key=value but found " + arg);
+            options.put(arg.substring(2, eq), arg.substring(eq + 1));
+        }
+        SyntheticAccountGenerator generator = new SyntheticAccountGenerator(
+                Long.parseLong(options.getOrDefault("count", "1000000")),
+                Long.parseLong(options.getOrDefault("seed", "42")),
+                Integer.parseInt(options.getOrDefault("threads", String.valueOf(Runtime.getRuntime().availableProcessors()))),
+                Double.parseDouble(options.getOrDefault("uk-share", "0.3")),
+                Distribution.parse(AccountStatus.class,
+                        options.getOrDefault("account-status", "DOMESTIC_RESTRICTED:0.5,DOMESTIC_UNRESTRICTED:0.5")),
+                Distribution.parse(SwitchingStatus.class,
+                        options.getOrDefault("switching-status", "SWITCHED:0.2,NOT_SWITCHING:0.8")),
+                Distribution.parse(ModulusCheckStatus.class, options.getOrDefault("modulus-status", "PASS:1.0")),
+                loadWeights(options.get("weights")));
+        generator.generate(Path.of(options.getOrDefault("out", "dataset")));
+    }
+
+    /**
+     * Loads the weight table from {@code path}, or from the classpath copy the simulator uses.
+     * Without a table every account passes the modulus check, so only PASS accounts can be generated.
+     */
+    private static ModulusCheckEngine loadWeights(String path) throws IOException {
+        if (path != null) return ModulusCheckEngine.parse(Files.readAllLines(Path.of(path), StandardCharsets.UTF_8));
+        try (InputStream weights = SyntheticAccountGenerator.class.getClassLoader()
+                .getResourceAsStream(ServiceConstants.MODULUS_WEIGHTS_PATH)) {
+            if (weights == null) {
+                logger.warn("{} not found, every account will pass the modulus check",
+                        ServiceConstants.MODULUS_WEIGHTS_PATH);
+                return ModulusCheckEngine.empty();
+            }
+            return ModulusCheckEngine.parse(List.of(new String(weights.readAllBytes(), StandardCharsets.UTF_8).split("\\R")));
+        }
+    }
+
+    /**
+     * Generates the dataset and fixture files into {@code outputDirectory}.
+     *
+     * @param outputDirectory target directory, created if missing
+     * @throws IOException if a file cannot be written
+     * @throws InterruptedException if interrupted while waiting for a chunk
+     */
+    public void generate(Path outputDirectory) throws IOException, InterruptedException {
+        Files.createDirectories(outputDirectory);
+        long started = System.nanoTime();
+        long chunks = (count + CHUNK_SIZE - 1) / CHUNK_SIZE;
+        ExecutorService pool = Executors.newFixedThreadPool(threads);
+        try (BufferedWriter accounts = Files.newBufferedWriter(outputDirectory.resolve("generated-accounts.csv"), StandardCharsets.UTF_8);
+             BufferedWriter fixtures = Files.newBufferedWriter(outputDirectory.resolve("generated-requests.csv"), StandardCharsets.UTF_8)) {
+            accounts.write("iban,accountStatus,switchingStatus\n");
+            accounts.write("# Generated by SyntheticAccountGenerator, seed " + seed + ", " + count + " accounts\n");
+            fixtures.write("identifier,codeValue,transactionId,accountStatus,switchingStatus,modulusCheckStatus\n");
+            Deque<Future<Chunk>> window = new ArrayDeque<>();
+            for (long c = 0; c < chunks; c++) {
+                long chunk = c;
+                window.add(pool.submit(() -> generateChunk(chunk)));
+                if (window.size() >= threads * 2) write(window.poll(), accounts, fixtures);
+            }
+            while (!window.isEmpty()) write(window.poll(), accounts, fixtures);
+        } finally {
+            pool.shutdownNow();
+        }
+        double seconds = (System.nanoTime() - started) / 1e9;
+        logger.info("Generated {} accounts into {} in {}s ({} accounts/s), {} failing the modulus check",
+                count, outputDirectory, String.format("%.1f", seconds),
+                String.format("%.0f", count / Math.max(seconds, 1e-9)), modulusFailures.sum());
+        if (modulusMismatches.sum() > 0) {
+            logger.warn("{} accounts have no account digit giving the requested modulus check status,"
+                    + " they carry the status the weight table gives", modulusMismatches.sum());
+        }
+    }
+
+    private void write(Future<Chunk> future, BufferedWriter accounts, BufferedWriter fixtures)
+            throws IOException, InterruptedException {
+        try {
+            Chunk chunk = future.get();
+            accounts.append(chunk.accounts());
+            fixtures.append(chunk.fixtures());
+        } catch (ExecutionException e) {
+            throw new IOException("Failed to generate accounts", e.getCause());
+        }
+    }
+
+    private Chunk generateChunk(long chunk) {
+        SplittableRandom random = new SplittableRandom(seed + chunk * SEED_STRIDE);
+        long from = chunk * CHUNK_SIZE;
+        long to = Math.min(count, from + CHUNK_SIZE);
+        StringBuilder accounts = new StringBuilder((int) (to - from) * 60);
+        StringBuilder fixtures = new StringBuilder((int) (to - from) * 90);
+        StringBuilder bban = new StringBuilder(18);
+        long failures = 0;
+        long mismatches = 0;
+        for (long i = from; i < to; i++) {
+            long prefix = (i * PERMUTATION_MULTIPLIER + PERMUTATION_OFFSET) % ACCOUNT_SPACE;
+            String bankCode = BANK_CODES[(int) ((prefix / 10_000_000L) % BANK_CODES.length)];
+
+            AccountStatus status = accountStatus.pick(random.nextDouble());
+            SwitchingStatus switching = switchingStatus.pick(random.nextDouble());
+            ModulusCheckStatus requested = modulusStatus.pick(random.nextDouble());
+            String iban = null;
+            ModulusCheckStatus modulus = null;
+            for (int digit = 0; digit < 10 && modulus != requested; digit++) {
+                iban = iban(bban, bankCode, prefix * 10 + digit);
+                modulus = modulusCheckEngine.check(iban, ServiceConstants.INTL_BANK_ACCOUNT);
+            }
+            if (modulus != requested) mismatches++;
+            if (modulus == ModulusCheckStatus.FAILED) failures++;
+            boolean ukForm = random.nextDouble() < ukShare;
+
+            accounts.append(iban).append(',').append(status.name()).append(',').append(switching.name()).append('\n');
+            fixtures.append(ukForm ? iban.substring(iban.length() - 14) : iban).append(',')
+                    .append(ukForm ? ServiceConstants.UK_BASIC_BANK_ACCOUNT : ServiceConstants.INTL_BANK_ACCOUNT).append(',')
+                    .append("LT").append(i).append(',')
+                    .append(status.getValue()).append(',').append(switching.getValue()).append(',').append(modulus.getValue())
+                    .append('\n');
+        }
+        modulusFailures.add(failures);
+        modulusMismatches.add(mismatches);
+        return new Chunk(accounts, fixtures);
+    }
+
+    private static String iban(StringBuilder bban, String bankCode, long sortCodeAndAccount) {
+        bban.setLength(0);
+        bban.append(bankCode);
+        appendPadded(bban, sortCodeAndAccount, 14);
+        int checkDigits = ModulusCheckEngine.ibanCheckDigits("GB", bban);
+        return "GB" + (checkDigits < 10 ? "0" : "") + checkDigits + bban;
+    }
+
+    private static void appendPadded(StringBuilder target, long value, int width) {
+        String digits = Long.toString(value);
+        for (int i = digits.length(); i < width; i++) target.append('0');
+        target.append(digits);
+    }
+
+    /**
+     * Output of one chunk, written in chunk order.
+     *
+     * @param accounts account dataset lines
+     * @param fixtures request fixture lines
+     */
+    private record Chunk(CharSequence accounts, CharSequence fixtures) {
+    }
+
+    /**
+     * Weighted distribution over enum values, sampled from a uniform double.
+     *
+     * @param values     the values
+     * @param cumulative cumulative weights normalised to 1
+     * @param <E>        the enum type
+     */
+    public record Distribution<E extends Enum<E>>(E[] values, double[] cumulative) {
+
+        /**
+         * Parses {@code VALUE:weight,VALUE:weight}; weights are normalised.
+         *
+         * @param type the enum type
+         * @param spec the distribution specification
+         * @param <E>  the enum type
+         * @return the distribution
+         */
+        public static <E extends Enum<E>> Distribution<E> parse(Class<E> type, String spec) {
+            String[] entries = spec.split(",");
+            @SuppressWarnings("unchecked")
+            E[] values = (E[]) java.lang.reflect.Array.newInstance(type, entries.length);
+            double[] cumulative = new double[entries.length];
+            double total = 0;
+            for (int i = 0; i < entries.length; i++) {
+                String[] parts = entries[i].trim().split(":");
+                values[i] = Enum.valueOf(type, parts[0].trim());
+                total += parts.length > 1 ? Double.parseDouble(parts[1].trim()) : 1.0;
+                cumulative[i] = total;
+            }
+            if (total <= 0) throw new IllegalArgumentException("Distribution weights must be positive: " + spec);
+            for (int i = 0; i < cumulative.length; i++) cumulative[i] /= total;
+            return new Distribution<>(values, cumulative);
+        }
+
+        /**
+         * @param value an enum value
+         * @return the normalised weight of {@code value}, 0 if it cannot be picked
+         */
+        public double weight(E value) {
+            double weight = 0;
+            for (int i = 0; i < values.length; i++) {
+                if (values[i] == value) weight += cumulative[i] - (i == 0 ? 0 : cumulative[i - 1]);
+            }
+            return weight;
+        }
+
+        /**
+         * @param uniform a value in [0, 1)
+         * @return the sampled enum value
+         */
+        public E pick(double uniform) {
+            for (int i = 0; i < cumulative.length - 1; i++) {
+                if (uniform < cumulative[i]) return values[i];
+            }
+            return values[values.length - 1];
+        }
+    }
+}
+
+
+---------------------------------------
+
+package com.rbs.bdd.common;
+
+import jakarta.xml.soap.SOAPException;
+import org.springframework.ws.WebServiceMessage;
+import org.springframework.ws.soap.saaj.SaajSoapMessage;
+
+import javax.xml.stream.XMLInputFactory;
+import javax.xml.stream.XMLStreamConstants;
+import javax.xml.stream.XMLStreamException;
+import javax.xml.stream.XMLStreamReader;
+import javax.xml.transform.TransformerException;
+import javax.xml.transform.stax.StAXSource;
+import javax.xml.transform.stream.StreamSource;
+import java.io.ByteArrayInputStream;
+
+/**
+ * Message factory independent access to SOAP messages, so the same code runs under the
+ * eager SAAJ factory and the streaming (lazily parsed) factory configured in {@code SoapWebServiceConfig}.
+ * <p>
+ * SAAJ messages take a complete envelope as their SOAP part content, which the lazy factory keeps
+ * unparsed until it is read. Any other {@link WebServiceMessage} receives the body payload through
+ * {@link WebServiceMessage#getPayloadResult()}, copied with StAX without building a DOM.
+ * </p>
+ */
+public final class SoapMessages {
+
+    private static final String SOAP_11_ENVELOPE_NS = "http://schemas.xmlsoap.org/soap/envelope/";
+    private static final String SOAP_12_ENVELOPE_NS = "http://www.w3.org/2003/05/soap-envelope";
+
+    private static final XMLInputFactory INPUT_FACTORY = createInputFactory();
+
+    private SoapMessages() {
+        // Prevent instantiation
+    }
+
+    /**
+     * Replaces the content of {@code message} with the given SOAP envelope.
+     *
+     * @param message  the outgoing message
+     * @param envelope the complete SOAP envelope, UTF-8 encoded
+     * @throws SOAPException        if the SAAJ message rejects the content
+     * @throws TransformerException if the payload cannot be copied
+     */
+    public static void replaceEnvelope(WebServiceMessage message, byte[] envelope)
+            throws SOAPException, TransformerException {
+        if (message instanceof SaajSoapMessage saajMessage) {
+            saajMessage.getSaajMessage().getSOAPPart()
+                    .setContent(new StreamSource(new ByteArrayInputStream(envelope)));
+            return;
+        }
+        XMLStreamReader reader = null;
+        try {
+            reader = INPUT_FACTORY.createXMLStreamReader(new ByteArrayInputStream(envelope));
+            if (advanceToBodyPayload(reader)) {
+                SecureXml.transformer().transform(new StAXSource(reader), message.getPayloadResult());
+            }
+        } catch (XMLStreamException e) {
+            throw new TransformerException("Failed to read SOAP envelope", e);
+        } finally {
+            close(reader);
+        }
+    }
+
+    private static boolean advanceToBodyPayload(XMLStreamReader reader) throws XMLStreamException {
+        boolean inBody = false;
+        while (reader.hasNext()) {
+            if (reader.next() != XMLStreamConstants.START_ELEMENT) continue;
+            if (inBody) return true;
+            String ns = reader.getNamespaceURI();
+            inBody = "Body".equals(reader.getLocalName())
+                    && (SOAP_11_ENVELOPE_NS.equals(ns) || SOAP_12_ENVELOPE_NS.equals(ns));
+        }
+        return false;
+    }
+
+    private static void close(XMLStreamReader reader) {
+        if (reader == null) return;
+        try {
+            reader.close();
+        } catch (XMLStreamException ignored) {
+            // Nothing left to release
+        }
+    }
+
+    private static XMLInputFactory createInputFactory() {
+        XMLInputFactory factory = XMLInputFactory.newFactory();
+        factory.setProperty(XMLInputFactory.SUPPORT_DTD, false);
+        factory.setProperty(XMLInputFactory.IS_SUPPORTING_EXTERNAL_ENTITIES, false);
+        return factory;
+    }
+}
+
+
+---------------------------------------
+
+package com.rbs.bdd.benchmark;
+
+import com.rbs.bdd.common.SoapMessages;
+import com.rbs.bdd.infrastructure.config.LazySaajSoapMessageFactory;
+import com.rbs.bdd.infrastructure.config.SoapWebServiceConfig;
+import com.rbs.bdd.infrastructure.soap.api.PaymentValidationSoapAdapter;
+import com.sun.xml.messaging.saaj.soap.impl.BodyImpl;
+import io.micrometer.core.instrument.MeterRegistry;
+import io.micrometer.core.instrument.simple.SimpleMeterRegistry;
+import jakarta.xml.soap.SOAPBody;
+import jakarta.xml.soap.SOAPException;
+import org.openjdk.jmh.annotations.Benchmark;
+import org.openjdk.jmh.annotations.BenchmarkMode;
+import org.openjdk.jmh.annotations.Fork;
+import org.openjdk.jmh.annotations.Measurement;
+import org.openjdk.jmh.annotations.Mode;
+import org.openjdk.jmh.annotations.OutputTimeUnit;
+import org.openjdk.jmh.annotations.Param;
+import org.openjdk.jmh.annotations.Scope;
+import org.openjdk.jmh.annotations.Setup;
+import org.openjdk.jmh.annotations.State;
+import org.openjdk.jmh.annotations.TearDown;
+import org.openjdk.jmh.annotations.Warmup;
+import org.springframework.context.annotation.AnnotationConfigApplicationContext;
+import org.springframework.context.annotation.Bean;
+import org.springframework.context.annotation.Configuration;
+import org.springframework.context.annotation.Import;
+import org.springframework.core.env.MapPropertySource;
+import org.springframework.core.io.ClassPathResource;
+import org.springframework.ws.FaultAwareWebServiceMessage;
+import org.springframework.ws.WebServiceMessage;
+import org.springframework.ws.context.DefaultMessageContext;
+import org.springframework.ws.context.MessageContext;
+import org.springframework.ws.soap.saaj.SaajSoapMessage;
+import org.springframework.ws.soap.saaj.SaajSoapMessageFactory;
+import org.springframework.ws.soap.server.SoapMessageDispatcher;
+
+import javax.xml.transform.TransformerException;
+import java.io.ByteArrayInputStream;
+import java.io.IOException;
+import java.io.OutputStream;
+import java.nio.charset.StandardCharsets;
+import java.util.Map;
+import java.util.concurrent.TimeUnit;
+
+/**
+ * JMH benchmark of one request/response round trip through the Spring WS pipeline in each SOAP message
+ * factory mode: the message factory reads the request, a {@link SoapMessageDispatcher} runs the
+ * {@code FlightRecorderInterceptor}, the schema validating interceptor and the JAXB bound
+ * {@link PaymentValidationSoapAdapter} exactly as configured by {@link SoapWebServiceConfig}, and the
+ * response is serialised. Only the orchestrator is replaced, by a port writing the static response, so
+ * the rules do not dominate the measurement. The set-up fails if the streaming mode does not leave the
+ * SOAP body unparsed after reading, or if the request is answered with a fault.
+ * <p>
+ * Both interceptors and the JAXB argument resolver read the request through
+ * {@link WebServiceMessage#getPayloadSource()}, which a SAAJ message answers with a {@code DOMSource} of
+ * the body, so the lazy body is expected to be parsed into a DOM within the same request and to save
+ * little or nothing once the interceptors run. Run with {@code ./gradlew jmh -Pjmh.profilers=gc} and
+ * compare {@code gc.alloc.rate.norm} (bytes per request) and throughput of the two modes before
+ * enabling {@value SoapWebServiceConfig#MESSAGE_FACTORY_STREAMING}.
+ * </p>
+ */
+@State(Scope.Benchmark)
+@Fork(1)
+@Warmup(iterations = 3, time = 2)
+@Measurement(iterations = 5, time = 2)
+public class SoapMessageFactoryBenchmark {
+
+    private static final String REQUEST =
+            "<soapenv:Envelope xmlns:soapenv=\"http://schemas.xmlsoap.org/soap/envelope/\" "
+            + "xmlns:v01=\"http://com/rbsg/soa/C040PaymentManagement/ArrValidationForPayment/V01/\">"
+            + "<soapenv:Header/><soapenv:Body><v01:validateArrangementForPayment>"
+            + "<requestHeader><operatingBrand>ALL</operatingBrand>"
+            + "<requestIds><systemId>RBS</systemId><transactionId>LT1</transactionId></requestIds>"
+            + "<cmdType>Request</cmdType></requestHeader>"
+            + "<arrangementIdentifier><identifier>GB29NWBK60161331926801</identifier>"
+            + "<context><schemeName>ArrangementEnterpriseIdType</schemeName>"
+            + "<codeValue>InternationalBankAccountNumber</codeValue></context></arrangementIdentifier>"
+            + "</v01:validateArrangementForPayment></soapenv:Body></soapenv:Envelope>";
+
+    private static final String RESPONSE_PATH = "static-response/response1.xml";
+
+    @Param({SoapWebServiceConfig.MESSAGE_FACTORY_SAAJ, SoapWebServiceConfig.MESSAGE_FACTORY_STREAMING})
+    private String mode;
+
+    private AnnotationConfigApplicationContext context;
+    private SaajSoapMessageFactory factory;
+    private SoapMessageDispatcher dispatcher;
+    private byte[] request;
+
+    @Setup
+    public void setUp() throws Exception {
+        context = new AnnotationConfigApplicationContext();
+        context.getEnvironment().getPropertySources().addFirst(new MapPropertySource("benchmark",
+                Map.of("esp.simulator.soap.message-factory", mode)));
+        context.register(DispatcherConfig.class);
+        context.refresh();
+        factory = context.getBean(SaajSoapMessageFactory.class);
+        dispatcher = new SoapMessageDispatcher();
+        dispatcher.setApplicationContext(context);
+        request = REQUEST.getBytes(StandardCharsets.UTF_8);
+
+        boolean lazy = lazyBody(factory.createWebServiceMessage(new ByteArrayInputStream(request))) != null;
+        if (lazy != SoapWebServiceConfig.MESSAGE_FACTORY_STREAMING.equals(mode)) {
+            throw new IllegalStateException(LazySaajSoapMessageFactory.SAAJ_LAZY_SOAP_BODY
+                    + (lazy ? " is active" : " did not take effect") + " in mode " + mode);
+        }
+        if (roundTrip() instanceof FaultAwareWebServiceMessage response && response.hasFault()) {
+            throw new IllegalStateException("Benchmark request was answered with a fault in mode " + mode);
+        }
+    }
+
+    @TearDown
+    public void tearDown() {
+        context.close();
+    }
+
+    @Benchmark
+    @BenchmarkMode(Mode.Throughput)
+    @OutputTimeUnit(TimeUnit.SECONDS)
+    public WebServiceMessage roundTrip() throws Exception {
+        MessageContext messageContext = new DefaultMessageContext(
+                factory.createWebServiceMessage(new ByteArrayInputStream(request)), factory);
+        dispatcher.receive(messageContext);
+        WebServiceMessage response = messageContext.getResponse();
+        response.writeTo(OutputStream.nullOutputStream());
+        return response;
+    }
+
+    private static BodyImpl lazyBody(SaajSoapMessage message) throws SOAPException {
+        SOAPBody body = message.getSaajMessage().getSOAPBody();
+        return body instanceof BodyImpl impl && impl.isLazy() ? impl : null;
+    }
+
+    /**
+     * The simulator's Spring WS configuration with the endpoint adapter backed by a port that writes
+     * the static response.
+     */
+    @Configuration
+    @Import(SoapWebServiceConfig.class)
+    static class DispatcherConfig {
+
+        @Bean
+        MeterRegistry meterRegistry() {
+            return new SimpleMeterRegistry();
+        }
+
+        @Bean
+        PaymentValidationSoapAdapter paymentValidationSoapAdapter() throws IOException {
+            byte[] response;
+            try (var in = new ClassPathResource(RESPONSE_PATH).getInputStream()) {
+                response = in.readAllBytes();
+            }
+            return new PaymentValidationSoapAdapter((payload, requestMessage, message) -> {
+                try {
+                    SoapMessages.replaceEnvelope(message, response);
+                } catch (SOAPException | TransformerException e) {
+                    throw new IllegalStateException("Failed to write " + RESPONSE_PATH, e);
+                }
+            });
+        }
+    }
+}
+
+
+---------------------------------------
+
+package com.rbs.bdd.infrastructure.config;
+
+import org.springframework.boot.context.properties.ConfigurationProperties;
+
+import java.time.Duration;
+
+/**
+ * Start-up warm-up settings, bound from {@code esp.simulator.warmup}.
+ *
+ * @param enabled             whether warm-up runs before the instance reports ready
+ * @param requestsPerScenario synthetic requests sent for every scenario
+ * @param batchSize           requests per point of the latency curve
+ * @param tolerance           largest relative spread of the batch medians that counts as steady
+ * @param window              consecutive batches that must stay within the tolerance
+ * @param systemId            {@code requestIds/systemId} sent by warm-up requests, so they can be told apart;
+ *                            their accounts are not counted in the shared state and their responses not replayed
+ * @param requestTimeout      timeout of a single warm-up request
+ */
+@ConfigurationProperties("esp.simulator.warmup")
+public record WarmupProperties(Boolean enabled, Integer requestsPerScenario, Integer batchSize,
+                               Double tolerance, Integer window, String systemId, Duration requestTimeout) {
+
+    public WarmupProperties {
+        enabled = enabled == null || enabled;
+        requestsPerScenario = requestsPerScenario != null ? requestsPerScenario : 500;
+        batchSize = batchSize != null ? batchSize : 200;
+        tolerance = tolerance != null ? tolerance : 0.15;
+        window = window != null ? window : 5;
+        systemId = systemId != null ? systemId : "ESPWARMUP";
+        requestTimeout = requestTimeout != null ? requestTimeout : Duration.ofSeconds(5);
+    }
+}
+
+
+---------------------------------------
+
+package com.rbs.bdd.infrastructure.warmup;
+
+import com.rbs.bdd.common.ServiceConstants;
+
+import java.util.List;
+
+/**
+ * Synthetic requests covering every scenario documented in the README: the known accounts,
+ * the UK basic bank account alias, a missing transaction id, an invalid IBAN length,
+ * a MOD97 failure, a GB identifier sent with the wrong code value, schema-invalid and malformed XML.
+ */
+public final class WarmupScenarios {
+
+    private static final String REQUEST_TEMPLATE =
+            "<soapenv:Envelope xmlns:soapenv=\"http://schemas.xmlsoap.org/soap/envelope/\" "
+            + "xmlns:v01=\"http://com/rbsg/soa/C040PaymentManagement/ArrValidationForPayment/V01/\">"
+            + "<soapenv:Header/><soapenv:Body><v01:validateArrangementForPayment>"
+            + "<requestHeader><operatingBrand>ALL</operatingBrand>"
+            + "<requestIds><systemId>%s</systemId>%s</requestIds><cmdType>Request</cmdType></requestHeader>"
+            + "%s"
+            + "</v01:validateArrangementForPayment></soapenv:Body></soapenv:Envelope>";
+
+    private static final String ARRANGEMENT_TEMPLATE =
+            "<arrangementIdentifier><identifier>%s</identifier>"
+            + "<context><schemeName>ArrangementEnterpriseIdType</schemeName><codeValue>%s</codeValue></context>"
+            + "</arrangementIdentifier>";
+
+    private WarmupScenarios() {
+        // Prevent instantiation
+    }
+
+    private static final String TRANSACTION_ID_PLACEHOLDER = "WARMUP_TXN";
+
+    /**
+     * A named warm-up request.
+     *
+     * @param name     scenario name used in the report
+     * @param template the complete SOAP request, with a placeholder for the transaction id
+     */
+    public record Scenario(String name, String template) {
+
+        /**
+         * @param run      identifier of the warm-up run, so restarts and other instances do not reuse ids
+         * @param sequence number of the request within the run
+         * @return the SOAP request with transaction id {@code WARMUP<run>-<sequence>}, so warm-up requests
+         *         are not answered from the replay cache
+         */
+        public String envelope(String run, long sequence) {
+            return template.replace(TRANSACTION_ID_PLACEHOLDER, "WARMUP" + run + "-" + sequence);
+        }
+    }
+
+    /**
+     * @param systemId the {@code requestIds/systemId} to send
+     * @return one request per README scenario
+     */
+    public static List<Scenario> readmeScenarios(String systemId) {
+        String iban = ServiceConstants.IBAN_1;
+        return List.of(
+                account("iban1", systemId, ServiceConstants.IBAN_1, ServiceConstants.INTL_BANK_ACCOUNT),
+                account("iban2", systemId, ServiceConstants.IBAN_2, ServiceConstants.INTL_BANK_ACCOUNT),
+                account("iban3", systemId, ServiceConstants.IBAN_3, ServiceConstants.INTL_BANK_ACCOUNT),
+                account("iban4", systemId, ServiceConstants.IBAN_4, ServiceConstants.INTL_BANK_ACCOUNT),
+                account("ukBasicBankAccount", systemId, iban.substring(iban.length() - 14), ServiceConstants.UK_BASIC_BANK_ACCOUNT),
+                new Scenario("missingTransactionId", String.format(REQUEST_TEMPLATE, systemId, "",
+                        String.format(ARRANGEMENT_TEMPLATE, iban, ServiceConstants.INTL_BANK_ACCOUNT))),
+                account("invalidIbanLength", systemId, iban + "0", ServiceConstants.INTL_BANK_ACCOUNT),
+                account("mod97Failure", systemId, "GB00NWBK60161331926801", ServiceConstants.INTL_BANK_ACCOUNT),
+                account("sortCodeFailure", systemId, "GB07LOYD30963412345678", ServiceConstants.INTL_BANK_ACCOUNT),
+                account("gbIdentifierNotIban", systemId, iban, ServiceConstants.UK_BASIC_BANK_ACCOUNT),
+                new Scenario("schemaInvalid", String.format(REQUEST_TEMPLATE, systemId, transactionId(),
+                        "<arrangementIdentifier><unexpected/></arrangementIdentifier>")),
+                new Scenario("malformedXml", "<soapenv:Envelope xmlns:soapenv=\"http://schemas.xmlsoap.org/soap/envelope/\">"
+                        + "<soapenv:Body><v01:validateArrangementForPayment>"));
+    }
+
+    private static Scenario account(String name, String systemId, String identifier, String codeValue) {
+        return new Scenario(name, String.format(REQUEST_TEMPLATE, systemId, transactionId(),
+                String.format(ARRANGEMENT_TEMPLATE, identifier, codeValue)));
+    }
+
+    private static String transactionId() {
+        return "<transactionId>" + TRANSACTION_ID_PLACEHOLDER + "</transactionId>";
+    }
+}
+
+
+---------------------------------------
+
+package com.rbs.bdd.infrastructure.warmup;
+
+import java.util.ArrayList;
+import java.util.Arrays;
+import java.util.List;
+
+/**
+ * Latency curve recorded in fixed-size batches, with steady-state detection.
+ * <p>
+ * Each completed batch becomes a {@link Point} holding its median, 99th percentile and maximum.
+ * Steady state is reached when the medians of {@code window} consecutive batches differ by at most
+ * {@code tolerance} relative to the smallest of them; the reported position is the first request of
+ * that window. Not thread-safe: the warm-up sends its requests from a single thread.
+ * </p>
+ */
+public final class LatencyCurve {
+
+    private final long[] batch;
+    private final double tolerance;
+    private final int window;
+    private final List<Point> points = new ArrayList<>();
+    private int filled;
+    private int steadyBatch = -1;
+
+    /**
+     * One batch of the curve.
+     *
+     * @param batch     batch index, from 0
+     * @param requests  requests recorded up to and including this batch
+     * @param p50Micros median latency
+     * @param p99Micros 99th percentile latency
+     * @param maxMicros slowest request
+     */
+    public record Point(int batch, long requests, long p50Micros, long p99Micros, long maxMicros) {
+    }
+
+    /**
+     * @param batchSize requests per point
+     * @param tolerance largest relative spread of the batch medians that counts as steady
+     * @param window    consecutive batches that must stay within the tolerance
+     */
+    public LatencyCurve(int batchSize, double tolerance, int window) {
+        if (batchSize < 1 || window < 1) throw new IllegalArgumentException("batchSize and window must be positive");
+        this.batch = new long[batchSize];
+        this.tolerance = tolerance;
+        this.window = window;
+    }
+
+    /**
+     * @param latencyNanos latency of one request
+     */
+    public void record(long latencyNanos) {
+        batch[filled++] = latencyNanos;
+        if (filled == batch.length) closeBatch();
+    }
+
+    /**
+     * @return the completed batches, in order
+     */
+    public List<Point> points() {
+        return List.copyOf(points);
+    }
+
+    /**
+     * @return whether steady state has been reached
+     */
+    public boolean isSteady() {
+        return steadyBatch >= 0;
+    }
+
+    /**
+     * @return requests sent before steady state began, or -1 if it was not reached
+     */
+    public long requestsBeforeSteadyState() {
+        return steadyBatch < 0 ? -1 : (long) steadyBatch * batch.length;
+    }
+
+    /**
+     * @return the median of the last completed batch in microseconds, or -1 if none
+     */
+    public long lastMedianMicros() {
+        return points.isEmpty() ? -1 : points.get(points.size() - 1).p50Micros();
+    }
+
+    private void closeBatch() {
+        Arrays.sort(batch);
+        long requests = (long) (points.size() + 1) * batch.length;
+        points.add(new Point(points.size(), requests, micros(percentile(0.50)), micros(percentile(0.99)),
+                micros(batch[batch.length - 1])));
+        filled = 0;
+        if (steadyBatch < 0 && points.size() >= window) {
+            long min = Long.MAX_VALUE;
+            long max = 0;
+            for (int i = points.size() - window; i < points.size(); i++) {
+                long median = points.get(i).p50Micros();
+                min = Math.min(min, median);
+                max = Math.max(max, median);
+            }
+            if (max - min <= tolerance * Math.max(min, 1)) steadyBatch = points.size() - window;
+        }
+    }
+
+    private long percentile(double quantile) {
+        return batch[Math.min(batch.length - 1, (int) Math.ceil(quantile * batch.length) - 1)];
+    }
+
+    private static long micros(long nanos) {
+        return nanos / 1_000;
+    }
+}
+
+
+---------------------------------------
+
+package com.rbs.bdd.infrastructure.warmup;
+
+import java.util.List;
+
+/**
+ * Outcome of the start-up warm-up, served by {@code GET /admin/warmup}.
+ *
+ * @param status                    {@code pending}, {@code skipped} or {@code completed}
+ * @param scenarios                 number of scenarios exercised
+ * @param requests                  requests sent
+ * @param failures                  requests that failed at transport level
+ * @param elapsedMillis             warm-up duration
+ * @param requestsBeforeSteadyState requests sent before steady state began, -1 if not reached
+ * @param steadyMedianMicros        median latency of the last batch
+ * @param curve                     the latency curve
+ */
+public record WarmupReport(String status, int scenarios, long requests, long failures, long elapsedMillis,
+                           long requestsBeforeSteadyState, long steadyMedianMicros, List<LatencyCurve.Point> curve) {
+
+    static WarmupReport of(String status) {
+        return new WarmupReport(status, 0, 0, 0, 0, -1, -1, List.of());
+    }
+}
+
+
+---------------------------------------
+
+package com.rbs.bdd.infrastructure.warmup;
+
+import com.rbs.bdd.infrastructure.config.WarmupProperties;
+import org.slf4j.Logger;
+import org.slf4j.LoggerFactory;
+import org.springframework.boot.ApplicationArguments;
+import org.springframework.boot.ApplicationRunner;
+import org.springframework.boot.web.context.WebServerApplicationContext;
+import org.springframework.context.ApplicationContext;
+
+import java.io.IOException;
+import java.net.URI;
+import java.net.http.HttpClient;
+import java.net.http.HttpRequest;
+import java.net.http.HttpResponse;
+import java.util.List;
+import java.util.Locale;
+
+/**
+ * Sends synthetic requests for every README scenario through the running {@code /ws} endpoint
+ * (servlet, filters, interceptors, JAXB and the service) before the instance reports ready.
+ * <p>
+ * Spring Boot only moves readiness to {@code ACCEPTING_TRAFFIC} once all application runners have
+ * returned, so load tests that wait on the readiness probe start against a warmed-up JVM. Scenarios are
+ * sent round robin from a single thread and recorded in a {@link LatencyCurve}; the curve and the point
+ * where steady state was reached are logged and kept for {@code GET /admin/warmup}.
+ * Warm-up requests carry their own {@code systemId}, so a throttling default rate may need an entry for it.
+ * </p>
+ */
+public class WarmupRunner implements ApplicationRunner {
+
+    private static final Logger logger = LoggerFactory.getLogger(WarmupRunner.class);
+
+    private final WarmupProperties properties;
+    private final ApplicationContext context;
+    private volatile WarmupReport report = WarmupReport.of("pending");
+
+    /**
+     * @param properties the warm-up settings
+     * @param context    the application context, used to find the local server port
+     */
+    public WarmupRunner(WarmupProperties properties, ApplicationContext context) {
+        this.properties = properties;
+        this.context = context;
+    }
+
+    /**
+     * @return the latest warm-up report
+     */
+    public WarmupReport report() {
+        return report;
+    }
+
+    @Override
+    public void run(ApplicationArguments args) throws InterruptedException {
+        if (!properties.enabled() || !(context instanceof WebServerApplicationContext web)) {
+            logger.info("Warm-up skipped");
+            report = WarmupReport.of("skipped");
+            return;
+        }
+        URI endpoint = URI.create("http://localhost:" + web.getWebServer().getPort() + "/ws");
+        List<WarmupScenarios.Scenario> scenarios = WarmupScenarios.readmeScenarios(properties.systemId());
+        LatencyCurve curve = new LatencyCurve(properties.batchSize(), properties.tolerance(), properties.window());
+        HttpClient client = HttpClient.newBuilder().connectTimeout(properties.requestTimeout()).build();
+
+        logger.info("Warming up with {} requests for each of {} scenarios", properties.requestsPerScenario(), scenarios.size());
+        long started = System.nanoTime();
+        String run = Long.toString(System.currentTimeMillis(), Character.MAX_RADIX).toUpperCase(Locale.ROOT);
+        long requests = 0;
+        long failures = 0;
+        for (int round = 0; round < properties.requestsPerScenario(); round++) {
+            for (WarmupScenarios.Scenario scenario : scenarios) {
+                HttpRequest request = HttpRequest.newBuilder(endpoint)
+                        .timeout(properties.requestTimeout())
+                        .header("Content-Type", "text/xml; charset=utf-8")
+                        .header("SOAPAction", "\"\"")
+                        .POST(HttpRequest.BodyPublishers.ofString(scenario.envelope(run, requests)))
+                        .build();
+                long sent = System.nanoTime();
+                try {
+                    client.send(request, HttpResponse.BodyHandlers.discarding());
+                } catch (IOException e) {
+                    failures++;
+                    logger.debug("Warm-up request {} failed: {}", scenario.name(), e.getMessage());
+                }
+                curve.record(System.nanoTime() - sent);
+                requests++;
+            }
+        }
+        long elapsedMillis = (System.nanoTime() - started) / 1_000_000;
+
+        curve.points().forEach(point -> logger.debug("Warm-up batch {}: {} requests, p50={}us p99={}us max={}us",
+                point.batch(), point.requests(), point.p50Micros(), point.p99Micros(), point.maxMicros()));
+        if (curve.isSteady()) {
+            logger.info("Warm-up completed: {} requests in {} ms, steady state after {} requests (p50 {}us), {} failures",
+                    requests, elapsedMillis, curve.requestsBeforeSteadyState(), curve.lastMedianMicros(), failures);
+        } else {
+            logger.warn("Warm-up completed: {} requests in {} ms without reaching steady state (last p50 {}us), {} failures",
+                    requests, elapsedMillis, curve.lastMedianMicros(), failures);
+        }
+        report = new WarmupReport("completed", scenarios.size(), requests, failures, elapsedMillis,
+                curve.requestsBeforeSteadyState(), curve.lastMedianMicros(), curve.points());
+    }
+}
+
+
+---------------------------------------
+
+package com.rbs.bdd.infrastructure.warmup;
+
+import org.springframework.web.bind.annotation.GetMapping;
+import org.springframework.web.bind.annotation.RequestMapping;
+import org.springframework.web.bind.annotation.RestController;
+
+/**
+ * Serves the start-up warm-up report: {@code GET /admin/warmup}.
+ */
+@RestController
+@RequestMapping("/admin/warmup")
+public class WarmupAdminController {
+
+    private final WarmupRunner warmupRunner;
+
+    /**
+     * @param warmupRunner the warm-up runner
+     */
+    public WarmupAdminController(WarmupRunner warmupRunner) {
+        this.warmupRunner = warmupRunner;
+    }
+
+    /**
+     * @return the latency curve and steady-state point of the warm-up
+     */
+    @GetMapping
+    public WarmupReport report() {
+        return warmupRunner.report();
+    }
+}
+
+
+---------------------------------------
+
+package com.rbs.bdd.infrastructure.config;
+
+import com.rbs.bdd.infrastructure.warmup.WarmupRunner;
+import org.springframework.boot.context.properties.EnableConfigurationProperties;
+import org.springframework.context.ApplicationContext;
+import org.springframework.context.annotation.Bean;
+import org.springframework.context.annotation.Configuration;
+
+/**
+ * Registers the start-up {@link WarmupRunner} configured by {@link WarmupProperties}.
+ */
+@Configuration
+@EnableConfigurationProperties(WarmupProperties.class)
+public class WarmupConfig {
+
+    /**
+     * @param properties the warm-up settings
+     * @param context    the application context
+     * @return the warm-up runner
+     */
+    @Bean
+    public WarmupRunner warmupRunner(WarmupProperties properties, ApplicationContext context) {
+        return new WarmupRunner(properties, context);
+    }
+}
+
+
+---------------------------------------
+
+package com.rbs.bdd.infrastructure.config;
+
+import java.lang.invoke.MethodHandles;
+import java.lang.invoke.VarHandle;
+import java.nio.ByteOrder;
+import java.nio.charset.StandardCharsets;
+import java.util.Collections;
+import java.util.LinkedHashMap;
+import java.util.Map;
+import java.util.concurrent.atomic.LongAdder;
+
+/**
+ * Bounded cache of XSD validation outcomes keyed by a digest of the serialised request payload.
+ * <p>
+ * Load tests replay a handful of payloads, so each distinct payload is validated once and its outcome,
+ * including the first {@code SAXParseException} message, is reused afterwards. Every request carries its
+ * own transaction id, so payloads are canonicalised with {@link #maskTransactionIds} before hashing. Keys are a 128-bit
+ * two-lane multiplicative hash plus the payload length, computed in one pass without allocation; unlike
+ * {@link CompressedVariantCache} the content itself is not kept. Least recently used outcomes are evicted
+ * first. Also records the hit ratio and the validation time saved (hits times the mean validation time of
+ * a miss, less the time spent hashing).
+ * </p>
+ */
+public class SchemaValidationCache {
+
+    private static final VarHandle LONG_LE = MethodHandles.byteArrayViewVarHandle(long[].class, ByteOrder.LITTLE_ENDIAN);
+    private static final long C1 = 0x87c37b91114253d5L;
+    private static final long C2 = 0x4cf5ad432745937fL;
+    private static final byte[] TRANSACTION_ID_TAG = "transactionId>".getBytes(StandardCharsets.US_ASCII);
+
+    /**
+     * A cached validation outcome.
+     *
+     * @param valid      whether the payload passed validation
+     * @param firstError message of the first validation error, null if valid or unknown
+     */
+    public record Outcome(boolean valid, String firstError) {
+        public static final Outcome VALID = new Outcome(true, null);
+    }
+
+    /**
+     * Payload digest used as the cache key.
+     *
+     * @param high   first hash lane
+     * @param low    second hash lane
+     * @param length payload length in bytes
+     */
+    public record Digest(long high, long low, int length) {
+    }
+
+    private final Map<Digest, Outcome> outcomes;
+    private final LongAdder hits = new LongAdder();
+    private final LongAdder misses = new LongAdder();
+    private final LongAdder evictions = new LongAdder();
+    private final LongAdder validationNanos = new LongAdder();
+    private final LongAdder digestNanos = new LongAdder();
+
+    /**
+     * @param maxEntries maximum number of cached outcomes
+     */
+    public SchemaValidationCache(int maxEntries) {
+        this.outcomes = Collections.synchronizedMap(new LinkedHashMap<>(16, 0.75f, true) {
+            @Override
+            protected boolean removeEldestEntry(Map.Entry<Digest, Outcome> eldest) {
+                boolean evict = size() > maxEntries;
+                if (evict) evictions.increment();
+                return evict;
+            }
+        });
+    }
+
+    /**
+     * Replaces, in place, the text of every {@code transactionId} element with its shape: ASCII digits
+     * become {@code 0}, ASCII letters {@code A}, other bytes are kept. Requests differing only in their
+     * transaction id then share a digest, while length and character class facets of the schema still see
+     * an equivalent value. Elements with attributes are left as they are.
+     *
+     * @param payload the serialised payload, modified in place
+     * @param length  number of valid bytes in {@code payload}
+     */
+    public static void maskTransactionIds(byte[] payload, int length) {
+        int i = indexOf(payload, length, 0);
+        while (i >= 0) {
+            int text = i + TRANSACTION_ID_TAG.length;
+            if (isStartTag(payload, i)) {
+                for (int j = text; j < length && payload[j] != '<'; j++) {
+                    byte b = payload[j];
+                    if (b >= '0' && b <= '9') {
+                        payload[j] = '0';
+                    } else if ((b >= 'a' && b <= 'z') || (b >= 'A' && b <= 'Z')) {
+                        payload[j] = 'A';
+                    }
+                }
+            }
+            i = indexOf(payload, length, text);
+        }
+    }
+
+    private static int indexOf(byte[] payload, int length, int from) {
+        outer:
+        for (int i = from; i <= length - TRANSACTION_ID_TAG.length; i++) {
+            for (int j = 0; j < TRANSACTION_ID_TAG.length; j++) {
+                if (payload[i + j] != TRANSACTION_ID_TAG[j]) continue outer;
+            }
+            return i;
+        }
+        return -1;
+    }
+
+    /**
+     * Walks back over an optional namespace prefix to the {@code <}; true unless it opens an end tag.
+     */
+    private static boolean isStartTag(byte[] payload, int nameStart) {
+        int i = nameStart - 1;
+        while (i >= 0 && payload[i] != '<') {
+            byte b = payload[i];
+            if (b == ' ' || b == '>' || b == '"' || b == '\'') return false;
+            i--;
+        }
+        return i >= 0 && i + 1 < payload.length && payload[i + 1] != '/';
+    }
+
+    /**
+     * Digests the payload; the time spent is charged against the time saved.
+     *
+     * @param payload the serialised payload
+     * @param length  number of valid bytes in {@code payload}
+     * @return the cache key
+     */
+    public Digest digest(byte[] payload, int length) {
+        long start = System.nanoTime();
+        long h1 = length * C1;
+        long h2 = ~length * C2;
+        int i = 0;
+        for (; i + Long.BYTES <= length; i += Long.BYTES) {
+            long k = (long) LONG_LE.get(payload, i);
+            h1 = Long.rotateLeft(h1 ^ k * C1, 31) * C2 + 0x52dce729;
+            h2 = Long.rotateLeft(h2 + k * C2, 33) * C1 ^ 0x38495ab5;
+        }
+        for (; i < length; i++) {
+            long k = payload[i] & 0xFF;
+            h1 = (h1 ^ k) * C1;
+            h2 = (h2 + k) * C2;
+        }
+        Digest digest = new Digest(mix(h1 ^ h2), mix(h2 + h1), length);
+        digestNanos.add(System.nanoTime() - start);
+        return digest;
+    }
+
+    /**
+     * @param digest the payload digest
+     * @return the cached outcome, or null on a miss
+     */
+    public Outcome get(Digest digest) {
+        Outcome outcome = outcomes.get(digest);
+        if (outcome != null) {
+            hits.increment();
+        } else {
+            misses.increment();
+        }
+        return outcome;
+    }
+
+    /**
+     * Stores the outcome of a validation that missed the cache.
+     *
+     * @param digest          the payload digest
+     * @param outcome         the validation outcome
+     * @param validationNanos time the validation took
+     */
+    public void put(Digest digest, Outcome outcome, long validationNanos) {
+        this.validationNanos.add(validationNanos);
+        outcomes.put(digest, outcome);
+    }
+
+    /**
+     * @return snapshot of the cache statistics
+     */
+    public ValidationCacheStats stats() {
+        long hitCount = hits.sum();
+        long missCount = misses.sum();
+        long meanValidation = missCount == 0 ? 0 : validationNanos.sum() / missCount;
+        long saved = hitCount * meanValidation - digestNanos.sum();
+        double ratio = hitCount + missCount == 0 ? 0 : (double) hitCount / (hitCount + missCount);
+        return new ValidationCacheStats(hitCount, missCount, evictions.sum(), outcomes.size(), ratio, saved);
+    }
+
+    private static long mix(long h) {
+        h ^= h >>> 33;
+        h *= 0xff51afd7ed558ccdL;
+        h ^= h >>> 33;
+        h *= 0xc4ceb9fe1a85ec53L;
+        return h ^ (h >>> 33);
+    }
+
+    /**
+     * Validation cache statistics.
+     *
+     * @param hits       lookups answered from the cache
+     * @param misses     lookups that ran the XSD validation
+     * @param evictions  outcomes evicted to respect the bound
+     * @param size       current number of outcomes
+     * @param hitRatio   hits over lookups
+     * @param savedNanos validation time saved, net of hashing
+     */
+    public record ValidationCacheStats(long hits, long misses, long evictions, int size, double hitRatio,
+                                       long savedNanos) {
+    }
+}
+
+
+---------------------------------------
+
+package com.rbs.bdd.infrastructure.config;
+
+import io.micrometer.core.instrument.FunctionCounter;
+import io.micrometer.core.instrument.Gauge;
+import io.micrometer.core.instrument.MeterRegistry;
+import io.micrometer.core.instrument.TimeGauge;
+import org.slf4j.Logger;
+import org.slf4j.LoggerFactory;
+import org.springframework.beans.factory.annotation.Value;
+import org.springframework.boot.autoconfigure.condition.ConditionalOnProperty;
+import org.springframework.context.annotation.Bean;
+import org.springframework.context.annotation.Configuration;
+
+import java.util.concurrent.TimeUnit;
+
+/**
+ * Opt-in {@link SchemaValidationCache}, enabled with {@code esp.simulator.validation-cache.enabled=true}.
+ * Publishes {@code esp.validation.cache.*}: hits, misses, evictions, size, hit ratio and time saved.
+ */
+@Configuration
+@ConditionalOnProperty(prefix = "esp.simulator.validation-cache", name = "enabled", havingValue = "true")
+public class SchemaValidationCacheConfig {
+
+    private static final Logger logger = LoggerFactory.getLogger(SchemaValidationCacheConfig.class);
+
+    /**
+     * @param maxEntries maximum number of cached validation outcomes
+     * @param registry   the metrics registry
+     * @return the validation cache
+     */
+    @Bean
+    public SchemaValidationCache schemaValidationCache(
+            @Value("${esp.simulator.validation-cache.max-entries:1024}") int maxEntries, MeterRegistry registry) {
+        SchemaValidationCache cache = new SchemaValidationCache(maxEntries);
+        FunctionCounter.builder("esp.validation.cache.hits", cache, c -> c.stats().hits()).register(registry);
+        FunctionCounter.builder("esp.validation.cache.misses", cache, c -> c.stats().misses()).register(registry);
+        FunctionCounter.builder("esp.validation.cache.evictions", cache, c -> c.stats().evictions()).register(registry);
+        Gauge.builder("esp.validation.cache.size", cache, c -> c.stats().size()).register(registry);
+        Gauge.builder("esp.validation.cache.hit.ratio", cache, c -> c.stats().hitRatio()).register(registry);
+        TimeGauge.builder("esp.validation.cache.time.saved", cache, TimeUnit.NANOSECONDS, c -> c.stats().savedNanos())
+                .register(registry);
+        logger.info("Schema validation cache enabled with {} entries", maxEntries);
+        return cache;
+    }
+}
+
+
+---------------------------------------
+
+package com.rbs.bdd.infrastructure.config;
+
+import jakarta.servlet.FilterChain;
+import jakarta.servlet.ServletException;
+import jakarta.servlet.http.HttpServletRequest;
+import jakarta.servlet.http.HttpServletResponse;
+import org.slf4j.Logger;
+import org.slf4j.LoggerFactory;
+import org.springframework.http.HttpHeaders;
+import org.springframework.http.HttpMethod;
+import org.springframework.web.filter.OncePerRequestFilter;
+import org.springframework.web.util.ContentCachingResponseWrapper;
+
+import java.io.IOException;
+import java.security.MessageDigest;
+import java.security.NoSuchAlgorithmException;
+import java.util.EnumMap;
+import java.util.HexFormat;
+import java.util.Map;
+import java.util.concurrent.ConcurrentHashMap;
+import java.util.concurrent.atomic.LongAdder;
+
+/**
+ * Serves the WSDL and XSD documents from pre-rendered, pre-compressed bytes held in memory.
+ * <p>
+ * {@code DefaultWsdl11Definition} rewrites locations for the host the client used
+ * ({@code setTransformWsdlLocations(true)}), so a document is rendered once per scheme, host, port
+ * and path through the {@code MessageDispatcherServlet} and kept with its gzip and deflate variants.
+ * Each variant has its own strong ETag (the identity tag with a {@code -gzip} or {@code -deflate} suffix),
+ * since their bytes differ. Later fetches are answered from memory, and an {@code If-None-Match} matching
+ * the ETag of the negotiated variant costs only a 304. Once {@code maxVariants} variants are held, new ones are rendered per request.
+ * Registered inside {@link SoapCompressionFilter}, which passes already encoded bodies through unchanged.
+ * </p>
+ */
+public class WsdlDocumentFilter extends OncePerRequestFilter {
+
+    private static final Logger logger = LoggerFactory.getLogger(WsdlDocumentFilter.class);
+
+    private final CompressedVariantCache variants;
+    private final int maxVariants;
+    private final Map<String, RenderedDocument> documents = new ConcurrentHashMap<>();
+    private final LongAdder served = new LongAdder();
+    private final LongAdder notModified = new LongAdder();
+    private final LongAdder renders = new LongAdder();
+
+    /**
+     * @param variants    cache used to compress the rendered documents
+     * @param maxVariants maximum number of host/location variants kept
+     */
+    public WsdlDocumentFilter(CompressedVariantCache variants, int maxVariants) {
+        this.variants = variants;
+        this.maxVariants = maxVariants;
+    }
+
+    @Override
+    protected boolean shouldNotFilter(HttpServletRequest request) {
+        String uri = request.getRequestURI();
+        return !HttpMethod.GET.matches(request.getMethod()) || !(uri.endsWith(".wsdl") || uri.endsWith(".xsd"));
+    }
+
+    @Override
+    protected void doFilterInternal(HttpServletRequest request, HttpServletResponse response, FilterChain chain)
+            throws ServletException, IOException {
+        String key = request.getScheme() + "://" + request.getServerName() + ":" + request.getServerPort()
+                + request.getRequestURI();
+        RenderedDocument document = documents.get(key);
+        if (document == null) {
+            document = render(request, response, chain);
+            if (document == null) return;
+            if (documents.size() < maxVariants) {
+                documents.putIfAbsent(key, document);
+                logger.info("Pre-rendered {} ({} bytes, ETag {})", key, document.identity().length, document.etag());
+            }
+        }
+
+        CompressedVariantCache.Coding coding = SoapCompressionFilter.negotiate(request.getHeader(HttpHeaders.ACCEPT_ENCODING));
+        String etag = document.etag(coding);
+        response.setHeader(HttpHeaders.ETAG, etag);
+        response.setHeader(HttpHeaders.CACHE_CONTROL, "no-cache");
+        response.addHeader(HttpHeaders.VARY, HttpHeaders.ACCEPT_ENCODING);
+        if (matches(request.getHeader(HttpHeaders.IF_NONE_MATCH), etag)) {
+            notModified.increment();
+            response.setStatus(HttpServletResponse.SC_NOT_MODIFIED);
+            return;
+        }
+        byte[] body = coding != null ? document.encoded().get(coding) : document.identity();
+        if (coding != null) response.setHeader(HttpHeaders.CONTENT_ENCODING, coding.getValue());
+        response.setContentType(document.contentType());
+        response.setContentLength(body.length);
+        response.getOutputStream().write(body);
+        served.increment();
+    }
+
+    /**
+     * @return documents served from memory
+     */
+    public long served() {
+        return served.sum();
+    }
+
+    /**
+     * @return fetches answered with 304 Not Modified
+     */
+    public long notModified() {
+        return notModified.sum();
+    }
+
+    /**
+     * @return documents rendered through the servlet
+     */
+    public long renders() {
+        return renders.sum();
+    }
+
+    /**
+     * @return host/location variants held in memory
+     */
+    public int variants() {
+        return documents.size();
+    }
+
+    /**
+     * Renders the document through the servlet; non-200 answers are passed on and not kept.
+     */
+    private RenderedDocument render(HttpServletRequest request, HttpServletResponse response, FilterChain chain)
+            throws ServletException, IOException {
+        ContentCachingResponseWrapper buffered = new ContentCachingResponseWrapper(response);
+        chain.doFilter(request, buffered);
+        renders.increment();
+        if (buffered.getStatus() != HttpServletResponse.SC_OK) {
+            buffered.copyBodyToResponse();
+            return null;
+        }
+        byte[] identity = buffered.getContentAsByteArray();
+        buffered.resetBuffer();
+        Map<CompressedVariantCache.Coding, byte[]> encoded = new EnumMap<>(CompressedVariantCache.Coding.class);
+        for (CompressedVariantCache.Coding coding : CompressedVariantCache.Coding.values()) {
+            encoded.put(coding, variants.compress(identity, identity.length, coding));
+        }
+        String contentType = buffered.getContentType() != null ? buffered.getContentType() : "text/xml;charset=UTF-8";
+        return new RenderedDocument(identity, encoded, etag(identity), contentType);
+    }
+
+    private static boolean matches(String ifNoneMatch, String etag) {
+        if (ifNoneMatch == null) return false;
+        for (String candidate : ifNoneMatch.split(",")) {
+            String tag = candidate.trim();
+            if (tag.startsWith("W/")) tag = tag.substring(2);
+            if ("*".equals(tag) || etag.equals(tag)) return true;
+        }
+        return false;
+    }
+
+    private static String etag(byte[] body) {
+        try {
+            byte[] sha = MessageDigest.getInstance("SHA-256").digest(body);
+            return "\"" + HexFormat.of().formatHex(sha, 0, 16) + "\"";
+        } catch (NoSuchAlgorithmException e) {
+            throw new IllegalStateException("SHA-256 not available", e);
+        }
+    }
+
+    /**
+     * A rendered document variant.
+     *
+     * @param identity    uncompressed bytes
+     * @param encoded     pre-compressed bytes per coding
+     * @param etag        strong ETag of the uncompressed bytes
+     * @param contentType the content type the servlet answered with
+     */
+    private record RenderedDocument(byte[] identity, Map<CompressedVariantCache.Coding, byte[]> encoded,
+                                    String etag, String contentType) {
+
+        /**
+         * @param coding the content coding, or null for identity
+         * @return the ETag of the representation sent with that coding
+         */
+        String etag(CompressedVariantCache.Coding coding) {
+            return coding == null ? etag : etag.substring(0, etag.length() - 1) + "-" + coding.getValue() + "\"";
+        }
+    }
+}
+
+
+---------------------------------------
+
+package com.rbs.bdd.application.idempotency;
+
+import java.security.MessageDigest;
+import java.security.NoSuchAlgorithmException;
+import java.util.Map;
+import java.util.Queue;
+import java.util.concurrent.ConcurrentHashMap;
+import java.util.concurrent.ConcurrentLinkedQueue;
+import java.util.concurrent.atomic.LongAdder;
+import java.util.function.Consumer;
+import java.util.function.LongSupplier;
+
+/**
+ * Bounded, time-expiring cache of rendered responses keyed on {@code (systemId, transactionId)}.
+ * <p>
+ * Retries of a request within the time to live get the identical response bytes back without running
+ * the pipeline. Every entry lives for the same time, so insertion order is expiry order: a FIFO queue
+ * next to the {@link ConcurrentHashMap} drops expired entries, and the oldest ones once the bound is
+ * reached, without scanning. Two concurrent first attempts may both render; the last one is kept.
+ * Each entry carries a SHA-256 digest of the request payload; a request reusing a transaction id with a
+ * different payload is a miss and runs the pipeline. Entries can be shared with other instances through a {@link ReplicationListener} and
+ * {@link #putReplicated}.
+ * </p>
+ */
+public final class ReplayCache {
+
+    private final boolean enabled;
+    private final int maxEntries;
+    private final long ttlNanos;
+    private final LongSupplier clock;
+    private final Map<Key, Entry> entries = new ConcurrentHashMap<>();
+    private final Queue<Entry> insertionOrder = new ConcurrentLinkedQueue<>();
+    private final LongAdder hits = new LongAdder();
+    private final LongAdder misses = new LongAdder();
+    private final LongAdder expired = new LongAdder();
+    private final LongAdder evicted = new LongAdder();
+    private volatile ReplicationListener replicationListener = (key, requestDigest, response, ttlNanos) -> { };
+    private volatile Consumer<byte[]> responseListener = response -> { };
+
+    /**
+     * Replay key.
+     *
+     * @param systemId      the requesting system, may be null
+     * @param transactionId the request transaction id
+     */
+    public record Key(String systemId, String transactionId) {
+
+        private static final char SEPARATOR = '\u001f';
+
+        /**
+         * @return the key as a single string, for shared state stores
+         */
+        public String encoded() {
+            return (systemId != null ? systemId : "") + SEPARATOR + transactionId;
+        }
+
+        /**
+         * @param encoded a key produced by {@link #encoded()}
+         * @return the key
+         */
+        public static Key decode(String encoded) {
+            int separator = encoded.indexOf(SEPARATOR);
+            String systemId = encoded.substring(0, separator);
+            return new Key(systemId.isEmpty() ? null : systemId, encoded.substring(separator + 1));
+        }
+    }
+
+    /**
+     * Receives every response stored by this instance, for replication to other instances.
+     */
+    @FunctionalInterface
+    public interface ReplicationListener {
+
+        /**
+         * @param key           the replay key
+         * @param requestDigest digest of the request payload the response was rendered for
+         * @param response      the stored response
+         * @param ttlNanos      time the response is replayed for
+         */
+        void stored(Key key, byte[] requestDigest, byte[] response, long ttlNanos);
+    }
+
+    private record Entry(Key key, byte[] requestDigest, byte[] response, long expiresAt) {
+    }
+
+    /**
+     * @param enabled    whether responses are replayed
+     * @param maxEntries maximum number of stored responses
+     * @param ttlNanos   how long a response is replayed
+     * @param clock      monotonic nanosecond clock
+     */
+    public ReplayCache(boolean enabled, int maxEntries, long ttlNanos, LongSupplier clock) {
+        this.enabled = enabled;
+        this.maxEntries = maxEntries;
+        this.ttlNanos = ttlNanos;
+        this.clock = clock;
+    }
+
+    /**
+     * @param systemId      the requesting system
+     * @param transactionId the request transaction id
+     * @return the replay key, or null when replay is disabled or the request has no transaction id
+     */
+    public Key keyFor(String systemId, String transactionId) {
+        return enabled && transactionId != null ? new Key(systemId, transactionId) : null;
+    }
+
+    /**
+     * @param payload the serialised request payload
+     * @return SHA-256 digest of {@code payload}
+     */
+    public static byte[] digest(byte[] payload) {
+        try {
+            return MessageDigest.getInstance("SHA-256").digest(payload);
+        } catch (NoSuchAlgorithmException e) {
+            throw new IllegalStateException("SHA-256 not available", e);
+        }
+    }
+
+    /**
+     * @param key           the replay key
+     * @param requestDigest {@link #digest} of the request payload
+     * @return the stored response, or null on a miss, expiry or a different request payload
+     */
+    public byte[] get(Key key, byte[] requestDigest) {
+        Entry entry = entries.get(key);
+        if (entry != null && entry.expiresAt() - clock.getAsLong() <= 0) {
+            if (entries.remove(key, entry)) expired.increment();
+            entry = null;
+        }
+        if (entry == null || !MessageDigest.isEqual(entry.requestDigest(), requestDigest)) {
+            misses.increment();
+            return null;
+        }
+        hits.increment();
+        return entry.response();
+    }
+
+    /**
+     * @param listener receives every response stored through {@link #put}
+     */
+    public void setReplicationListener(ReplicationListener listener) {
+        this.replicationListener = listener;
+    }
+
+    /**
+     * @param listener receives every response stored, locally or replicated, e.g. to pre-compress it
+     */
+    public void setResponseListener(Consumer<byte[]> listener) {
+        this.responseListener = listener;
+    }
+
+    /**
+     * Stores a rendered response, dropping expired and, above the bound, the oldest entries.
+     *
+     * @param key           the replay key
+     * @param requestDigest {@link #digest} of the request payload
+     * @param response      the complete response bytes
+     */
+    public void put(Key key, byte[] requestDigest, byte[] response) {
+        store(key, requestDigest, response, ttlNanos);
+        replicationListener.stored(key, requestDigest, response, ttlNanos);
+    }
+
+    /**
+     * Stores a response replicated from another instance, without replicating it again.
+     *
+     * @param key            the replay key
+     * @param requestDigest  digest of the request payload the response was rendered for
+     * @param response       the complete response bytes
+     * @param remainingNanos remaining time to live
+     */
+    public void putReplicated(Key key, byte[] requestDigest, byte[] response, long remainingNanos) {
+        if (enabled) store(key, requestDigest, response, Math.min(remainingNanos, ttlNanos));
+    }
+
+    private void store(Key key, byte[] requestDigest, byte[] response, long entryTtlNanos) {
+        long now = clock.getAsLong();
+        Entry entry = new Entry(key, requestDigest, response, now + entryTtlNanos);
+        entries.put(key, entry);
+        insertionOrder.add(entry);
+        responseListener.accept(response);
+        Entry head;
+        while ((head = insertionOrder.peek()) != null
+                && (head.expiresAt() - now <= 0 || entries.size() > maxEntries)) {
+            if (!insertionOrder.remove(head)) continue;
+            if (entries.remove(head.key(), head)) {
+                if (head.expiresAt() - now <= 0) {
+                    expired.increment();
+                } else {
+                    evicted.increment();
+                }
+            }
+        }
+    }
+
+    public int size() {
+        return entries.size();
+    }
+
+    public long hits() {
+        return hits.sum();
+    }
+
+    public long misses() {
+        return misses.sum();
+    }
+
+    public long expired() {
+        return expired.sum();
+    }
+
+    public long evicted() {
+        return evicted.sum();
+    }
+}
+
+
+---------------------------------------
+
+package com.rbs.bdd.infrastructure.config;
+
+import com.rbs.bdd.application.idempotency.ReplayCache;
+import io.micrometer.core.instrument.FunctionCounter;
+import io.micrometer.core.instrument.Gauge;
+import io.micrometer.core.instrument.MeterRegistry;
+import org.springframework.beans.factory.annotation.Value;
+import org.springframework.context.annotation.Bean;
+import org.springframework.context.annotation.Configuration;
+
+import java.time.Duration;
+
+/**
+ * Configures the idempotent replay cache and publishes {@code esp.idempotency.hits},
+ * {@code esp.idempotency.misses}, {@code esp.idempotency.expired}, {@code esp.idempotency.evicted}
+ * and {@code esp.idempotency.size}. With HTTP compression enabled, stored responses are pre-compressed
+ * so replays are not compressed again.
+ */
+@Configuration
+public class IdempotencyConfig {
+
+    /**
+     * Creates the replay cache; when idempotency is disabled every request runs the pipeline.
+     *
+     * @param registry    the metrics registry
+     * @param variants    the compressed variant cache
+     * @param enabled     whether retries are answered from the cache
+     * @param maxEntries  maximum number of stored responses
+     * @param ttl         how long a response is replayed
+     * @param compression whether HTTP compression is enabled
+     * @return the replay cache
+     */
+    @Bean
+    public ReplayCache replayCache(MeterRegistry registry, CompressedVariantCache variants,
+            @Value("${esp.simulator.idempotency.enabled:false}") boolean enabled,
+            @Value("${esp.simulator.idempotency.max-entries:10000}") int maxEntries,
+            @Value("${esp.simulator.idempotency.ttl:5m}") Duration ttl,
+            @Value("${esp.simulator.compression.enabled:true}") boolean compression) {
+        ReplayCache cache = new ReplayCache(enabled, maxEntries, ttl.toNanos(), System::nanoTime);
+        if (compression) cache.setResponseListener(variants::precompress);
+        Gauge.builder("esp.idempotency.size", cache, ReplayCache::size).register(registry);
+        FunctionCounter.builder("esp.idempotency.hits", cache, ReplayCache::hits).register(registry);
+        FunctionCounter.builder("esp.idempotency.misses", cache, ReplayCache::misses).register(registry);
+        FunctionCounter.builder("esp.idempotency.expired", cache, ReplayCache::expired).register(registry);
+        FunctionCounter.builder("esp.idempotency.evicted", cache, ReplayCache::evicted).register(registry);
+        return cache;
+    }
+}
+
+
+---------------------------------------
+
+package com.rbs.bdd.application.service;
+
+import com.rbs.bdd.domain.rules.RuleOutcome;
+
+/**
+ * Result of running an account through the routing rules, before any response is rendered.
+ *
+ * @param ruleName        name of the matched routing rule, or {@code sortCodeFailure} if only an injected
+ *                        sort code failure applies
+ * @param outcome         the outcome to return; for {@code RESPOND} the modulus status is always set
+ * @param sortCode        the sort code of the identifier, or -1 if it has none
+ * @param injectedFailure whether a sort code directory failure replaced the rule outcome
+ */
+public record AccountDecision(String ruleName, RuleOutcome outcome, int sortCode, boolean injectedFailure) {
+}
+
+
+---------------------------------------
+
+package com.rbs.bdd.infrastructure.bulk;
+
+import com.fasterxml.jackson.databind.JsonNode;
+import com.fasterxml.jackson.databind.ObjectMapper;
+import com.rbs.bdd.application.service.AccountDecision;
+import com.rbs.bdd.application.service.AccountValidationService;
+import com.rbs.bdd.domain.rules.RuleOutcome;
+import org.slf4j.Logger;
+import org.slf4j.LoggerFactory;
+import org.springframework.beans.factory.annotation.Value;
+import org.springframework.boot.ApplicationArguments;
+import org.springframework.boot.ApplicationRunner;
+import org.springframework.boot.autoconfigure.condition.ConditionalOnProperty;
+import org.springframework.stereotype.Component;
+
+import java.io.BufferedReader;
+import java.io.BufferedWriter;
+import java.io.IOException;
+import java.io.UncheckedIOException;
+import java.nio.charset.StandardCharsets;
+import java.nio.file.Files;
+import java.nio.file.Path;
+import java.util.ArrayDeque;
+import java.util.ArrayList;
+import java.util.Deque;
+import java.util.LinkedHashMap;
+import java.util.List;
+import java.util.Locale;
+import java.util.Map;
+import java.util.Optional;
+import java.util.concurrent.ExecutionException;
+import java.util.concurrent.ExecutorService;
+import java.util.concurrent.Executors;
+import java.util.concurrent.Future;
+import java.util.concurrent.atomic.LongAdder;
+
+/**
+ * Offline bulk validation: streams a CSV or NDJSON file of identifiers through the same routing rules,
+ * sort code failures and modulus checks as {@link AccountValidationService}, without rendering SOAP.
+ * <p>
+ * Started by {@code EspSimulatorEngine --esp.simulator.bulk.input=accounts.csv [--esp.simulator.bulk.output=results.csv]
+ * [--esp.simulator.bulk.threads=N] [--esp.simulator.bulk.batch-size=8192]}, which runs without a web server.
+ * CSV input is {@code identifier,codeValue[,transactionId]} with an optional header, quoted as in RFC 4180
+ * (one record per line); NDJSON input has the same fields per line. The input is read in batches, batches are
+ * decided on all cores and written back in input order through a bounded window, so memory stays constant for
+ * inputs of any size. The output format follows the input; a malformed CSV or NDJSON line gets an
+ * {@code INVALID_RECORD} row and the run continues. Throughput and the number of invalid records are logged
+ * at the end.
+ * </p>
+ */
+@Component
+@ConditionalOnProperty(prefix = "esp.simulator.bulk", name = "input")
+public class BulkValidationRunner implements ApplicationRunner {
+
+    private static final Logger logger = LoggerFactory.getLogger(BulkValidationRunner.class);
+    private static final String CSV_HEADER = "identifier,codeValue,transactionId,rule,action,accountStatus,"
+            + "switchingStatus,modulusCheckStatus,returnCode,systemReturnCode,description";
+
+    private final AccountValidationService accountValidationService;
+    private final ObjectMapper objectMapper = new ObjectMapper();
+    private final LongAdder invalidRecords = new LongAdder();
+    private final Path input;
+    private final Path output;
+    private final int threads;
+    private final int batchSize;
+
+    /**
+     * @param accountValidationService the service whose rules are applied
+     * @param input                    the input file
+     * @param output                   the output file, defaults to the input name with {@code .results} inserted
+     * @param threads                  worker threads, defaults to the number of cores
+     * @param batchSize                records per batch
+     */
+    public BulkValidationRunner(AccountValidationService accountValidationService,
+                                @Value("${esp.simulator.bulk.input}") Path input,
+                                @Value("${esp.simulator.bulk.output:}") String output,
+                                @Value("${esp.simulator.bulk.threads:0}") int threads,
+                                @Value("${esp.simulator.bulk.batch-size:8192}") int batchSize) {
+        this.accountValidationService = accountValidationService;
+        this.input = input;
+        this.output = output.isBlank() ? defaultOutput(input) : Path.of(output);
+        this.threads = threads > 0 ? threads : Runtime.getRuntime().availableProcessors();
+        this.batchSize = Math.max(1, batchSize);
+    }
+
+    @Override
+    public void run(ApplicationArguments args) throws IOException, InterruptedException {
+        boolean ndjson = input.getFileName().toString().toLowerCase(Locale.ROOT).endsWith(".ndjson");
+        logger.info("Bulk validation of {} into {} on {} threads", input, output, threads);
+        long started = System.nanoTime();
+        long records = 0;
+        ExecutorService pool = Executors.newFixedThreadPool(threads);
+        try (BufferedReader reader = Files.newBufferedReader(input, StandardCharsets.UTF_8);
+             BufferedWriter writer = Files.newBufferedWriter(output, StandardCharsets.UTF_8)) {
+            if (!ndjson) writer.write(CSV_HEADER + "\n");
+            Deque<Future<String>> window = new ArrayDeque<>();
+            List<String> batch = new ArrayList<>(batchSize);
+            String line;
+            boolean first = true;
+            while ((line = reader.readLine()) != null) {
+                if (line.isBlank() || (first && !ndjson && line.startsWith("identifier"))) {
+                    first = false;
+                    continue;
+                }
+                first = false;
+                batch.add(line);
+                records++;
+                if (batch.size() == batchSize) {
+                    List<String> lines = batch;
+                    window.add(pool.submit(() -> process(lines, ndjson)));
+                    batch = new ArrayList<>(batchSize);
+                    if (window.size() >= threads * 2) write(window.poll(), writer);
+                }
+            }
+            if (!batch.isEmpty()) {
+                List<String> lines = batch;
+                window.add(pool.submit(() -> process(lines, ndjson)));
+            }
+            while (!window.isEmpty()) write(window.poll(), writer);
+        } finally {
+            pool.shutdownNow();
+        }
+        double seconds = (System.nanoTime() - started) / 1e9;
+        logger.info("Bulk validation completed: {} records ({} invalid) in {}s ({} records/s) written to {}", records,
+                invalidRecords.sum(), String.format("%.1f", seconds),
+                String.format("%.0f", records / Math.max(seconds, 1e-9)), output);
+    }
+
+    private void write(Future<String> future, BufferedWriter writer) throws IOException, InterruptedException {
+        try {
+            writer.write(future.get());
+        } catch (ExecutionException e) {
+            throw new IOException("Bulk validation failed", e.getCause());
+        }
+    }
+
+    private String process(List<String> lines, boolean ndjson) {
+        StringBuilder out = new StringBuilder(lines.size() * 128);
+        for (String line : lines) {
+            String[] fields = ndjson ? parseJson(line) : parseCsv(line);
+            if (fields == null) {
+                invalidRecords.increment();
+                if (ndjson) {
+                    appendInvalidJson(out, line);
+                } else {
+                    appendInvalidCsv(out, line);
+                }
+                continue;
+            }
+            Optional<AccountDecision> decision = accountValidationService.decide(fields[0], fields[1], fields[2] != null);
+            if (ndjson) {
+                appendJson(out, fields, decision.orElse(null));
+            } else {
+                appendCsv(out, fields, decision.orElse(null));
+            }
+        }
+        return out.toString();
+    }
+
+    /**
+     * Splits an RFC 4180 record: quoted fields may contain commas and doubled quotes, blanks around fields
+     * are ignored. Quoted fields cannot span lines.
+     *
+     * @return identifier, codeValue and transactionId, or null if a quote is unterminated, followed by
+     *         anything but a comma, or appears inside an unquoted field
+     */
+    private static String[] parseCsv(String line) {
+        String[] fields = new String[3];
+        StringBuilder value = new StringBuilder();
+        int length = line.length();
+        int i = 0;
+        for (int column = 0; ; column++) {
+            value.setLength(0);
+            i = skipBlanks(line, i);
+            if (i < length && line.charAt(i) == '"') {
+                for (i++; ; i++) {
+                    if (i >= length) return null;
+                    char c = line.charAt(i);
+                    if (c != '"') {
+                        value.append(c);
+                    } else if (i + 1 < length && line.charAt(i + 1) == '"') {
+                        value.append('"');
+                        i++;
+                    } else {
+                        break;
+                    }
+                }
+                i = skipBlanks(line, i + 1);
+                if (i < length && line.charAt(i) != ',') return null;
+            } else {
+                int end = line.indexOf(',', i);
+                if (end < 0) end = length;
+                String raw = line.substring(i, end).trim();
+                if (raw.indexOf('"') >= 0) return null;
+                value.append(raw);
+                i = end;
+            }
+            if (column < fields.length && !value.isEmpty()) fields[column] = value.toString();
+            if (i >= length) return fields;
+            i++;
+        }
+    }
+
+    private static int skipBlanks(String line, int from) {
+        int i = from;
+        while (i < line.length() && line.charAt(i) <= ' ') i++;
+        return i;
+    }
+
+    /**
+     * @return identifier, codeValue and transactionId, or null if the line is not a JSON object
+     */
+    private String[] parseJson(String line) {
+        try {
+            JsonNode node = objectMapper.readTree(line);
+            if (node == null || !node.isObject()) return null;
+            return new String[] {text(node, "identifier"), text(node, "codeValue"), text(node, "transactionId")};
+        } catch (IOException e) {
+            logger.debug("Invalid NDJSON record: {}", e.getMessage());
+            return null;
+        }
+    }
+
+    private static String text(JsonNode node, String field) {
+        JsonNode value = node.get(field);
+        return value == null || value.isNull() || value.asText().isBlank() ? null : value.asText();
+    }
+
+    private void appendCsv(StringBuilder out, String[] fields, AccountDecision decision) {
+        out.append(csv(fields[0])).append(',').append(csv(fields[1])).append(',').append(csv(fields[2])).append(',');
+        if (decision == null) {
+            out.append(",NOT_FOUND,,,,,,\n");
+            return;
+        }
+        RuleOutcome outcome = decision.outcome();
+        out.append(csv(decision.ruleName())).append(',').append(outcome.action()).append(',')
+                .append(csv(outcome.status() != null ? outcome.status().getValue() : null)).append(',')
+                .append(csv(outcome.switching() != null ? outcome.switching().getValue() : null)).append(',')
+                .append(csv(outcome.modulus() != null ? outcome.modulus().getValue() : null)).append(',')
+                .append(csv(outcome.returnCode())).append(',')
+                .append(csv(outcome.systemReturnCode())).append(',')
+                .append(csv(outcome.description())).append('\n');
+    }
+
+    private static String csv(String value) {
+        if (value == null) return "";
+        if (value.indexOf(',') < 0 && value.indexOf('"') < 0) return value;
+        return "\"" + value.replace("\"", "\"\"") + "\"";
+    }
+
+    private void appendJson(StringBuilder out, String[] fields, AccountDecision decision) {
+        Map<String, Object> record = new LinkedHashMap<>();
+        record.put("identifier", fields[0]);
+        record.put("codeValue", fields[1]);
+        record.put("transactionId", fields[2]);
+        if (decision == null) {
+            record.put("action", "NOT_FOUND");
+        } else {
+            RuleOutcome outcome = decision.outcome();
+            record.put("rule", decision.ruleName());
+            record.put("action", outcome.action());
+            if (outcome.status() != null) record.put("accountStatus", outcome.status().getValue());
+            if (outcome.switching() != null) record.put("switchingStatus", outcome.switching().getValue());
+            if (outcome.modulus() != null) record.put("modulusCheckStatus", outcome.modulus().getValue());
+            if (outcome.returnCode() != null) record.put("returnCode", outcome.returnCode());
+            if (outcome.systemReturnCode() != null) record.put("systemReturnCode", outcome.systemReturnCode());
+            if (outcome.description() != null) record.put("description", outcome.description());
+        }
+        try {
+            out.append(objectMapper.writeValueAsString(record)).append('\n');
+        } catch (IOException e) {
+            throw new UncheckedIOException(e);
+        }
+    }
+
+    private static void appendInvalidCsv(StringBuilder out, String line) {
+        out.append(",,,,INVALID_RECORD,,,,,,").append(csv(line)).append('\n');
+    }
+
+    private void appendInvalidJson(StringBuilder out, String line) {
+        Map<String, Object> record = new LinkedHashMap<>();
+        record.put("action", "INVALID_RECORD");
+        record.put("record", line);
+        try {
+            out.append(objectMapper.writeValueAsString(record)).append('\n');
+        } catch (IOException e) {
+            throw new UncheckedIOException(e);
+        }
+    }
+
+    private static Path defaultOutput(Path input) {
+        String name = input.getFileName().toString();
+        int dot = name.lastIndexOf('.');
+        String results = dot < 0 ? name + ".results" : name.substring(0, dot) + ".results" + name.substring(dot);
+        return input.resolveSibling(results);
+    }
+}
+
+
+---------------------------------------
+
+package com.rbs.bdd.application.port.out;
+
+import java.util.List;
+import java.util.Map;
+
+/**
+ * Output port for scenario state shared between simulator instances: per-account counters and
+ * idempotent replay entries.
+ * <p>
+ * The only operation is a batched {@link #sync}: a node pushes the counter deltas and replay entries it
+ * collected since its last call and, in the same round trip, pulls everything other nodes changed after
+ * the sequence number it last saw, other than its own replay entries. Nodes serve reads from a near-cache
+ * between syncs, so no request waits on the store. Sequence numbers are only meaningful within one store
+ * epoch; a store that restarts with a new epoch has lost its state and numbers its changes from 0 again.
+ * </p>
+ */
+public interface SharedStateStore {
+
+    /**
+     * Applies a batch of updates and returns the state changed since {@code request.sinceSequence()}.
+     *
+     * @param request the batched updates
+     * @return current values of the changed counters, live changed replay entries and the new sequence
+     * @throws java.io.UncheckedIOException if the store cannot be reached; the caller keeps its batch
+     */
+    SyncResult sync(SyncRequest request);
+
+    /**
+     * A stored response available for replay on every node.
+     *
+     * @param key                 encoded {@code (systemId, transactionId)}
+     * @param requestDigest       digest of the request payload the response was rendered for
+     * @param response            the rendered response bytes
+     * @param expiresAtEpochMilli wall-clock expiry
+     */
+    record ReplayEntry(String key, byte[] requestDigest, byte[] response, long expiresAtEpochMilli) {
+    }
+
+    /**
+     * Updates collected by one node.
+     *
+     * @param nodeId        id of the sending node
+     * @param batchSequence increases with every new batch of the node; a resent batch keeps its sequence and
+     *                      is not applied again
+     * @param counterDeltas increments per counter key
+     * @param replayEntries new replay entries
+     * @param sinceSequence last sequence number this node has seen
+     */
+    record SyncRequest(String nodeId, long batchSequence, Map<String, Long> counterDeltas,
+                       List<ReplayEntry> replayEntries, long sinceSequence) {
+    }
+
+    /**
+     * State changed after the requested sequence.
+     *
+     * @param counters      current values of changed counters
+     * @param replayEntries changed replay entries of other nodes that have not expired
+     * @param sequence      sequence number to send with the next sync
+     * @param epoch         non-zero id of the store instance, changes when the store restarts
+     */
+    record SyncResult(Map<String, Long> counters, List<ReplayEntry> replayEntries, long sequence, long epoch) {
+    }
+}
+
+
+---------------------------------------
+
+package com.rbs.bdd.infrastructure.state;
+
+import com.rbs.bdd.application.port.out.SharedStateStore;
+
+import java.util.ArrayList;
+import java.util.HashMap;
+import java.util.Iterator;
+import java.util.LinkedHashMap;
+import java.util.List;
+import java.util.Map;
+import java.util.TreeMap;
+import java.util.concurrent.ThreadLocalRandom;
+import java.util.function.LongSupplier;
+
+/**
+ * Embedded {@link SharedStateStore} holding the shared state in memory.
+ * <p>
+ * Used directly for a single instance, and behind {@link SharedStateSidecar} when several instances share
+ * one store. Every change gets the next sequence number; a change log maps each key to its latest sequence,
+ * so a sync returns only the keys changed since the caller's sequence, leaving out replay entries the caller
+ * wrote itself. Expired replay entries are purged on every sync, and the oldest ones once {@code maxEntries}
+ * is reached; beyond {@code maxCounters} the least recently updated counters are dropped and count from 0
+ * again if updated later. The change log only holds keys still in the store, so it is bounded by both limits.
+ * A batch whose sequence is not above the last one applied for its node was already applied, and only pulls
+ * changes; the last 1024 nodes are remembered. Every store picks a random epoch, returned
+ * with each sync, so clients notice a restart. Syncs are serialised; each one is a single batch.
+ * </p>
+ */
+public final class InMemorySharedStateStore implements SharedStateStore {
+
+    public static final int DEFAULT_MAX_ENTRIES = 10_000;
+    public static final int DEFAULT_MAX_COUNTERS = 100_000;
+
+    private static final int MAX_NODES = 1024;
+    private static final String COUNTER_PREFIX = "c:";
+    private static final String REPLAY_PREFIX = "r:";
+
+    private final Map<String, Long> counters = new LinkedHashMap<>();
+    private final Map<String, StoredReplay> replayEntries = new LinkedHashMap<>();
+    private final TreeMap<Long, String> changeLog = new TreeMap<>();
+    private final Map<String, Long> latestChange = new HashMap<>();
+    private final Map<String, Long> appliedBatches = new LinkedHashMap<>(16, 0.75f, true) {
+        @Override
+        protected boolean removeEldestEntry(Map.Entry<String, Long> eldest) {
+            return size() > MAX_NODES;
+        }
+    };
+    private final long epoch = ThreadLocalRandom.current().nextLong(1, Long.MAX_VALUE);
+    private final int maxEntries;
+    private final int maxCounters;
+    private final LongSupplier clock;
+    private long sequence;
+
+    private record StoredReplay(ReplayEntry entry, String nodeId) {
+    }
+
+    /**
+     * Creates a store using the system wall clock for replay expiry.
+     *
+     * @param maxEntries  maximum number of replay entries
+     * @param maxCounters maximum number of counters
+     */
+    public InMemorySharedStateStore(int maxEntries, int maxCounters) {
+        this(maxEntries, maxCounters, System::currentTimeMillis);
+    }
+
+    /**
+     * @param maxEntries  maximum number of replay entries
+     * @param maxCounters maximum number of counters
+     * @param clock       wall clock in epoch milliseconds
+     */
+    public InMemorySharedStateStore(int maxEntries, int maxCounters, LongSupplier clock) {
+        this.maxEntries = maxEntries;
+        this.maxCounters = Math.max(1, maxCounters);
+        this.clock = clock;
+    }
+
+    @Override
+    public synchronized SyncResult sync(SyncRequest request) {
+        long now = clock.getAsLong();
+        Long applied = appliedBatches.get(request.nodeId());
+        if (applied == null || request.batchSequence() > applied) {
+            appliedBatches.put(request.nodeId(), request.batchSequence());
+            apply(request, now);
+        }
+        purgeExpired(now);
+
+        Map<String, Long> changedCounters = new HashMap<>();
+        List<ReplayEntry> changedReplays = new ArrayList<>();
+        for (String key : changeLog.tailMap(request.sinceSequence(), false).values()) {
+            if (key.startsWith(COUNTER_PREFIX)) {
+                String counter = key.substring(COUNTER_PREFIX.length());
+                changedCounters.put(counter, counters.get(counter));
+            } else {
+                StoredReplay replay = replayEntries.get(key.substring(REPLAY_PREFIX.length()));
+                if (!replay.nodeId().equals(request.nodeId())) changedReplays.add(replay.entry());
+            }
+        }
+        return new SyncResult(changedCounters, changedReplays, sequence, epoch);
+    }
+
+    private void apply(SyncRequest request, long now) {
+        request.counterDeltas().forEach((key, delta) -> {
+            Long value = counters.remove(key);
+            counters.put(key, value != null ? value + delta : delta);
+            changed(COUNTER_PREFIX + key);
+        });
+        Iterator<String> leastRecentlyUpdated = counters.keySet().iterator();
+        while (counters.size() > maxCounters) {
+            String key = leastRecentlyUpdated.next();
+            leastRecentlyUpdated.remove();
+            forget(COUNTER_PREFIX + key);
+        }
+        for (ReplayEntry entry : request.replayEntries()) {
+            if (entry.expiresAtEpochMilli() <= now) continue;
+            replayEntries.remove(entry.key());
+            replayEntries.put(entry.key(), new StoredReplay(entry, request.nodeId()));
+            changed(REPLAY_PREFIX + entry.key());
+        }
+        Iterator<StoredReplay> oldest = replayEntries.values().iterator();
+        while (replayEntries.size() > maxEntries) {
+            StoredReplay replay = oldest.next();
+            oldest.remove();
+            forget(REPLAY_PREFIX + replay.entry().key());
+        }
+    }
+
+    private void changed(String key) {
+        Long previous = latestChange.put(key, ++sequence);
+        if (previous != null) changeLog.remove(previous);
+        changeLog.put(sequence, key);
+    }
+
+    private void forget(String key) {
+        Long change = latestChange.remove(key);
+        if (change != null) changeLog.remove(change);
+    }
+
+    private void purgeExpired(long now) {
+        Iterator<StoredReplay> replays = replayEntries.values().iterator();
+        while (replays.hasNext()) {
+            ReplayEntry entry = replays.next().entry();
+            if (entry.expiresAtEpochMilli() > now) continue;
+            replays.remove();
+            forget(REPLAY_PREFIX + entry.key());
+        }
+    }
+}
+
+
+---------------------------------------
+
+package com.rbs.bdd.infrastructure.state;
+
+import com.rbs.bdd.application.port.out.SharedStateStore;
+
+import java.io.DataInputStream;
+import java.io.DataOutputStream;
+import java.io.IOException;
+import java.util.ArrayList;
+import java.util.HashMap;
+import java.util.List;
+import java.util.Map;
+
+/**
+ * Binary framing of {@link SharedStateStore.SyncRequest} and {@link SharedStateStore.SyncResult} between
+ * {@link SidecarSharedStateStore} and {@link SharedStateSidecar}: one request frame and one result frame
+ * per sync.
+ */
+final class SharedStateProtocol {
+
+    private SharedStateProtocol() {
+        // Prevent instantiation
+    }
+
+    static void writeRequest(DataOutputStream out, SharedStateStore.SyncRequest request) throws IOException {
+        out.writeUTF(request.nodeId());
+        out.writeLong(request.batchSequence());
+        writeCounters(out, request.counterDeltas());
+        writeReplayEntries(out, request.replayEntries());
+        out.writeLong(request.sinceSequence());
+        out.flush();
+    }
+
+    static SharedStateStore.SyncRequest readRequest(DataInputStream in) throws IOException {
+        return new SharedStateStore.SyncRequest(in.readUTF(), in.readLong(), readCounters(in), readReplayEntries(in),
+                in.readLong());
+    }
+
+    static void writeResult(DataOutputStream out, SharedStateStore.SyncResult result) throws IOException {
+        writeCounters(out, result.counters());
+        writeReplayEntries(out, result.replayEntries());
+        out.writeLong(result.sequence());
+        out.writeLong(result.epoch());
+        out.flush();
+    }
+
+    static SharedStateStore.SyncResult readResult(DataInputStream in) throws IOException {
+        return new SharedStateStore.SyncResult(readCounters(in), readReplayEntries(in), in.readLong(), in.readLong());
+    }
+
+    private static void writeCounters(DataOutputStream out, Map<String, Long> counters) throws IOException {
+        out.writeInt(counters.size());
+        for (Map.Entry<String, Long> counter : counters.entrySet()) {
+            out.writeUTF(counter.getKey());
+            out.writeLong(counter.getValue());
+        }
+    }
+
+    private static Map<String, Long> readCounters(DataInputStream in) throws IOException {
+        int size = in.readInt();
+        Map<String, Long> counters = new HashMap<>(Math.max(16, size * 2));
+        for (int i = 0; i < size; i++) {
+            counters.put(in.readUTF(), in.readLong());
+        }
+        return counters;
+    }
+
+    private static void writeReplayEntries(DataOutputStream out, List<SharedStateStore.ReplayEntry> entries)
+            throws IOException {
+        out.writeInt(entries.size());
+        for (SharedStateStore.ReplayEntry entry : entries) {
+            out.writeUTF(entry.key());
+            out.writeLong(entry.expiresAtEpochMilli());
+            out.writeInt(entry.requestDigest().length);
+            out.write(entry.requestDigest());
+            out.writeInt(entry.response().length);
+            out.write(entry.response());
+        }
+    }
+
+    private static List<SharedStateStore.ReplayEntry> readReplayEntries(DataInputStream in) throws IOException {
+        int size = in.readInt();
+        List<SharedStateStore.ReplayEntry> entries = new ArrayList<>(size);
+        for (int i = 0; i < size; i++) {
+            String key = in.readUTF();
+            long expiresAt = in.readLong();
+            byte[] requestDigest = new byte[in.readInt()];
+            in.readFully(requestDigest);
+            byte[] response = new byte[in.readInt()];
+            in.readFully(response);
+            entries.add(new SharedStateStore.ReplayEntry(key, requestDigest, response, expiresAt));
+        }
+        return entries;
+    }
+}
+
+
+---------------------------------------
+
+package com.rbs.bdd.infrastructure.state;
+
+import com.rbs.bdd.application.port.out.SharedStateStore;
+import org.slf4j.Logger;
+import org.slf4j.LoggerFactory;
+
+import java.io.BufferedInputStream;
+import java.io.BufferedOutputStream;
+import java.io.Closeable;
+import java.io.DataInputStream;
+import java.io.DataOutputStream;
+import java.io.EOFException;
+import java.io.IOException;
+import java.net.InetAddress;
+import java.net.InetSocketAddress;
+import java.net.ServerSocket;
+import java.net.Socket;
+import java.util.concurrent.ExecutorService;
+import java.util.concurrent.Executors;
+
+/**
+ * Serves an {@link InMemorySharedStateStore} over TCP so several simulator instances can share it.
+ * <p>
+ * Runs inside a simulator ({@code esp.simulator.shared-state.mode=sidecar}) or standalone:
+ * {@code java -cp esp-simulator.jar com.rbs.bdd.infrastructure.state.SharedStateSidecar 7400 [maxEntries
+ * [maxCounters [bindAddress]]]}. It binds the loopback interface unless a bind address is given; the protocol
+ * is not authenticated, so bind other interfaces only on a trusted network, for instances on other hosts
+ * using {@code mode=remote}. Each connection is served by its own thread and carries one request/result
+ * frame per sync.
+ * </p>
+ */
+public final class SharedStateSidecar implements Closeable {
+
+    private static final Logger logger = LoggerFactory.getLogger(SharedStateSidecar.class);
+
+    private final SharedStateStore store;
+    private final ServerSocket serverSocket;
+    private final ExecutorService connections = Executors.newCachedThreadPool(runnable -> {
+        Thread thread = new Thread(runnable, "shared-state-sidecar");
+        thread.setDaemon(true);
+        return thread;
+    });
+
+    /**
+     * Binds the sidecar to the loopback interface and starts accepting connections.
+     *
+     * @param store the store to serve
+     * @param port  the port, 0 for any free port
+     * @throws IOException if the port cannot be bound
+     */
+    public SharedStateSidecar(SharedStateStore store, int port) throws IOException {
+        this(store, InetAddress.getLoopbackAddress(), port);
+    }
+
+    /**
+     * Binds the sidecar and starts accepting connections.
+     *
+     * @param store       the store to serve
+     * @param bindAddress the interface to listen on, a wildcard address for all interfaces
+     * @param port        the port, 0 for any free port
+     * @throws IOException if the port cannot be bound
+     */
+    public SharedStateSidecar(SharedStateStore store, InetAddress bindAddress, int port) throws IOException {
+        this.store = store;
+        this.serverSocket = new ServerSocket(port, 50, bindAddress);
+        connections.execute(this::accept);
+        logger.info("Shared state sidecar listening on {}", serverSocket.getLocalSocketAddress());
+    }
+
+    public static void main(String[] args) throws IOException, InterruptedException {
+        int port = args.length > 0 ? Integer.parseInt(args[0]) : 7400;
+        int maxEntries = args.length > 1 ? Integer.parseInt(args[1]) : InMemorySharedStateStore.DEFAULT_MAX_ENTRIES;
+        int maxCounters = args.length > 2 ? Integer.parseInt(args[2]) : InMemorySharedStateStore.DEFAULT_MAX_COUNTERS;
+        InetAddress bindAddress = args.length > 3 ? InetAddress.getByName(args[3]) : InetAddress.getLoopbackAddress();
+        try (SharedStateSidecar sidecar = new SharedStateSidecar(
+                new InMemorySharedStateStore(maxEntries, maxCounters), bindAddress, port)) {
+            Thread.currentThread().join();
+        }
+    }
+
+    /**
+     * @return the bound port
+     */
+    public int port() {
+        return serverSocket.getLocalPort();
+    }
+
+    /**
+     * @return the address clients on this host connect to: the bound address, or loopback when bound to all
+     *         interfaces
+     */
+    public InetSocketAddress localAddress() {
+        InetAddress bound = serverSocket.getInetAddress();
+        return new InetSocketAddress(bound.isAnyLocalAddress() ? InetAddress.getLoopbackAddress() : bound, port());
+    }
+
+    @Override
+    public void close() throws IOException {
+        serverSocket.close();
+        connections.shutdownNow();
+    }
+
+    private void accept() {
+        while (!serverSocket.isClosed()) {
+            try {
+                Socket socket = serverSocket.accept();
+                connections.execute(() -> serve(socket));
+            } catch (IOException e) {
+                if (!serverSocket.isClosed()) logger.warn("Shared state sidecar accept failed: {}", e.getMessage());
+            }
+        }
+    }
+
+    private void serve(Socket socket) {
+        try (socket;
+             DataInputStream in = new DataInputStream(new BufferedInputStream(socket.getInputStream()));
+             DataOutputStream out = new DataOutputStream(new BufferedOutputStream(socket.getOutputStream()))) {
+            while (true) {
+                SharedStateProtocol.writeResult(out, store.sync(SharedStateProtocol.readRequest(in)));
+            }
+        } catch (EOFException e) {
+            logger.debug("Shared state client {} disconnected", socket.getRemoteSocketAddress());
+        } catch (IOException e) {
+            logger.warn("Shared state connection {} failed: {}", socket.getRemoteSocketAddress(), e.getMessage());
+        }
+    }
+}
+
+
+---------------------------------------
+
+package com.rbs.bdd.infrastructure.state;
+
+import com.rbs.bdd.application.port.out.SharedStateStore;
+
+import java.io.BufferedInputStream;
+import java.io.BufferedOutputStream;
+import java.io.Closeable;
+import java.io.DataInputStream;
+import java.io.DataOutputStream;
+import java.io.IOException;
+import java.io.UncheckedIOException;
+import java.net.InetSocketAddress;
+import java.net.Socket;
+import java.time.Duration;
+
+/**
+ * {@link SharedStateStore} client of a {@link SharedStateSidecar}. Keeps one connection, reconnecting
+ * after a failure; a failed sync throws so the caller can keep its batch for the next attempt.
+ */
+public final class SidecarSharedStateStore implements SharedStateStore, Closeable {
+
+    private final InetSocketAddress address;
+    private final int timeoutMillis;
+    private Socket socket;
+    private DataInputStream in;
+    private DataOutputStream out;
+
+    /**
+     * @param host    sidecar host
+     * @param port    sidecar port
+     * @param timeout connect and read timeout
+     */
+    public SidecarSharedStateStore(String host, int port, Duration timeout) {
+        this.address = new InetSocketAddress(host, port);
+        this.timeoutMillis = (int) timeout.toMillis();
+    }
+
+    @Override
+    public synchronized SyncResult sync(SyncRequest request) {
+        try {
+            connect();
+            SharedStateProtocol.writeRequest(out, request);
+            return SharedStateProtocol.readResult(in);
+        } catch (IOException e) {
+            disconnect();
+            throw new UncheckedIOException("Shared state sidecar " + address + " unavailable", e);
+        }
+    }
+
+    @Override
+    public synchronized void close() {
+        disconnect();
+    }
+
+    private void connect() throws IOException {
+        if (socket != null) return;
+        Socket connection = new Socket();
+        try {
+            connection.connect(address, timeoutMillis);
+            connection.setSoTimeout(timeoutMillis);
+            connection.setTcpNoDelay(true);
+            in = new DataInputStream(new BufferedInputStream(connection.getInputStream()));
+            out = new DataOutputStream(new BufferedOutputStream(connection.getOutputStream()));
+            socket = connection;
+        } catch (IOException e) {
+            connection.close();
+            throw e;
+        }
+    }
+
+    private void disconnect() {
+        if (socket == null) return;
+        try {
+            socket.close();
+        } catch (IOException ignored) {
+            // Connection is being discarded
+        }
+        socket = null;
+        in = null;
+        out = null;
+    }
+}
+
+
+---------------------------------------
+
+package com.rbs.bdd.application.state;
+
+import com.rbs.bdd.application.port.out.SharedStateStore;
+import org.slf4j.Logger;
+import org.slf4j.LoggerFactory;
+
+import java.util.ArrayList;
+import java.util.Collections;
+import java.util.HashMap;
+import java.util.LinkedHashMap;
+import java.util.List;
+import java.util.Map;
+import java.util.UUID;
+import java.util.concurrent.ArrayBlockingQueue;
+import java.util.concurrent.BlockingQueue;
+import java.util.concurrent.ConcurrentHashMap;
+import java.util.concurrent.atomic.LongAdder;
+import java.util.function.Consumer;
+
+/**
+ * Near-cache and write-behind batching in front of a {@link SharedStateStore}.
+ * <p>
+ * Request threads only touch local maps: account increments are merged into pending deltas, new replay
+ * entries are queued, and reads combine the last synced value with the local pending delta. A scheduler
+ * calls {@link #flush()}, which sends the whole batch and pulls the other nodes' changes in one round trip.
+ * Cross-node state therefore lags by at most one flush interval, and no request waits on the store. The
+ * near-cache keeps the {@code maxCounters} most recently used synced counters; an evicted counter reads as
+ * this node's pending count until it changes again.
+ * </p>
+ * <p>
+ * Every batch carries this node's id and a batch sequence. If a sync fails the batch is kept and resent
+ * unchanged, apart from replay entries that expired meanwhile, before any newer updates; the store skips a
+ * batch it already applied, so a sync that timed out after the store applied it is not counted twice. The
+ * replay queue is bounded, dropping the oldest entries while the store is unreachable, and no exception
+ * escapes a flush, so the scheduled sync keeps running. When the store answers with a different epoch it has
+ * restarted and lost its state: the synced counters are cleared and the next flush pulls from sequence 0.
+ * </p>
+ */
+public final class SharedScenarioState {
+
+    private static final Logger logger = LoggerFactory.getLogger(SharedScenarioState.class);
+
+    private final SharedStateStore store;
+    private final String nodeId = UUID.randomUUID().toString();
+    private final Map<String, Long> pendingDeltas = new ConcurrentHashMap<>();
+    private final BlockingQueue<SharedStateStore.ReplayEntry> pendingReplays;
+    private final Map<String, Long> syncedCounters;
+    private final LongAdder syncs = new LongAdder();
+    private final LongAdder failures = new LongAdder();
+    private final LongAdder dropped = new LongAdder();
+    private volatile Consumer<SharedStateStore.ReplayEntry> replayListener = entry -> { };
+    private volatile Batch unacknowledged;
+    private long batchSequence;
+    private long sequence;
+    private long epoch;
+
+    private record Batch(long sequence, Map<String, Long> deltas, List<SharedStateStore.ReplayEntry> replays) {
+    }
+
+    /**
+     * @param store             the shared state backend
+     * @param maxPendingReplays maximum number of replay entries waiting for a sync
+     * @param maxCounters       maximum number of synced counters kept in the near-cache
+     */
+    public SharedScenarioState(SharedStateStore store, int maxPendingReplays, int maxCounters) {
+        this.store = store;
+        this.pendingReplays = new ArrayBlockingQueue<>(Math.max(1, maxPendingReplays));
+        this.syncedCounters = Collections.synchronizedMap(new LinkedHashMap<>(16, 0.75f, true) {
+            @Override
+            protected boolean removeEldestEntry(Map.Entry<String, Long> eldest) {
+                return size() > maxCounters;
+            }
+        });
+    }
+
+    /**
+     * Counts one validation of {@code account}; shared with other nodes on the next flush.
+     *
+     * @param account the account identifier
+     */
+    public void incrementAccount(String account) {
+        pendingDeltas.merge(account, 1L, Long::sum);
+    }
+
+    /**
+     * @param account the account identifier
+     * @return validations of {@code account} across all nodes, as of the last flush plus this node's pending ones
+     */
+    public long accountCount(String account) {
+        Batch batch = unacknowledged;
+        long unsent = batch != null ? batch.deltas().getOrDefault(account, 0L) : 0L;
+        return syncedCounters.getOrDefault(account, 0L) + unsent + pendingDeltas.getOrDefault(account, 0L);
+    }
+
+    /**
+     * Queues a replay entry for the other nodes, dropping the oldest queued one when the queue is full.
+     *
+     * @param key                 encoded replay key
+     * @param requestDigest       digest of the request payload
+     * @param response            the rendered response
+     * @param expiresAtEpochMilli wall-clock expiry
+     */
+    public void replicate(String key, byte[] requestDigest, byte[] response, long expiresAtEpochMilli) {
+        SharedStateStore.ReplayEntry entry =
+                new SharedStateStore.ReplayEntry(key, requestDigest, response, expiresAtEpochMilli);
+        while (!pendingReplays.offer(entry)) {
+            if (pendingReplays.poll() != null) dropped.increment();
+        }
+    }
+
+    /**
+     * @param listener receives replay entries written by other nodes
+     */
+    public void setReplayListener(Consumer<SharedStateStore.ReplayEntry> listener) {
+        this.replayListener = listener;
+    }
+
+    /**
+     * Resends the unacknowledged batch, if any, then pushes pending updates and pulls changes from the
+     * other nodes in a single sync. Failures are counted and logged, never thrown.
+     */
+    public synchronized void flush() {
+        try {
+            long now = System.currentTimeMillis();
+            if (unacknowledged != null) {
+                unacknowledged.replays().removeIf(entry -> entry.expiresAtEpochMilli() <= now);
+                if (!send(unacknowledged)) return;
+            }
+            send(nextBatch(now));
+        } catch (RuntimeException e) {
+            failures.increment();
+            logger.warn("Shared state flush failed: {}", e.toString());
+        }
+    }
+
+    private Batch nextBatch(long now) {
+        Map<String, Long> deltas = new HashMap<>();
+        for (String account : pendingDeltas.keySet()) {
+            Long delta = pendingDeltas.remove(account);
+            if (delta != null) deltas.put(account, delta);
+        }
+        List<SharedStateStore.ReplayEntry> replays = new ArrayList<>();
+        SharedStateStore.ReplayEntry entry;
+        while ((entry = pendingReplays.poll()) != null) {
+            if (entry.expiresAtEpochMilli() > now) replays.add(entry);
+        }
+        return new Batch(++batchSequence, deltas, replays);
+    }
+
+    /**
+     * Syncs {@code batch}; on failure keeps it as the unacknowledged batch.
+     *
+     * @return true if the store acknowledged the batch
+     */
+    private boolean send(Batch batch) {
+        unacknowledged = batch;
+        SharedStateStore.SyncResult result;
+        try {
+            result = store.sync(new SharedStateStore.SyncRequest(nodeId, batch.sequence(), batch.deltas(),
+                    batch.replays(), sequence));
+        } catch (RuntimeException e) {
+            failures.increment();
+            logger.warn("Shared state sync failed, batch {} with {} counters and {} replay entries kept: {}",
+                    batch.sequence(), batch.deltas().size(), batch.replays().size(), e.getMessage());
+            return false;
+        }
+        unacknowledged = null;
+        if (result.epoch() != epoch && sequence > 0) {
+            logger.info("Shared state store restarted (epoch {}), resynchronising from sequence 0", result.epoch());
+            syncedCounters.clear();
+            sequence = 0;
+        } else {
+            sequence = result.sequence();
+        }
+        epoch = result.epoch();
+        syncedCounters.putAll(result.counters());
+        syncs.increment();
+        result.replayEntries().forEach(replayListener);
+        return true;
+    }
+
+    public long syncs() {
+        return syncs.sum();
+    }
+
+    public long failures() {
+        return failures.sum();
+    }
+
+    public long dropped() {
+        return dropped.sum();
+    }
+
+    public int pending() {
+        Batch batch = unacknowledged;
+        int unsent = batch != null ? batch.deltas().size() + batch.replays().size() : 0;
+        return unsent + pendingDeltas.size() + pendingReplays.size();
+    }
+
+    public synchronized long sequence() {
+        return sequence;
+    }
+}
+
+
+---------------------------------------
+
+package com.rbs.bdd.infrastructure.config;
+
+import com.rbs.bdd.application.idempotency.ReplayCache;
+import com.rbs.bdd.application.port.out.SharedStateStore;
+import com.rbs.bdd.application.state.SharedScenarioState;
+import com.rbs.bdd.infrastructure.state.InMemorySharedStateStore;
+import com.rbs.bdd.infrastructure.state.SharedStateSidecar;
+import com.rbs.bdd.infrastructure.state.SidecarSharedStateStore;
+import io.micrometer.core.instrument.FunctionCounter;
+import io.micrometer.core.instrument.Gauge;
+import io.micrometer.core.instrument.MeterRegistry;
+import org.slf4j.Logger;
+import org.slf4j.LoggerFactory;
+import org.springframework.beans.factory.annotation.Value;
+import org.springframework.context.annotation.Bean;
+import org.springframework.context.annotation.Configuration;
+
+import java.io.IOException;
+import java.io.UncheckedIOException;
+import java.net.InetAddress;
+import java.time.Duration;
+import java.util.concurrent.Executors;
+import java.util.concurrent.ScheduledExecutorService;
+import java.util.concurrent.TimeUnit;
+
+/**
+ * Selects the {@link SharedStateStore} backend and wires the {@link SharedScenarioState} near-cache.
+ * <p>
+ * {@code esp.simulator.shared-state.mode} is {@code local} (in-process store, a single instance),
+ * {@code sidecar} (this instance also serves its store on {@code port} for the others) or {@code remote}
+ * (use the sidecar at {@code host:port}). In the other modes replay entries are replicated through the shared
+ * state into every node's {@link ReplayCache}; the store keeps at most
+ * {@code esp.simulator.idempotency.max-entries} of them, and the store and every near-cache at most
+ * {@code max-counters} account counters. The sidecar listens on {@code bind-address}, loopback by default.
+ * Publishes {@code esp.shared-state.syncs},
+ * {@code esp.shared-state.failures}, {@code esp.shared-state.dropped}, {@code esp.shared-state.pending} and
+ * {@code esp.shared-state.sequence}.
+ * </p>
+ */
+@Configuration
+public class SharedStateConfig {
+
+    private static final Logger logger = LoggerFactory.getLogger(SharedStateConfig.class);
+
+    /**
+     * Starts the embedded sidecar in {@code sidecar} mode; in other modes no server is started.
+     *
+     * @param mode        the shared state mode
+     * @param bindAddress the interface the sidecar listens on, {@code 0.0.0.0} for all
+     * @param port        the sidecar port
+     * @param maxEntries  maximum number of replay entries in the store
+     * @param maxCounters maximum number of counters in the store
+     * @return holder of the running sidecar, empty in other modes
+     */
+    @Bean(destroyMethod = "close")
+    public SharedStateSidecarHolder sharedStateSidecar(
+            @Value("${esp.simulator.shared-state.mode:local}") String mode,
+            @Value("${esp.simulator.shared-state.bind-address:127.0.0.1}") String bindAddress,
+            @Value("${esp.simulator.shared-state.port:7400}") int port,
+            @Value("${esp.simulator.idempotency.max-entries:10000}") int maxEntries,
+            @Value("${esp.simulator.shared-state.max-counters:100000}") int maxCounters) {
+        if (!"sidecar".equalsIgnoreCase(mode)) return new SharedStateSidecarHolder(null);
+        try {
+            return new SharedStateSidecarHolder(new SharedStateSidecar(
+                    new InMemorySharedStateStore(maxEntries, maxCounters), InetAddress.getByName(bindAddress), port));
+        } catch (IOException e) {
+            throw new UncheckedIOException("Failed to start shared state sidecar on " + bindAddress + ":" + port, e);
+        }
+    }
+
+    /**
+     * @param sidecar the embedded sidecar, if any
+     * @param mode    {@code local}, {@code sidecar} or {@code remote}
+     * @param host    sidecar host in {@code remote} mode
+     * @param port    sidecar port
+     * @param timeout     connect and read timeout
+     * @param maxEntries  maximum number of replay entries in the local store
+     * @param maxCounters maximum number of counters in the local store
+     * @return the shared state backend
+     */
+    @Bean
+    public SharedStateStore sharedStateStore(SharedStateSidecarHolder sidecar,
+            @Value("${esp.simulator.shared-state.mode:local}") String mode,
+            @Value("${esp.simulator.shared-state.host:localhost}") String host,
+            @Value("${esp.simulator.shared-state.port:7400}") int port,
+            @Value("${esp.simulator.shared-state.timeout:1s}") Duration timeout,
+            @Value("${esp.simulator.idempotency.max-entries:10000}") int maxEntries,
+            @Value("${esp.simulator.shared-state.max-counters:100000}") int maxCounters) {
+        SharedStateStore store = switch (mode.toLowerCase()) {
+            case "local" -> new InMemorySharedStateStore(maxEntries, maxCounters);
+            case "sidecar" -> new SidecarSharedStateStore(sidecar.sidecar().localAddress().getHostString(),
+                    sidecar.sidecar().port(), timeout);
+            case "remote" -> new SidecarSharedStateStore(host, port, timeout);
+            default -> throw new IllegalArgumentException("Unknown esp.simulator.shared-state.mode: " + mode);
+        };
+        logger.info("Shared scenario state mode {}", mode);
+        return store;
+    }
+
+    /**
+     * Creates the near-cache and, unless the store is local to this single instance, connects it with the
+     * replay cache in both directions.
+     *
+     * @param store       the shared state backend
+     * @param replayCache the local replay cache
+     * @param registry    the metrics registry
+     * @param mode        the shared state mode
+     * @param maxEntries  maximum number of replay entries waiting for a sync
+     * @param maxCounters maximum number of synced counters in the near-cache
+     * @return the shared scenario state
+     */
+    @Bean
+    public SharedScenarioState sharedScenarioState(SharedStateStore store, ReplayCache replayCache,
+            MeterRegistry registry,
+            @Value("${esp.simulator.shared-state.mode:local}") String mode,
+            @Value("${esp.simulator.idempotency.max-entries:10000}") int maxEntries,
+            @Value("${esp.simulator.shared-state.max-counters:100000}") int maxCounters) {
+        SharedScenarioState state = new SharedScenarioState(store, maxEntries, maxCounters);
+        if (!"local".equalsIgnoreCase(mode)) {
+            replayCache.setReplicationListener((key, requestDigest, response, ttlNanos) -> state.replicate(
+                    key.encoded(), requestDigest, response, System.currentTimeMillis() + ttlNanos / 1_000_000));
+            state.setReplayListener(entry -> {
+                long remainingMillis = entry.expiresAtEpochMilli() - System.currentTimeMillis();
+                if (remainingMillis > 0) {
+                    replayCache.putReplicated(ReplayCache.Key.decode(entry.key()), entry.requestDigest(),
+                            entry.response(), TimeUnit.MILLISECONDS.toNanos(remainingMillis));
+                }
+            });
+        }
+        FunctionCounter.builder("esp.shared-state.syncs", state, SharedScenarioState::syncs).register(registry);
+        FunctionCounter.builder("esp.shared-state.failures", state, SharedScenarioState::failures).register(registry);
+        FunctionCounter.builder("esp.shared-state.dropped", state, SharedScenarioState::dropped).register(registry);
+        Gauge.builder("esp.shared-state.pending", state, SharedScenarioState::pending).register(registry);
+        Gauge.builder("esp.shared-state.sequence", state, SharedScenarioState::sequence).register(registry);
+        return state;
+    }
+
+    /**
+     * Flushes the near-cache on a fixed interval.
+     *
+     * @param state         the shared scenario state
+     * @param flushInterval time between syncs, the cross-node staleness bound
+     * @return the scheduler, shut down with the context
+     */
+    @Bean(destroyMethod = "shutdownNow")
+    public ScheduledExecutorService sharedStateFlushScheduler(SharedScenarioState state,
+            @Value("${esp.simulator.shared-state.flush-interval:100ms}") Duration flushInterval) {
+        ScheduledExecutorService scheduler = Executors.newSingleThreadScheduledExecutor(runnable -> {
+            Thread thread = new Thread(runnable, "shared-state-flush");
+            thread.setDaemon(true);
+            return thread;
+        });
+        long period = Math.max(1, flushInterval.toMillis());
+        scheduler.scheduleWithFixedDelay(state::flush, period, period, TimeUnit.MILLISECONDS);
+        return scheduler;
+    }
+
+    /**
+     * Holder so the optional embedded sidecar can be a bean and be closed with the context.
+     *
+     * @param sidecar the running sidecar, or null
+     */
+    public record SharedStateSidecarHolder(SharedStateSidecar sidecar) implements AutoCloseable {
+        @Override
+        public void close() throws IOException {
+            if (sidecar != null) sidecar.close();
+        }
+    }
+}
+
+
+---------------------------------------
+
+package com.rbs.bdd.infrastructure.state;
+
+import com.rbs.bdd.application.state.SharedScenarioState;
+import org.springframework.web.bind.annotation.GetMapping;
+import org.springframework.web.bind.annotation.PathVariable;
+import org.springframework.web.bind.annotation.RequestMapping;
+import org.springframework.web.bind.annotation.RestController;
+
+import java.util.Map;
+
+/**
+ * Read access to the shared scenario state: {@code GET /admin/state/accounts/{identifier}} returns the
+ * validations counted for an account across all nodes.
+ */
+@RestController
+@RequestMapping("/admin/state")
+public class SharedStateAdminController {
+
+    private final SharedScenarioState sharedScenarioState;
+
+    /**
+     * @param sharedScenarioState the shared scenario state
+     */
+    public SharedStateAdminController(SharedScenarioState sharedScenarioState) {
+        this.sharedScenarioState = sharedScenarioState;
+    }
+
+    /**
+     * @param identifier the account identifier
+     * @return the account and its validation count
+     */
+    @GetMapping("/accounts/{identifier}")
+    public Map<String, Object> account(@PathVariable String identifier) {
+        return Map.of("identifier", identifier, "validations", sharedScenarioState.accountCount(identifier),
+                "sequence", sharedScenarioState.sequence());
+    }
+}
+
+
+---------------------------------------
+
+package com.rbs.bdd.common;
+
+import com.rbs.bdd.application.exception.XmlParsingException;
+import org.w3c.dom.Document;
+import org.xml.sax.SAXException;
+
+import javax.xml.XMLConstants;
+import javax.xml.parsers.DocumentBuilder;
+import javax.xml.parsers.DocumentBuilderFactory;
+import javax.xml.parsers.ParserConfigurationException;
+import javax.xml.transform.Transformer;
+import javax.xml.transform.TransformerConfigurationException;
+import javax.xml.transform.TransformerFactory;
+import javax.xml.xpath.XPath;
+import javax.xml.xpath.XPathFactory;
+import javax.xml.xpath.XPathFactoryConfigurationException;
+import java.io.ByteArrayInputStream;
+import java.io.IOException;
+import java.io.InputStream;
+
+/**
+ * Shared XML tooling with one XXE-hardened feature set for the whole simulator.
+ * <p>
+ * The JAXP factories are looked up and configured once. {@link DocumentBuilder}, {@link Transformer}
+ * and {@link XPath} are not thread-safe, so each thread keeps its own instances, reset before every
+ * hand-out. Parsing is namespace aware, rejects DOCTYPE declarations and never resolves external
+ * entities, DTDs, stylesheets or XIncludes. Instances must not be kept beyond the current call.
+ * </p>
+ */
+public final class SecureXml {
+
+    private static final DocumentBuilderFactory DOCUMENT_BUILDER_FACTORY = createDocumentBuilderFactory();
+    private static final TransformerFactory TRANSFORMER_FACTORY = createTransformerFactory();
+    private static final XPathFactory XPATH_FACTORY = createXPathFactory();
+
+    private static final ThreadLocal<DocumentBuilder> DOCUMENT_BUILDER = ThreadLocal.withInitial(SecureXml::newDocumentBuilder);
+    private static final ThreadLocal<Transformer> TRANSFORMER = ThreadLocal.withInitial(SecureXml::newTransformer);
+    private static final ThreadLocal<XPath> XPATH = ThreadLocal.withInitial(SecureXml::newXPath);
+
+    private SecureXml() {
+        // Prevent instantiation
+    }
+
+    /**
+     * @return this thread's document builder, reset
+     */
+    public static DocumentBuilder documentBuilder() {
+        DocumentBuilder builder = DOCUMENT_BUILDER.get();
+        builder.reset();
+        return builder;
+    }
+
+    /**
+     * @return this thread's identity transformer, reset
+     */
+    public static Transformer transformer() {
+        Transformer transformer = TRANSFORMER.get();
+        transformer.reset();
+        return transformer;
+    }
+
+    /**
+     * @return this thread's XPath evaluator, reset
+     */
+    public static XPath xpath() {
+        XPath xpath = XPATH.get();
+        xpath.reset();
+        return xpath;
+    }
+
+    /**
+     * @param xml the document
+     * @return the parsed document
+     * @throws IOException  if the stream cannot be read
+     * @throws SAXException if the document is not well-formed or declares a DOCTYPE
+     */
+    public static Document parse(InputStream xml) throws IOException, SAXException {
+        return documentBuilder().parse(xml);
+    }
+
+    /**
+     * @param xml the document bytes
+     * @return the parsed document
+     * @throws IOException  if the bytes cannot be read
+     * @throws SAXException if the document is not well-formed or declares a DOCTYPE
+     */
+    public static Document parse(byte[] xml) throws IOException, SAXException {
+        return parse(new ByteArrayInputStream(xml));
+    }
+
+    private static DocumentBuilderFactory createDocumentBuilderFactory() {
+        try {
+            DocumentBuilderFactory factory = DocumentBuilderFactory.newInstance();
+            factory.setNamespaceAware(true);
+            factory.setFeature(XMLConstants.FEATURE_SECURE_PROCESSING, true);
+            factory.setFeature("http://apache.org/xml/features/disallow-doctype-decl", true);
+            factory.setFeature("http://xml.org/sax/features/external-general-entities", false);
+            factory.setFeature("http://xml.org/sax/features/external-parameter-entities", false);
+            factory.setFeature("http://apache.org/xml/features/nonvalidating/load-external-dtd", false);
+            factory.setAttribute(XMLConstants.ACCESS_EXTERNAL_DTD, "");
+            factory.setAttribute(XMLConstants.ACCESS_EXTERNAL_SCHEMA, "");
+            factory.setXIncludeAware(false);
+            factory.setExpandEntityReferences(false);
+            return factory;
+        } catch (ParserConfigurationException e) {
+            throw new XmlParsingException("Failed to configure secure DocumentBuilderFactory", e);
+        }
+    }
+
+    private static TransformerFactory createTransformerFactory() {
+        try {
+            TransformerFactory factory = TransformerFactory.newInstance();
+            factory.setFeature(XMLConstants.FEATURE_SECURE_PROCESSING, true);
+            factory.setAttribute(XMLConstants.ACCESS_EXTERNAL_DTD, "");
+            factory.setAttribute(XMLConstants.ACCESS_EXTERNAL_STYLESHEET, "");
+            return factory;
+        } catch (TransformerConfigurationException e) {
+            throw new XmlParsingException("Failed to configure secure TransformerFactory", e);
+        }
+    }
+
+    private static XPathFactory createXPathFactory() {
+        try {
+            XPathFactory factory = XPathFactory.newInstance();
+            factory.setFeature(XMLConstants.FEATURE_SECURE_PROCESSING, true);
+            return factory;
+        } catch (XPathFactoryConfigurationException e) {
+            throw new XmlParsingException("Failed to configure secure XPathFactory", e);
+        }
+    }
+
+    private static DocumentBuilder newDocumentBuilder() {
+        synchronized (DOCUMENT_BUILDER_FACTORY) {
+            try {
+                return DOCUMENT_BUILDER_FACTORY.newDocumentBuilder();
+            } catch (ParserConfigurationException e) {
+                throw new XmlParsingException("Failed to create DocumentBuilder", e);
+            }
+        }
+    }
+
+    private static Transformer newTransformer() {
+        synchronized (TRANSFORMER_FACTORY) {
+            try {
+                return TRANSFORMER_FACTORY.newTransformer();
+            } catch (TransformerConfigurationException e) {
+                throw new XmlParsingException("Failed to create Transformer", e);
+            }
+        }
+    }
+
+    private static XPath newXPath() {
+        synchronized (XPATH_FACTORY) {
+            return XPATH_FACTORY.newXPath();
+        }
+    }
+}
+
+
+---------------------------------------
+
+package com.rbs.bdd.domain.modulus;
+
+import com.rbs.bdd.common.ServiceConstants;
+import com.rbs.bdd.domain.enums.ModulusCheckStatus;
+import org.junit.jupiter.api.Test;
+
+import java.util.List;
+
+import static org.junit.jupiter.api.Assertions.assertEquals;
+import static org.junit.jupiter.api.Assertions.assertFalse;
+import static org.junit.jupiter.api.Assertions.assertThrows;
+import static org.junit.jupiter.api.Assertions.assertTrue;
+
+/**
+ * Unit tests for {@link ModulusCheckEngine}, using the worked examples of the VocaLink specification
+ * and the ISO 13616 sample IBAN.
+ */
+class ModulusCheckEngineTest {
+
+    private static final ModulusCheckEngine ENGINE = ModulusCheckEngine.parse(List.of(
+            "# sortFrom sortTo method w1..w14",
+            "089000 089999 MOD10 0 0 0 0 0 0 7 1 3 7 1 3 7 1",
+            "107999 107999 MOD11 0 0 0 0 0 0 8 7 6 5 4 3 2 1",
+            "",
+            "202959 202959 DBLAL 2 1 2 1 2 1 2 1 2 1 2 1 2 1"));
+
+    @Test
+    void acceptsValidIbanChecksum() {
+        assertTrue(ModulusCheckEngine.isValidIban("GB82WEST12345698765432"));
+    }
+
+    @Test
+    void rejectsIbanWithWrongCheckDigits() {
+        assertFalse(ModulusCheckEngine.isValidIban("GB00WEST12345698765432"));
+        assertFalse(ModulusCheckEngine.isValidIban("GB82WEST12345698765433"));
+    }
+
+    @Test
+    void rejectsIbanWithInvalidCharactersOrLength() {
+        assertFalse(ModulusCheckEngine.isValidIban("gb82west12345698765432"));
+        assertFalse(ModulusCheckEngine.isValidIban("GB82WEST"));
+        assertFalse(ModulusCheckEngine.isValidIban(null));
+    }
+
+    @Test
+    void computesIbanCheckDigits() {
+        assertEquals(82, ModulusCheckEngine.ibanCheckDigits("GB", "WEST12345698765432"));
+        assertEquals(70, ModulusCheckEngine.ibanCheckDigits("GB", "NWBK08999966374958"));
+    }
+
+    @Test
+    void rejectsCheckDigitsForInvalidBban() {
+        assertThrows(IllegalArgumentException.class, () -> ModulusCheckEngine.ibanCheckDigits("GB", "WEST-1"));
+    }
+
+    @Test
+    void appliesMod10Weights() {
+        assertTrue(ENGINE.isValidUkAccount("08999966374958", 0));
+        assertFalse(ENGINE.isValidUkAccount("08999966374959", 0));
+    }
+
+    @Test
+    void appliesMod11Weights() {
+        assertTrue(ENGINE.isValidUkAccount("10799988837491", 0));
+        assertFalse(ENGINE.isValidUkAccount("10799988837492", 0));
+    }
+
+    @Test
+    void appliesDoubleAlternateWeights() {
+        assertTrue(ENGINE.isValidUkAccount("20295963748472", 0));
+        assertFalse(ENGINE.isValidUkAccount("20295963748473", 0));
+    }
+
+    @Test
+    void passesSortCodesWithoutWeightRow() {
+        assertTrue(ENGINE.isValidUkAccount("30963412345678", 0));
+        assertFalse(ENGINE.isValidUkAccount("3096341234567X", 0));
+    }
+
+    @Test
+    void checksGbIbanAgainstBothChecksumAndWeights() {
+        assertEquals(ModulusCheckStatus.PASS,
+                ENGINE.check("GB70NWBK08999966374958", ServiceConstants.INTL_BANK_ACCOUNT));
+        int digits = ModulusCheckEngine.ibanCheckDigits("GB", "NWBK08999966374959");
+        String weightFailure = String.format("GB%02dNWBK08999966374959", digits);
+        assertTrue(ModulusCheckEngine.isValidIban(weightFailure));
+        assertEquals(ModulusCheckStatus.FAILED, ENGINE.check(weightFailure, ServiceConstants.INTL_BANK_ACCOUNT));
+    }
+
+    @Test
+    void checksUkBasicBankAccountNumbers() {
+        assertEquals(ModulusCheckStatus.PASS, ENGINE.check("08999966374958", ServiceConstants.UK_BASIC_BANK_ACCOUNT));
+        assertEquals(ModulusCheckStatus.FAILED, ENGINE.check("0899996637495", ServiceConstants.UK_BASIC_BANK_ACCOUNT));
+    }
+
+    @Test
+    void rejectsMalformedWeightRows() {
+        assertThrows(IllegalArgumentException.class, () -> ModulusCheckEngine.parse(List.of("089000 089999 MOD10 1 2 3")));
+        assertThrows(IllegalArgumentException.class,
+                () -> ModulusCheckEngine.parse(List.of("089000 089999 MOD12 0 0 0 0 0 0 7 1 3 7 1 3 7 1")));
+    }
+}
+
+
+---------------------------------------
+
+package com.rbs.bdd.domain.rules;
+
+import com.rbs.bdd.common.ServiceConstants;
+import com.rbs.bdd.domain.modulus.ModulusCheckEngine;
+
+import java.util.Arrays;
+import java.util.LinkedHashMap;
+import java.util.Map;
+import java.util.concurrent.atomic.LongAdder;
+
+/**
+ * Sorted primitive index of generated GB accounts, consulted before the {@link CompiledRuleSet} trie.
+ * <p>
+ * Each account is one {@code long}: the 14 sort code and account number digits in the high bits, then
+ * the dictionary ids of the IBAN bank code and of the outcome, so millions of accounts cost 8 bytes each
+ * and are looked up by binary search without allocating. A GB IBAN matches when its digits and bank code
+ * are listed and its check digits are valid; the 14-digit UK basic bank account form always matches,
+ * like an {@code ukAlias} rule.
+ * </p>
+ */
+public final class AccountIndex {
+
+    /**
+     * Rule name reported for accounts answered from the index.
+     */
+    public static final String RULE_NAME = "accountDataset";
+
+    private static final int GB_IBAN_LENGTH = 22;
+    private static final int GB_IBAN_BANK_OFFSET = 4;
+    private static final int GB_IBAN_DIGITS_OFFSET = 8;
+    private static final int DIGITS = 14;
+    private static final int ID_BITS = 8;
+    private static final int MAX_IDS = 1 << ID_BITS;
+    private static final long ID_MASK = MAX_IDS - 1;
+
+    private final long[] entries;
+    private final String[] bankCodes;
+    private final RuleOutcome[] outcomes;
+    private final LongAdder hits = new LongAdder();
+
+    private AccountIndex(long[] entries, String[] bankCodes, RuleOutcome[] outcomes) {
+        this.entries = entries;
+        this.bankCodes = bankCodes;
+        this.outcomes = outcomes;
+    }
+
+    /**
+     * @return an index without accounts
+     */
+    public static AccountIndex empty() {
+        return builder().build();
+    }
+
+    /**
+     * @return a builder collecting accounts
+     */
+    public static Builder builder() {
+        return new Builder();
+    }
+
+    /**
+     * Looks an identifier up by its sort code and account number digits.
+     *
+     * @param identifier the request identifier, may be null
+     * @param codeValue  the request codeValue
+     * @return the outcome of the account, or null if it is not listed
+     */
+    public RuleOutcome find(CharSequence identifier, String codeValue) {
+        if (identifier == null || entries.length == 0) return null;
+        int offset;
+        if (ServiceConstants.INTL_BANK_ACCOUNT.equals(codeValue) && identifier.length() == GB_IBAN_LENGTH
+                && identifier.charAt(0) == 'G' && identifier.charAt(1) == 'B') {
+            offset = GB_IBAN_DIGITS_OFFSET;
+        } else if (ServiceConstants.UK_BASIC_BANK_ACCOUNT.equals(codeValue) && identifier.length() == DIGITS) {
+            offset = 0;
+        } else {
+            return null;
+        }
+        long digits = parseDigits(identifier, offset);
+        if (digits < 0) return null;
+        int index = indexOf(digits);
+        if (index < 0) return null;
+        long entry = entries[index];
+        if (offset == GB_IBAN_DIGITS_OFFSET) {
+            String bank = bankCodes[(int) ((entry >>> ID_BITS) & ID_MASK)];
+            for (int i = 0; i < bank.length(); i++) {
+                if (identifier.charAt(GB_IBAN_BANK_OFFSET + i) != bank.charAt(i)) return null;
+            }
+            if (!ModulusCheckEngine.isValidIban(identifier)) return null;
+        }
+        hits.increment();
+        return outcomes[(int) (entry & ID_MASK)];
+    }
+
+    /**
+     * @return number of accounts
+     */
+    public int size() {
+        return entries.length;
+    }
+
+    /**
+     * @return number of requests answered from the index
+     */
+    public long hits() {
+        return hits.sum();
+    }
+
+    private int indexOf(long digits) {
+        int lo = 0;
+        int hi = entries.length - 1;
+        while (lo <= hi) {
+            int mid = (lo + hi) >>> 1;
+            long key = entries[mid] >>> (2 * ID_BITS);
+            if (key < digits) {
+                lo = mid + 1;
+            } else if (key > digits) {
+                hi = mid - 1;
+            } else {
+                return mid;
+            }
+        }
+        return -1;
+    }
+
+    private static long parseDigits(CharSequence chars, int offset) {
+        long value = 0;
+        for (int i = offset; i < offset + DIGITS; i++) {
+            char c = chars.charAt(i);
+            if (c < '0' || c > '9') return -1;
+            value = value * 10 + (c - '0');
+        }
+        return value;
+    }
+
+    /**
+     * Collects accounts in any order into a growable {@code long[]} and sorts it on {@link #build()}.
+     */
+    public static final class Builder {
+        private final Map<String, Integer> bankDictionary = new LinkedHashMap<>();
+        private final Map<RuleOutcome, Integer> outcomeDictionary = new LinkedHashMap<>();
+        private long[] entries = new long[1024];
+        private int size;
+
+        private Builder() {
+        }
+
+        /**
+         * @param iban    a GB IBAN
+         * @param outcome the outcome returned for the account, in either form
+         * @return this builder
+         * @throws IllegalArgumentException if the IBAN is not a GB IBAN with 14 digits, or the index
+         *                                  would hold more than 256 bank codes or outcomes
+         */
+        public Builder add(String iban, RuleOutcome outcome) {
+            if (iban.length() != GB_IBAN_LENGTH || !iban.startsWith("GB")) {
+                throw new IllegalArgumentException("Not a GB IBAN: " + iban);
+            }
+            long digits = parseDigits(iban, GB_IBAN_DIGITS_OFFSET);
+            if (digits < 0) throw new IllegalArgumentException("Not a GB IBAN: " + iban);
+            long bankId = id(bankDictionary, iban.substring(GB_IBAN_BANK_OFFSET, GB_IBAN_DIGITS_OFFSET));
+            long outcomeId = id(outcomeDictionary, outcome);
+            if (size == entries.length) entries = Arrays.copyOf(entries, size * 2);
+            entries[size++] = digits << (2 * ID_BITS) | bankId << ID_BITS | outcomeId;
+            return this;
+        }
+
+        /**
+         * @return the index
+         * @throws IllegalArgumentException if an account appears twice
+         */
+        public AccountIndex build() {
+            long[] sorted = Arrays.copyOf(entries, size);
+            Arrays.parallelSort(sorted);
+            for (int i = 1; i < sorted.length; i++) {
+                if (sorted[i - 1] >>> (2 * ID_BITS) == sorted[i] >>> (2 * ID_BITS)) {
+                    throw new IllegalArgumentException("Duplicate account " + (sorted[i] >>> (2 * ID_BITS)));
+                }
+            }
+            return new AccountIndex(sorted, bankDictionary.keySet().toArray(new String[0]),
+                    outcomeDictionary.keySet().toArray(new RuleOutcome[0]));
+        }
+
+        private static <K> long id(Map<K, Integer> dictionary, K key) {
+            int id = dictionary.computeIfAbsent(key, k -> dictionary.size());
+            if (id >= MAX_IDS) throw new IllegalArgumentException("More than " + MAX_IDS + " distinct values: " + key);
+            return id;
+        }
+    }
+}
+
+
+---------------------------------------
+
+package com.rbs.bdd.infrastructure.config;
+
+import jakarta.xml.soap.MimeHeaders;
+import jakarta.xml.soap.SOAPException;
+import jakarta.xml.soap.SOAPMessage;
+import org.springframework.ws.soap.SoapMessageCreationException;
+import org.springframework.ws.soap.saaj.SaajSoapMessage;
+import org.springframework.ws.soap.saaj.SaajSoapMessageFactory;
+import org.springframework.ws.transport.TransportInputStream;
+
+import java.io.IOException;
+import java.io.InputStream;
+import java.io.PushbackInputStream;
+import java.util.Iterator;
+
+/**
+ * {@link SaajSoapMessageFactory} that enables lazy, StAX backed SOAP body parsing in the SAAJ reference
+ * implementation.
+ * <p>
+ * The SAAJ implementation reads {@code saaj.lazy.soap.body} when the envelope is first parsed, but
+ * {@link SaajSoapMessageFactory} only applies its message properties after it has parsed the envelope,
+ * so setting the property through {@code setMessageProperties} has no effect. This factory sets it on
+ * the message before the envelope is accessed; the body then stays unparsed until its payload is read.
+ * </p>
+ */
+public class LazySaajSoapMessageFactory extends SaajSoapMessageFactory {
+
+    /** SAAJ reference implementation property enabling lazy, StAX backed SOAP body parsing. */
+    public static final String SAAJ_LAZY_SOAP_BODY = "saaj.lazy.soap.body";
+
+    private static final byte[] UTF8_BOM = {(byte) 0xEF, (byte) 0xBB, (byte) 0xBF};
+
+    @Override
+    public SaajSoapMessage createWebServiceMessage(InputStream inputStream) throws IOException {
+        MimeHeaders mimeHeaders = mimeHeaders(inputStream);
+        try {
+            SOAPMessage saajMessage = getMessageFactory().createMessage(mimeHeaders, skipByteOrderMark(inputStream));
+            saajMessage.setProperty(SAAJ_LAZY_SOAP_BODY, Boolean.TRUE);
+            saajMessage.getSOAPPart().getEnvelope();
+            return new SaajSoapMessage(saajMessage, true, getMessageFactory());
+        } catch (SOAPException e) {
+            throw new SoapMessageCreationException("Could not create message from InputStream: " + e.getMessage(), e);
+        }
+    }
+
+    private static MimeHeaders mimeHeaders(InputStream inputStream) throws IOException {
+        MimeHeaders mimeHeaders = new MimeHeaders();
+        if (inputStream instanceof TransportInputStream transportInputStream) {
+            for (Iterator<String> names = transportInputStream.getHeaderNames(); names.hasNext(); ) {
+                String name = names.next();
+                for (Iterator<String> values = transportInputStream.getHeaders(name); values.hasNext(); ) {
+                    mimeHeaders.addHeader(name, values.next());
+                }
+            }
+        }
+        return mimeHeaders;
+    }
+
+    private static InputStream skipByteOrderMark(InputStream inputStream) throws IOException {
+        PushbackInputStream pushback = new PushbackInputStream(inputStream, UTF8_BOM.length);
+        byte[] start = new byte[UTF8_BOM.length];
+        int read = pushback.readNBytes(start, 0, start.length);
+        if (read != UTF8_BOM.length || start[0] != UTF8_BOM[0] || start[1] != UTF8_BOM[1] || start[2] != UTF8_BOM[2]) {
+            pushback.unread(start, 0, read);
+        }
+        return pushback;
+    }
+}
+
+
 ---------------------------------------
 
     Scenario:-